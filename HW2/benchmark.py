@@ -0,0 +1,326 @@
+#!/usr/bin/python3
+import getopt
+import math
+import sys
+import time
+import tracemalloc
+from array import array
+
+import planner
+from bitmap import Bitmap
+from intersect import gallop_merge, intersect, linear_merge, skip_merge
+from search import normalize, parse_query
+from utils import (MappedPosting, Posting, Skiplist, and_merge, decode_postings, encode_postings, not_merge,
+                   or_merge)
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+def load_raw_postings(dictionary, posting_file):
+    ''' read the raw bytes of every postings list, in postings file order '''
+    raw = dict()
+    for key, val in sorted(dictionary.items(), key=lambda item: item[1].offset):
+        posting_file.seek(val.offset)
+        raw[key] = posting_file.read(val.size)
+    return raw
+
+
+def bench_postings(dictionary, posting_file):
+    '''
+    compare the pickled postings format with the compressed one of index.py -c:
+    bytes per posting, and decode throughput (postings per second)
+    '''
+    raw = load_raw_postings(dictionary, posting_file)
+    num_postings = sum(val.frequency for val in dictionary.values())
+
+    postings = Posting(dictionary, posting_file)
+    start = time.perf_counter()
+    lists = {key: postings.decode(buf) for key, buf in raw.items()}
+    pickle_time = time.perf_counter() - start
+
+    compressed = {key: encode_postings(skiplist.list, skiplist.skips)
+                  for key, skiplist in lists.items()}
+
+    start = time.perf_counter()
+    for buf in compressed.values():
+        Skiplist(*decode_postings(buf))
+    vb_time = time.perf_counter() - start
+
+    pickle_size = sum(len(buf) for buf in raw.values())
+    vb_size = sum(len(buf) for buf in compressed.values())
+    print("terms: %d, postings: %d" % (len(raw), num_postings))
+    print("pickle:      %9d bytes, %.2f bytes/posting, %.0f postings/s" %
+          (pickle_size, pickle_size / num_postings, num_postings / pickle_time))
+    print("vb + skips:  %9d bytes, %.2f bytes/posting, %.0f postings/s" %
+          (vb_size, vb_size / num_postings, num_postings / vb_time))
+
+
+def bench_mapped(dictionary, posting_file):
+    ''' look up every term twice through Posting (seek + read) and MappedPosting (mmap) '''
+    for name, postings in (("read", Posting(dictionary, posting_file)),
+                           ("mmap", MappedPosting(dictionary, posting_file))):
+        start = time.perf_counter()
+        for _ in range(2):
+            for term in dictionary:
+                postings[term]
+        elapsed = time.perf_counter() - start
+        print("%s: %.0f lookups/s" % (name, 2 * len(dictionary) / elapsed))
+
+
+class LegacySkiplist(object):
+    ''' the Skiplist of earlier versions, reading "id:skip" strings while merging '''
+
+    def __init__(self, loaded_list):
+        self.loaded_list = loaded_list
+        self.frequency = len(loaded_list)
+        self.step = int(math.floor(math.sqrt(self.frequency)))
+        self.cursor = 0
+
+    def __iter__(self):
+        self.cursor = 0
+        return self
+
+    def __next__(self, compare_id=None):
+        if self.cursor >= self.frequency:
+            raise StopIteration
+        doc_id = self.loaded_list[self.cursor]
+        if isinstance(doc_id, str):
+            temp_id = int(doc_id.split(":")[1])
+            doc_id = int(doc_id.split(":")[0])
+            if (self.frequency > 9) and compare_id:
+                if temp_id <= compare_id:
+                    self.cursor += self.step
+                    doc_id = temp_id
+        self.cursor += 1
+        return doc_id
+
+
+def legacy_and_merge(l1, l2):
+    ''' the and_merge of earlier versions, on LegacySkiplists '''
+    out = []
+    i1, i2 = iter(l1), iter(l2)
+    try:
+        e1, e2 = next(i1, False), next(i2, False)
+        while e1 and e2:
+            if e1 == e2:
+                out.append(e1)
+                e1, e2 = next(i1, False), next(i2, False)
+            elif e1 < e2:
+                e1 = i1.__next__(e2)
+            else:
+                e2 = i2.__next__(e1)
+    except StopIteration:
+        pass
+    return LegacySkiplist(out)
+
+
+def to_legacy(skiplist):
+    ''' write the skip pointers of a Skiplist back as "id:skip" strings '''
+    loaded = list(skiplist.list)
+    for k, target in enumerate(skiplist.skips):
+        cursor = k * skiplist.step
+        loaded[cursor] = str(loaded[cursor]) + ":" + str(skiplist.list[target])
+    return loaded
+
+
+def bench_and_merge(dictionary, posting_file):
+    ''' AND-merge throughput of the array Skiplist against the "id:skip" string one '''
+    postings = Posting(dictionary, posting_file)
+    pairs = [("said", "__all__"), ("said", "the"), ("bahia", "said"), ("cocoa", "the")]
+    for t1, t2 in pairs:
+        l1, l2 = postings[t1], postings[t2]
+        if not l1.frequency or not l2.frequency:
+            continue
+        legacy1, legacy2 = to_legacy(l1), to_legacy(l2)
+        rounds = 20
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            result = and_merge(l1, l2)
+        array_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            legacy_result = legacy_and_merge(
+                LegacySkiplist(legacy1), LegacySkiplist(legacy2))
+        legacy_time = time.perf_counter() - start
+
+        assert list(result.list) == legacy_result.loaded_list
+        print("%s (%d) AND %s (%d): strings %.0f merges/s, arrays %.0f merges/s" %
+              (t1, l1.frequency, t2, l2.frequency, rounds / legacy_time, rounds / array_time))
+
+
+def bench_intersect(dictionary, posting_file):
+    ''' time each merge of intersect.py, and the adaptive choice, on pairs of rare / common terms '''
+    postings = Posting(dictionary, posting_file)
+    pairs = [("said", "the"), ("cocoa", "said"), ("bahia", "the"), ("bahia", "__all__")]
+    merges = [
+        ("linear", lambda l1, l2: linear_merge(l1.list, l2.list)),
+        ("skips", lambda l1, l2: skip_merge(l1.list, l2.list, l1.skips, l2.skips)),
+        ("gallop", lambda l1, l2: gallop_merge(l1.list, l2.list)),
+        ("adaptive", lambda l1, l2: intersect(l1.list, l2.list, l1.skips, l2.skips)),
+    ]
+    for t1, t2 in pairs:
+        l1, l2 = postings[t1], postings[t2]
+        if not l1.frequency or not l2.frequency:
+            continue
+        timings = []
+        for name, merge in merges:
+            rounds = 50
+            start = time.perf_counter()
+            for _ in range(rounds):
+                merge(l1, l2)
+            timings.append("%s %.1fus" % (
+                name, (time.perf_counter() - start) / rounds * 1e6))
+        print("%s (%d) AND %s (%d): %s" %
+              (t1, l1.frequency, t2, l2.frequency, ", ".join(timings)))
+
+
+def bench_bitmap(dictionary, posting_file):
+    ''' NOT, AND and OR of dense terms on Skiplists against bitmaps (index.py -b) '''
+    postings = Posting(dictionary, posting_file)
+    skiplists = {term: postings[term] for term in ("__all__", "said", "the", "bahia")}
+    bitmaps = {term: Bitmap.from_list(skiplist.list) for term, skiplist in skiplists.items()}
+    queries = [
+        ("NOT said", lambda get: not_merge(get("said"), get("__all__"))),
+        ("NOT bahia", lambda get: not_merge(get("bahia"), get("__all__"))),
+        ("said AND the", lambda get: and_merge(get("said"), get("the"))),
+        ("said OR the", lambda get: or_merge(get("said"), get("the"))),
+        ("bahia AND the", lambda get: and_merge(get("bahia"), get("the"))),
+    ]
+    for name, query in queries:
+        timings = []
+        results = []
+        for kind, lists in (("skiplist", skiplists), ("bitmap", bitmaps)):
+            rounds = 20
+            start = time.perf_counter()
+            for _ in range(rounds):
+                result = query(lists.get)
+            timings.append("%s %.1fus" % (
+                kind, (time.perf_counter() - start) / rounds * 1e6))
+            results.append(list(result.list))
+        assert results[0] == results[1]
+        print("%s (%d): %s" % (name, len(results[0]), ", ".join(timings)))
+
+
+def bench_fetch(dictionary, posting_file):
+    ''' reads and latency of loading a query's postings lists one by one against fetch_many '''
+    terms = sorted(dictionary, key=lambda term: dictionary[term].offset)
+    for count in (5, 20, 100):
+        # terms spread over the postings file, as in a query
+        query = terms[::max(1, len(terms) // count)][:count]
+        timings = []
+        for name, load in (("one by one", lambda postings: [postings[term] for term in query]),
+                           ("fetch_many", lambda postings: list(postings.fetch_many(query)))):
+            postings = Posting(dictionary, posting_file)
+            rounds = 20
+            start = time.perf_counter()
+            for _ in range(rounds):
+                load(postings)
+            timings.append("%s %d reads %.1fus" % (
+                name, postings.reads // rounds, (time.perf_counter() - start) / rounds * 1e6))
+        print("%d terms: %s" % (len(query), ", ".join(timings)))
+
+
+def eager_not_merge(l1, l2):
+    ''' NOT of earlier versions: build the Skiplist of every doc ID not in l1 '''
+    return Skiplist(array('i', not_merge(l1, l2)))
+
+
+def bench_not(dictionary, posting_file):
+    '''
+    peak memory (tracemalloc) and latency of NOT queries, parsed, compiled
+    and written out as search.py does, with lazy Complements against built
+    NOT lists
+    '''
+    postings = Posting(dictionary, posting_file)
+    file_list = postings['__all__']
+    queries = ["NOT said", "NOT bahia", "NOT bahia AND cocoa", "NOT bahia AND NOT cocoa",
+               "NOT (said AND NOT the)"]
+    lazy_not_merge = planner.not_merge
+
+    def plan(query):
+        return planner.compile_query(parse_query(query), postings, normalize)
+
+    def run(query):
+        return " ".join(map(str, plan(query).eval(postings, file_list)))
+
+    for query in queries:
+        stats = []
+        outputs = []
+        for kind, merge in (("built", eager_not_merge), ("lazy", lazy_not_merge)):
+            planner.not_merge = merge
+            # peak while evaluating the plan, then while also writing the result out
+            tracemalloc.start()
+            result = plan(query).eval(postings, file_list)
+            eval_peak = tracemalloc.get_traced_memory()[1]
+            outputs.append(" ".join(map(str, result)))
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            del result
+            rounds = 20
+            start = time.perf_counter()
+            for _ in range(rounds):
+                run(query)
+            stats.append("%s %.1fus, peak %.1f kB (eval %.1f kB)" % (
+                kind, (time.perf_counter() - start) / rounds * 1e6,
+                peak / 1024, eval_peak / 1024))
+        planner.not_merge = lazy_not_merge
+        assert outputs[0] == outputs[1]
+        print("%s (%d): %s" % (query, len(outputs[1].split()), ", ".join(stats)))
+
+
+BENCHMARKS = {
+    'postings': bench_postings,
+    'mapped': bench_mapped,
+    'and_merge': bench_and_merge,
+    'intersect': bench_intersect,
+    'bitmap': bench_bitmap,
+    'not': bench_not,
+    'fetch': bench_fetch,
+}
+
+
+def run_benchmark(dict_file, postings_file, names):
+    with open(dict_file, mode="rb") as dictionary_file,\
+            open(postings_file, mode="rb") as posting_file:
+        dictionary = pickle.load(dictionary_file)
+        for name in names:
+            print("== " + name + " ==")
+            BENCHMARKS[name](dictionary, posting_file)
+
+
+def usage():
+    # test on my PC: $python3 benchmark.py -d dictionary.txt -p postings.txt -b postings
+    print("usage: " +
+          sys.argv[0] + " -d dictionary-file -p postings-file [-b benchmark]")
+    print("benchmarks: " + ", ".join(BENCHMARKS))
+
+
+dictionary_file = postings_file = None
+benchmarks = list(BENCHMARKS)
+
+try:
+    opts, args = getopt.getopt(sys.argv[1:], 'd:p:b:')
+except getopt.GetoptError:
+    usage()
+    sys.exit(2)
+
+for o, a in opts:
+    if o == '-d':
+        dictionary_file = a
+    elif o == '-p':
+        postings_file = a
+    elif o == '-b':
+        benchmarks = a.split(",")
+    else:
+        assert False, "unhandled option"
+
+if dictionary_file == None or postings_file == None or any(b not in BENCHMARKS for b in benchmarks):
+    usage()
+    sys.exit(2)
+
+run_benchmark(dictionary_file, postings_file, benchmarks)
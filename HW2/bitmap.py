@@ -0,0 +1,207 @@
+'''
+Compressed bitmaps for dense postings lists, in the style of Roaring bitmaps.
+
+The doc IDs are split by their high 16 bits into containers of 2^16 doc IDs:
+    - array container  := array('H') of the sorted low 16 bits, as long as
+                          the container holds at most ARRAY_MAX doc IDs
+    - bitmap container := a Python int of 2^16 bits, so that & | and "and not"
+                          of two containers run word-parallel inside the int
+On disk (Bitmap.to_bytes) a bitmap is an array('i') header
+    number of containers, then (high, kind, size) of every container
+followed by the payloads, with kind 0 for array containers (size doc IDs
+of 2 bytes) and 1 for bitmap containers (size bytes of little-endian bits).
+'''
+from array import array
+
+CONTAINER_BITS = 16
+CONTAINER_SIZE = 1 << CONTAINER_BITS
+ARRAY_MAX = 4096  # above: bitmap container (both are 8 kB at 4096 doc IDs)
+DENSE_RATIO = 1 / 16  # postings lists holding at least this share of the docs are bitmaps
+
+def popcount(bits):
+    return bin(bits).count("1")
+
+
+def to_bits(lows):
+    ''' bitmap container (int) of an array container '''
+    bits = bytearray(CONTAINER_SIZE // 8)
+    for low in lows:
+        bits[low >> 3] |= 1 << (low & 7)
+    return int.from_bytes(bits, "little")
+
+
+def to_lows(bits):
+    ''' sorted array container of a bitmap container (int) '''
+    lows = array('H')
+    digits = bin(bits)[:1:-1]  # bit i is digits[i]
+    low = digits.find("1")
+    while low >= 0:
+        lows.append(low)
+        low = digits.find("1", low + 1)
+    return lows
+
+
+def shrink(bits):
+    ''' store the result of an operation on bitmap containers in the smallest container '''
+    if popcount(bits) <= ARRAY_MAX:
+        return to_lows(bits)
+    return bits
+
+
+class Bitmap(object):
+    ''' a postings list of doc IDs stored as Roaring-style containers '''
+
+    def __init__(self, containers=None):
+        # high 16 bits -> array('H') container or int bitmap container
+        self.containers = containers if containers is not None else dict()
+        self.frequency = sum(len(c) if isinstance(c, array) else popcount(c)
+                             for c in self.containers.values())
+
+    @classmethod
+    def from_list(cls, doc_ids):
+        ''' build the bitmap of a sorted list of doc IDs '''
+        containers = dict()
+        for doc_id in doc_ids:
+            high = doc_id >> CONTAINER_BITS
+            if high not in containers:
+                containers[high] = array('H')
+            containers[high].append(doc_id & (CONTAINER_SIZE - 1))
+        for high, lows in containers.items():
+            if len(lows) > ARRAY_MAX:
+                containers[high] = to_bits(lows)
+        return cls(containers)
+
+    @property
+    def list(self):
+        ''' the sorted doc IDs '''
+        doc_ids = array('i')
+        for high in sorted(self.containers):
+            container = self.containers[high]
+            lows = container if isinstance(container, array) else to_lows(container)
+            base = high << CONTAINER_BITS
+            doc_ids.extend([base + low for low in lows])
+        return doc_ids
+
+    def __iter__(self):
+        ''' the sorted doc IDs, decoded one container at a time '''
+        for high in sorted(self.containers):
+            container = self.containers[high]
+            lows = container if isinstance(container, array) else to_lows(container)
+            base = high << CONTAINER_BITS
+            for low in lows:
+                yield base + low
+
+    def get_length(self):
+        return self.frequency
+
+    def filter(self, doc_ids, keep=True):
+        ''' the doc IDs of a sorted list that are (keep) or are not (not keep) in the bitmap '''
+        out = []
+        lookups = dict()
+        for doc_id in doc_ids:
+            high = doc_id >> CONTAINER_BITS
+            if high not in lookups:
+                container = self.containers.get(high)
+                if container is None:
+                    lookups[high] = None
+                elif isinstance(container, array):
+                    lookups[high] = set(container)
+                else:
+                    lookups[high] = container.to_bytes(CONTAINER_SIZE // 8, "little")
+            lookup = lookups[high]
+            low = doc_id & (CONTAINER_SIZE - 1)
+            if lookup is None:
+                found = False
+            elif isinstance(lookup, set):
+                found = low in lookup
+            else:
+                found = lookup[low >> 3] >> (low & 7) & 1
+            if bool(found) == keep:
+                out.append(doc_id)
+        return out
+
+    def __and__(self, other):
+        containers = dict()
+        for high in self.containers.keys() & other.containers.keys():
+            a, b = self.containers[high], other.containers[high]
+            if isinstance(a, array) and isinstance(b, array):
+                common = set(b)
+                lows = array('H', [low for low in a if low in common])
+            elif isinstance(a, array) or isinstance(b, array):
+                lows, bits = (a, b) if isinstance(a, array) else (b, a)
+                bits = bits.to_bytes(CONTAINER_SIZE // 8, "little")
+                lows = array('H', [low for low in lows if bits[low >> 3] >> (low & 7) & 1])
+            else:
+                lows = shrink(a & b)
+            if len(lows) if isinstance(lows, array) else lows:
+                containers[high] = lows
+        return Bitmap(containers)
+
+    def __or__(self, other):
+        containers = dict(self.containers)
+        for high, b in other.containers.items():
+            a = containers.get(high)
+            if a is None:
+                containers[high] = b
+                continue
+            if isinstance(a, array) and isinstance(b, array) and len(a) + len(b) <= ARRAY_MAX:
+                containers[high] = array('H', sorted(set(a) | set(b)))
+            else:
+                a = a if isinstance(a, int) else to_bits(a)
+                b = b if isinstance(b, int) else to_bits(b)
+                containers[high] = shrink(a | b)
+        return Bitmap(containers)
+
+    def __sub__(self, other):
+        ''' and not '''
+        containers = dict()
+        for high, a in self.containers.items():
+            b = other.containers.get(high)
+            if b is None:
+                containers[high] = a
+                continue
+            if isinstance(a, array):
+                lows = array('H', Bitmap({0: b}).filter(a, keep=False))
+            else:
+                b = b if isinstance(b, int) else to_bits(b)
+                lows = shrink(a & ~b)
+            if len(lows) if isinstance(lows, array) else lows:
+                containers[high] = lows
+        return Bitmap(containers)
+
+    def to_bytes(self):
+        header = array('i', [len(self.containers)])
+        payloads = []
+        for high in sorted(self.containers):
+            container = self.containers[high]
+            if isinstance(container, array):
+                header.extend([high, 0, len(container)])
+                payloads.append(container.tobytes())
+            else:
+                header.extend([high, 1, CONTAINER_SIZE // 8])
+                payloads.append(container.to_bytes(CONTAINER_SIZE // 8, "little"))
+        return header.tobytes() + b"".join(payloads)
+
+    @classmethod
+    def from_bytes(cls, buf, start=0):
+        header = array('i')
+        header.frombytes(buf[start:start + header.itemsize])
+        count = header[0]
+        header.frombytes(buf[start + header.itemsize:start + (1 + 3 * count) * header.itemsize])
+        pos = start + len(header) * header.itemsize
+        containers = dict()
+        for i in range(count):
+            high, kind, size = header[1 + 3 * i:4 + 3 * i]
+            if kind == 0:
+                lows = array('H')
+                lows.frombytes(buf[pos:pos + size * lows.itemsize])
+                pos += size * lows.itemsize
+                containers[high] = lows
+            else:
+                containers[high] = int.from_bytes(buf[pos:pos + size], "little")
+                pos += size
+        return cls(containers)
+
+    def __reduce__(self):
+        # pickled as its compact binary form
+        return (Bitmap.from_bytes, (self.to_bytes(),))
@@ -1618,7 +1618,7 @@ class OR(DualBase):
         return tmp
 
     def merge(self, l1, l2):
-        if l2.loaded_list == []: 
+        if l2.frequency == 0:
             return l1
         i1, i2 = iter(l1), iter(l2)
         
@@ -0,0 +1,139 @@
+'''
+Bounded LRU cache of query results for search.py.
+
+Results are keyed on canonical forms, so that logically equivalent queries
+and shared subtrees reuse earlier merges:
+    - a whole query by its simplified boolean.py Expression, which is
+      hashable and has its operands sorted (b & a and a & b are equal)
+    - a sub-expression by the key of its plan node (see planner.PlanNode.key),
+      an order-free tuple of the keys of its operands
+The cache is bounded by the estimated size in bytes of the cached postings
+lists (see result_size), evicting the least recently used results first.
+
+SharedResults is the memo of a batch of queries (search.py -b): the plans of
+all queries are added first, making a DAG in which every distinct key (term
+or sub-expression) is a single node. Each node is then evaluated once, and its
+result is dropped after its last use in the DAG.
+'''
+from collections import Counter, OrderedDict
+
+from bitmap import CONTAINER_SIZE, Bitmap
+from utils import Complement
+
+
+def result_size(result):
+    ''' estimated size in bytes of a postings list (Skiplist, Bitmap or Complement) '''
+    if isinstance(result, Complement):
+        return result_size(result.excluded)  # the universe is shared by all NOTs
+    if isinstance(result, Bitmap):
+        return sum(len(c) * c.itemsize if not isinstance(c, int) else CONTAINER_SIZE // 8
+                   for c in result.containers.values())
+    return len(result.list) * result.list.itemsize + len(result.skips) * result.skips.itemsize
+
+
+class ResultCache(object):
+    ''' LRU cache of postings lists, bounded by their total size in bytes '''
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.results = OrderedDict()  # key -> (result, size), least recently used first
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        return key in self.results
+
+    def get(self, key):
+        ''' Return the cached result of a key, or None '''
+        if key in self.results:
+            self.results.move_to_end(key)
+            self.hits += 1
+            return self.results[key][0]
+        self.misses += 1
+        return None
+
+    def put(self, key, result):
+        ''' cache a result, evicting the least recently used ones beyond max_bytes '''
+        size = result_size(result)
+        if size > self.max_bytes:
+            return
+        if key in self.results:
+            self.bytes -= self.results.pop(key)[1]
+        self.results[key] = (result, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, evicted) = self.results.popitem(last=False)
+            self.bytes -= evicted
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return "result cache: %d hits, %d misses (%.1f%% hit rate), %d evictions, %d results in %d / %d bytes" % (
+            self.hits, self.misses, 100 * self.hits / lookups if lookups else 0,
+            self.evictions, len(self.results), self.bytes, self.max_bytes)
+
+
+class SharedResults(object):
+    ''' results of the distinct terms and sub-expressions of a batch of plans, each evaluated once '''
+
+    def __init__(self):
+        self.uses = Counter()  # key -> evaluations of the key left in the DAG
+        self.results = dict()  # key -> result, until its last use
+        self.linked = set()  # keys of the DAG nodes
+        self.queries = 0
+        self.nodes = 0  # nodes of the plans, as trees
+        self.lookups = 0  # term lookups of the plans, as trees
+        self.terms = 0  # distinct terms, loaded once
+        self.evaluated = 0
+        self.reused = 0
+
+    def add_plan(self, plan):
+        ''' add the plan of a query to the DAG '''
+        self.queries += 1
+        self.uses[plan.key] += 1
+        self.count(plan)
+        self.link(plan)
+
+    def count(self, node):
+        self.nodes += 1
+        if not node.inputs():
+            self.lookups += 1
+        for child in node.inputs():
+            self.count(child)
+
+    def link(self, node):
+        ''' add a node to the DAG, if no node of the same key is already in it '''
+        if node.key in self.linked:
+            return
+        self.linked.add(node.key)
+        if not node.inputs():
+            self.terms += 1
+        for child in node.inputs():
+            self.uses[child.key] += 1
+            self.link(child)
+
+    def __contains__(self, key):
+        return key in self.results
+
+    def get(self, key):
+        ''' Return the result of a key evaluated earlier, or None, dropping it at its last use '''
+        self.uses[key] -= 1
+        if key not in self.results:
+            return None
+        self.reused += 1
+        if self.uses[key] > 0:
+            return self.results[key]
+        return self.results.pop(key)
+
+    def put(self, key, result):
+        self.evaluated += 1
+        if self.uses[key] > 0:
+            self.results[key] = result
+
+    def stats(self):
+        return ("batch: %d queries, %d plan nodes shared as %d DAG nodes (%d evaluated, %d results reused), "
+                "%d term lookups loading %d postings lists" % (
+                    self.queries, self.nodes, len(self.linked), self.evaluated, self.reused,
+                    self.lookups, self.terms))
@@ -0,0 +1,84 @@
+#!/usr/bin/python3
+import getopt
+import sys
+
+from bitmap import DENSE_RATIO, Bitmap
+from utils import BITMAP_MARKER, Entry, Posting, encode_postings
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+def convert_index(in_dict, in_postings, out_dict, out_postings, bitmaps=False):
+    """
+    convert a dictionary and postings file written by index.py (pickled
+    doc ID and skip arrays, or lists with "id:skip" strings from older
+    versions) to the compressed format of index.py -c (-c -b with bitmaps)
+    """
+    print('converting...')
+
+    with open(in_dict, mode="rb") as dictionary_file:
+        dictionary = pickle.load(dictionary_file)
+
+    # write postings file, keeping the order of the original postings file
+    new_dictionary = dict()
+    with open(in_postings, mode="rb") as posting_file,\
+            open(out_postings, mode="wb") as postings_file:
+        postings = Posting(dictionary, posting_file)
+        num_of_doc = dictionary['__all__'].frequency
+        for key, val in sorted(dictionary.items(), key=lambda item: item[1].offset):
+            skiplist = postings[key]
+            offset = postings_file.tell()
+            if bitmaps and val.frequency >= DENSE_RATIO * num_of_doc:
+                bitmap = Bitmap.from_list(skiplist.list)
+                size = postings_file.write(BITMAP_MARKER + bitmap.to_bytes())
+            else:
+                size = postings_file.write(
+                    encode_postings(skiplist.list, skiplist.skips))
+            new_dictionary[key] = Entry(val.frequency, offset, size)
+
+    # write dictionary file
+    with open(out_dict, mode="wb") as dictionary_file:
+        pickle.dump(new_dictionary, dictionary_file)
+
+
+def usage():
+    # command tested on PC:
+    # $ python3 convert.py -d dictionary.txt -p postings.txt -D dictionary.vb.txt -P postings.vb.txt
+    print("usage: " +
+          sys.argv[0] + " -d dictionary-file -p postings-file -D compressed-dictionary-file -P compressed-postings-file [-b]")
+    print("tips:\n"
+          "  -b  write dense postings lists as bitmaps\n")
+
+
+input_dictionary = input_postings = output_dictionary = output_postings = None
+bitmaps = False
+
+try:
+    opts, args = getopt.getopt(sys.argv[1:], 'd:p:D:P:b')
+except getopt.GetoptError:
+    usage()
+    sys.exit(2)
+
+for o, a in opts:
+    if o == '-d':  # dictionary file
+        input_dictionary = a
+    elif o == '-p':  # postings file
+        input_postings = a
+    elif o == '-D':  # compressed dictionary file
+        output_dictionary = a
+    elif o == '-P':  # compressed postings file
+        output_postings = a
+    elif o == '-b':  # bitmaps for dense postings
+        bitmaps = True
+    else:
+        assert False, "unhandled option"
+
+if input_dictionary == None or input_postings == None or output_dictionary == None or output_postings == None:
+    usage()
+    sys.exit(2)
+
+convert_index(input_dictionary, input_postings,
+              output_dictionary, output_postings, bitmaps)
@@ -1,24 +1,39 @@
 #!/usr/bin/python3
 import getopt
-import math
 import re
 import string
 import sys
+from array import array
 from collections import defaultdict
+from itertools import chain
+from multiprocessing import Pool
 
 import nltk
-from nltk.corpus import PlaintextCorpusReader, stopwords
-from nltk.stem import PorterStemmer
-from nltk.stem.wordnet import WordNetLemmatizer
+from nltk.corpus import PlaintextCorpusReader
 from nltk.tokenize import RegexpTokenizer, sent_tokenize, word_tokenize
 
-from utils import Entry
+from bitmap import DENSE_RATIO, Bitmap
+from kgram import KgramIndex
+from normalizer import get_normalizer, load_tables, save_tables, stats
+from spimi import SpimiBlocks
+from termdict import write_dictionary
+from utils import BITMAP_MARKER, Entry, encode_postings, shard_path, shard_ranges, skip_targets
 
 try:
     import cPickle as pickle
 except ImportError:
     import pickle
 
+compressed = False  # write gap + variable-byte compressed postings
+bitmaps = False  # write dense postings lists as bitmaps
+memory_budget = 0  # MB of postings kept in memory before flushing a SPIMI block, 0 for no limit
+workers = 1  # processes analysing the documents
+shards = 1  # indexes written, each for a range of doc IDs
+front_coded = False  # write the dictionary as a sorted front-coded term dictionary (termdict.py)
+kgram_file = None  # file of the k-gram index of the terms, for wildcard queries
+table_file = None  # file of the normalization tables, read before and written after the build
+corpus = None  # corpus reader of the process (set by open_corpus)
+
 
 def preprocess(text):
     ''' split conjunctions; remove punctuations, digits; case-folding all words '''
@@ -52,49 +67,38 @@ def tokenize(paragraph):
 
 def stemming(words, stem=True, stopword=False, lemma=False):
     ''' do stemming, ( stopword removal, lemmatization)'''
-    ps = PorterStemmer()
+    normalize = get_normalizer(stopword, lemma)  # memoised, shared by the whole process
     stemmed_tokens = set()  # multiple term entries in a single document are merged
     for w in words:
-
-        if not stopword:
-            stop_words = set()
-        else:  # stopword removal
-            stop_words = set(stopwords.words("english"))
-
-        if w not in stop_words:
-            # stemming
-            if not lemma:
-                token = ps.stem(w)
-            else:
-                # lemmatization
-                lem = WordNetLemmatizer()
-                token = ps.stem(lem.lemmatize(w, "v"))
+        token = normalize(w)
+        if token is not None:  # not a stop word
             stemmed_tokens.add(token)
 
     return stemmed_tokens
 
 
-def apply_skippointer(postings):
-    ''' insert evenly placed skip pointers in long postings '''
+def apply_skippointer(postings, skip=True):
+    '''
+    insert evenly placed skip pointers in long postings, return the sorted
+    doc IDs and the indices the skip pointers jump to, as two integer arrays
+    '''
+    doc_ids = array('i', sorted(postings))
+    if not skip:
+        return doc_ids, array('i')
+    return doc_ids, skip_targets(len(doc_ids))
 
-    postings_with_pointer = list(postings)
-    postings_with_pointer.sort()
-    postings_length = len(postings_with_pointer)
 
-    # for postings with relatively short length(<9), do nothing
-    if postings_length > 9:
-        cursor = 0
-        skip_distance = int(math.floor(math.sqrt(postings_length)))
-        while cursor < postings_length:
-            if (cursor+skip_distance) >= postings_length:  # add next position the pointer points to
-                postings_with_pointer[cursor] = str(
-                    postings_with_pointer[cursor]) + ":" + str(postings_with_pointer[-1])
-            else:
-                postings_with_pointer[cursor] = str(
-                    postings_with_pointer[cursor]) + ":" + str(postings_with_pointer[cursor+skip_distance])
-            cursor += skip_distance
+def open_corpus(in_dir):
+    ''' open the corpus in this process, also run by every worker process '''
+    global corpus
+    corpus = PlaintextCorpusReader(in_dir, '.*')
+
 
-    return postings_with_pointer
+def analyse(fn):
+    ''' return the stemmed tokens of a document, sorted so that every process yields the same order '''
+    content = corpus.raw(str(fn))  # read file content
+    words = tokenize(content)  # tokenization: content -> words
+    return sorted(stemming(words))  # stemming, singularize
 
 
 def build_index(in_dir, out_dict, out_postings):
@@ -105,21 +109,58 @@ def build_index(in_dir, out_dict, out_postings):
     print('indexing...')
 
     ''' head into reuters training data directory '''
-    corpus = PlaintextCorpusReader(in_dir, '.*')
+    open_corpus(in_dir)
     file_names_str = corpus.fileids()  # get list of documents
     file_names = sorted(map(int, file_names_str))
 
+    if workers > 1:
+        # analyse the documents in a pool, getting their tokens back in doc ID order
+        pool = Pool(workers, initializer=open_corpus, initargs=(in_dir,))
+        documents = pool.imap(analyse, file_names,
+                              chunksize=max(1, len(file_names) // (workers * 16)))
+    else:
+        documents = map(analyse, file_names)
+
+    if shards > 1:
+        # document-partitioned shards: each indexes a range of doc IDs, with its own __all__
+        for k, shard_names in enumerate(shard_ranges(file_names, shards)):
+            write_index(shard_names, documents, shard_path(out_dict, k), shard_path(out_postings, k),
+                        shard_path(kgram_file, k) if kgram_file else None)
+    else:
+        write_index(file_names, documents, out_dict, out_postings, kgram_file)
+    if workers > 1:
+        pool.close()
+        pool.join()
+
+
+def write_index(file_names, documents, out_dict, out_postings, out_kgrams=None):
+    """
+    index the documents of file_names, taking their tokens from documents (in
+    the same order), then output the dictionary file and postings file (and
+    the k-gram index of the terms to out_kgrams, if any)
+    """
     ''' load corpus '''
-    postings = defaultdict(set)
-    postings['__all__'] = set(file_names)
-    tokens = list()
-    for fn in file_names:
-        content = corpus.raw(str(fn))  # read file content
-        words = tokenize(content)  # tokenization: content -> words
-        tokens = stemming(words)  # stemming, singularize
+    if memory_budget:
+        # SPIMI: flush sorted blocks of postings to temporary files over the budget
+        blocks = SpimiBlocks(memory_budget * 1024 * 1024, set)
+        postings = blocks.postings
+    else:
+        postings = defaultdict(set)
+        postings['__all__'] = set(file_names)
+    # zip() stops at the end of file_names, before taking the next document
+    for fn, tokens in zip(file_names, documents):
         ''' generate dictionary of (key -> token), (value -> set of document IDs) '''
         for token in tokens:
             postings[token].add(fn)  # add tokens to postings dict
+        if memory_budget:
+            blocks.charge(len(tokens))
+            postings = blocks.postings  # emptied by a flush
+
+    if memory_budget:
+        # k-way merge of the blocks, in term order
+        postings = chain([('__all__', set(file_names))], blocks.merge())
+    else:
+        postings = postings.items()
 
     ''' Output dictionary and postings files '''
     # Dictionary file stores all tokens, with their frequency, offset in the postings file, and size(in bytes)
@@ -128,7 +169,7 @@ def build_index(in_dir, out_dict, out_postings):
     # write postings file
     dictionary = dict()
     with open(out_postings, mode="wb") as postings_file:
-        for key, value in postings.items():
+        for key, value in postings:
             '''
             len(value) := the frequency of the token(i.e. key)
                         = how many times the token appears in all documents
@@ -137,45 +178,94 @@ def build_index(in_dir, out_dict, out_postings):
             '''
             offset = postings_file.tell()
             # implement evenly placed skip-pointers in the postings lists
-            if key == "__all__": 
-                size = postings_file.write(pickle.dumps(value))
+            doc_ids, skips = apply_skippointer(value, skip=(key != "__all__"))
+            if bitmaps and len(value) >= DENSE_RATIO * len(file_names):
+                # dense postings list, e.g. __all__: AND / OR / NOT become bitwise
+                bitmap = Bitmap.from_list(doc_ids)
+                if compressed:
+                    size = postings_file.write(BITMAP_MARKER + bitmap.to_bytes())
+                else:
+                    size = postings_file.write(pickle.dumps(bitmap))
+            elif compressed:
+                size = postings_file.write(encode_postings(doc_ids, skips))
             else:
-                value_updated = apply_skippointer(value)
-                size = postings_file.write(pickle.dumps(value_updated))
+                size = postings_file.write(pickle.dumps((doc_ids, skips)))
             dictionary[key] = Entry(len(value), offset, size)
 
     # write dictionary file
     with open(out_dict, mode="wb") as dictionary_file:
-        pickle.dump(dictionary, dictionary_file)
+        if front_coded:
+            write_dictionary(dictionary, dictionary_file)
+        else:
+            pickle.dump(dictionary, dictionary_file)
+
+    # write k-gram index of the terms
+    if out_kgrams:
+        with open(out_kgrams, mode="wb") as kgram_out:
+            KgramIndex(term for term in dictionary if term != '__all__').dump(kgram_out)
 
 
 def usage():
     # command tested on PC:
     # $ python3 index.py -i /Users/yu/nltk_data/corpora/reuters/training/ -d dictionary.txt -p postings.txt
     print("usage: " +
-          sys.argv[0] + " -i directory-of-documents -d dictionary-file -p postings-file")
-
-
-input_directory = output_file_dictionary = output_file_postings = None
-
-try:
-    opts, args = getopt.getopt(sys.argv[1:], 'i:d:p:')
-except getopt.GetoptError:
-    usage()
-    sys.exit(2)
-
-for o, a in opts:
-    if o == '-i':  # input directory
-        input_directory = a
-    elif o == '-d':  # dictionary file
-        output_file_dictionary = a
-    elif o == '-p':  # postings file
-        output_file_postings = a
-    else:
-        assert False, "unhandled option"
-
-if input_directory == None or output_file_postings == None or output_file_dictionary == None:
-    usage()
-    sys.exit(2)
-
-build_index(input_directory, output_file_dictionary, output_file_postings)
+          sys.argv[0] + " -i directory-of-documents -d dictionary-file -p postings-file [-c] [-b] [-f] [-k kgram-file] [-s memory-budget] [--workers N] [--shards N] [-t table-file]")
+    print("tips:\n"
+          "  -c  write compressed (gap + variable-byte) postings\n"
+          "  -b  write dense postings lists as bitmaps\n"
+          "  -f  write a sorted front-coded dictionary, memory-mapped by search.py\n"
+          "  -k  write the k-gram index of the terms to kgram-file, for the wildcard queries of search.py -k\n"
+          "  -s  build the index in SPIMI blocks of at most memory-budget MB of postings\n"
+          "  --workers  analyse the documents in N processes\n"
+          "  --shards  write N indexes, each for a range of doc IDs, to dictionary-file.k and postings-file.k\n"
+          "  -t  start from the normalization table of table-file, and save it there\n")
+
+
+# worker processes import this module: only run the command line in the main process
+if __name__ == "__main__":
+
+    input_directory = output_file_dictionary = output_file_postings = None
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'i:d:p:cbfk:s:t:', ['workers=', 'shards='])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-i':  # input directory
+            input_directory = a
+        elif o == '-d':  # dictionary file
+            output_file_dictionary = a
+        elif o == '-p':  # postings file
+            output_file_postings = a
+        elif o == '-c':  # compressed postings
+            compressed = True
+        elif o == '-b':  # bitmaps for dense postings
+            bitmaps = True
+        elif o == '-f':  # front-coded dictionary
+            front_coded = True
+        elif o == '-k':  # k-gram index
+            kgram_file = a
+        elif o == '-s':  # SPIMI memory budget (MB)
+            memory_budget = float(a)
+        elif o == '--workers':  # document analysis processes
+            workers = int(a)
+        elif o == '--shards':  # doc ID range shards
+            shards = int(a)
+        elif o == '-t':  # normalization table file
+            table_file = a
+        else:
+            assert False, "unhandled option"
+
+    if input_directory == None or output_file_postings == None or output_file_dictionary == None:
+        usage()
+        sys.exit(2)
+
+    if table_file:
+        load_tables(table_file)
+    build_index(input_directory, output_file_dictionary, output_file_postings)
+    if table_file:
+        save_tables(table_file)
+    for line in stats():
+        print(line)
@@ -0,0 +1,115 @@
+'''
+Wildcard terms (comput*, *ology, c*t*r) expanded with a character k-gram
+index of the terms of the dictionary.
+
+Every term is padded with BOUNDARY on both sides and indexed under each of
+its k-grams, e.g. for k = 3 "$comput$" -> $co, com, omp, mpu, put, ut$.
+The postings of a k-gram are the positions of its terms in the sorted list
+of terms. A wildcard pattern is split on '*' into its fixed pieces:
+    - the first piece (when the pattern does not start with '*') gives the
+      range of the terms starting with it, by binary search on the sorted terms
+    - the other pieces give their k-grams, the last one padded with BOUNDARY
+      when the pattern does not end with '*'
+The range and the postings of the k-grams are intersected, shortest first
+(intersect.intersect_many), and the candidates are checked against the
+pattern, as the k-grams do not keep their order (c*t*r would match "rtc").
+The work depends on the number of candidates, not on the size of the
+vocabulary; only a pattern without a prefix nor any piece of k characters
+(e.g. *a) scans all the terms.
+'''
+import re
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+
+from intersect import intersect_many
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+K = 3  # characters of a k-gram
+BOUNDARY = '$'  # start and end of a term
+WILDCARD = '*'
+
+
+def kgrams(text, k=K):
+    ''' Return the set of the k-grams of a string '''
+    return {text[i:i + k] for i in range(len(text) - k + 1)}
+
+
+class KgramIndex(object):
+    '''
+    k-gram index of a list of terms, for the expansion of wildcard patterns
+    '''
+
+    def __init__(self, terms, k=K):
+        self.k = k
+        self.terms = sorted(terms)
+        grams = defaultdict(lambda: array('i'))
+        for i, term in enumerate(self.terms):
+            for gram in kgrams(BOUNDARY + term + BOUNDARY, k):
+                grams[gram].append(i)  # in increasing order of i
+        self.grams = dict(grams)
+
+    def prefix_range(self, prefix):
+        ''' Return the range of the positions of the terms starting with prefix '''
+        start = bisect_left(self.terms, prefix)
+        # every term starting with prefix sorts before prefix + the last code point
+        end = bisect_left(self.terms, prefix + '\U0010ffff', start)
+        return range(start, end)
+
+    def match(self, pattern):
+        ''' Return the sorted terms matching a wildcard pattern '''
+        pieces = pattern.split(WILDCARD)
+        lists = []
+        if pieces[0]:
+            lists.append(self.prefix_range(pieces[0]))
+        grams = set()
+        for i, piece in enumerate(pieces[1:], 1):
+            if i == len(pieces) - 1:
+                piece += BOUNDARY
+            grams |= kgrams(piece, self.k)
+        for gram in grams:
+            postings = self.grams.get(gram)
+            if postings is None:  # no term has this k-gram
+                return []
+            lists.append(postings)
+
+        if lists:
+            candidates = intersect_many(lists)
+        else:  # no prefix nor piece of k characters
+            candidates = range(len(self.terms))
+        regex = re.compile(".*".join(map(re.escape, pieces)), re.DOTALL)
+        return [self.terms[i] for i in candidates if regex.fullmatch(self.terms[i])]
+
+    def expand(self, pattern, normalize=None):
+        '''
+        Return the terms matching a wildcard pattern. The terms of the
+        dictionary are normalized (stemmed): when the pattern ends with a
+        piece, the terms matching it with that piece normalized are added,
+        e.g. *ology also matches the terms ending with "olog".
+
+        @param pattern: str with WILDCARD characters, in lowercase
+        @param normalize: the normalization of the indexed terms, or None
+        @return sorted list of terms
+        '''
+        terms = self.match(pattern)
+        if normalize is not None and not pattern.endswith(WILDCARD):
+            head, _, last = pattern.rpartition(WILDCARD)
+            stem = normalize(last)
+            if stem and stem != last:
+                terms = sorted(set(terms).union(self.match(head + WILDCARD + stem)))
+        return terms
+
+    def dump(self, kgram_file):
+        ''' write the index to a file opened in binary mode '''
+        pickle.dump((self.k, self.terms, self.grams), kgram_file)
+
+    @classmethod
+    def load(cls, kgram_file):
+        ''' read an index written by dump '''
+        index = cls.__new__(cls)
+        index.k, index.terms, index.grams = pickle.load(kgram_file)
+        return index
@@ -0,0 +1,430 @@
+'''
+Cost-based query planner for Boolean queries.
+
+compile_query() compiles the simplified boolean.py Expression of a query
+(as parsed by search.py) directly into a tree of plan nodes, normalizing
+every Symbol once:
+    - associative chains of & and | are flattened into n-ary PlanAnd / PlanOr
+    - the operands of a PlanAnd are merged by increasing estimated cardinality
+      (document frequency from the dictionary Entry), and ~x operands are
+      merged last as "and not"
+    - a selective conjunction is pushed down into a large union
+      (a & (b | c) => (a & b) | (a & c), see PlanFilter) when it is cheaper,
+      so that the union is only built from small filtered lists
+    - a wildcard Symbol (comput*) becomes the PlanOr of the terms it matches
+      in the k-gram index (kgram.py)
+
+Estimates assume the terms occur independently. Costs count the doc IDs
+read and compared by the merges (galloping merges by the short list).
+
+A plan is either evaluated (eval) into a postings list, or streamed
+(stream) through the generator merges of utils, which yield its doc IDs one
+at a time and stop as soon as the consumer does (search.py -n).
+
+Every plan node has a canonical key (the same for a & b and b & a), under
+which its result is kept in the ResultCache given to compile_query, if any, or
+shared by the plans of a batch of queries (cache.SharedResults).
+'''
+from abc import ABCMeta, abstractmethod
+from math import log2
+
+import boolean
+from intersect import GALLOP_RATIO
+from utils import (Skiplist, and_merge, and_not_merge, and_not_stream, and_stream, doc_stream,
+                   not_merge, or_merge, or_stream)
+
+
+def intersect_cost(len1, len2):
+    ''' doc IDs compared by intersect() for lists of the given lengths '''
+    short, long = min(len1, len2), max(len1, len2)
+    if short == 0:
+        return 0
+    if long / short >= GALLOP_RATIO:
+        return short * log2(long / short + 1)
+    return short + long
+
+
+def union_cost(lengths):
+    ''' doc IDs compared by pairwise or_merge of lists of the given lengths '''
+    cost = 0
+    acc = 0
+    for length in sorted(lengths):
+        cost += acc + length if acc else 0
+        acc += length
+    return cost
+
+
+############################################
+###########      Plan nodes      ###########
+############################################
+class PlanNode(metaclass=ABCMeta):
+    ''' a node of a query plan, with its estimated cardinality and cost '''
+
+    estimate = 0
+    cost = 0
+    key = None    # canonical form of the sub-expression
+    cache = None  # ResultCache of the sub-expression results, set by compile_query
+
+    def eval(self, postings, file_list):
+        ''' evaluate the plan to the Skiplist of matching docs, or return it from the cache '''
+        if self.cache is None:
+            return self.run(postings, file_list)
+        result = self.cache.get(self.key)
+        if result is None:
+            result = self.run(postings, file_list)
+            self.cache.put(self.key, result)
+        return result
+
+    @abstractmethod
+    def run(self, postings, file_list):
+        ''' evaluate the plan, without the cache '''
+
+    def stream(self, postings, file_list):
+        ''' iterate the doc IDs of the plan in increasing order, from the cache or merged lazily '''
+        if self.cache is not None and self.key in self.cache:
+            return doc_stream(self.cache.get(self.key))
+        return self.run_stream(postings, file_list)
+
+    def run_stream(self, postings, file_list):
+        ''' stream the plan, without the cache '''
+        return doc_stream(self.run(postings, file_list))
+
+    def explain(self, indent=0):
+        ''' return the lines describing the plan, with estimates and costs '''
+        lines = [" " * indent + "%s  (est=%.1f, cost=%.0f)" %
+                 (self.label(), self.estimate, self.cost)]
+        for child in self.children():
+            lines.extend(child.explain(indent + 2))
+        return lines
+
+    def label(self):
+        return self.__class__.__name__
+
+    def children(self):
+        return []
+
+    def inputs(self):
+        ''' the nodes evaluated by run(), in order '''
+        return []
+
+
+class PlanTerm(PlanNode):
+    def __init__(self, term, frequency):
+        self.term = term
+        self.key = term
+        self.estimate = frequency
+        self.cost = frequency  # reading the postings
+
+    def run(self, postings, file_list):
+        return postings[self.term]
+
+    def run_stream(self, postings, file_list):
+        return doc_stream(postings[self.term])
+
+    def label(self):
+        return "TERM " + self.term
+
+
+class PlanNot(PlanNode):
+    def __init__(self, child, num_of_doc):
+        self.child = child
+        self.key = ('~', child.key)
+        self.estimate = num_of_doc - child.estimate
+        self.cost = child.cost + num_of_doc
+
+    def run(self, postings, file_list):
+        return not_merge(self.child.eval(postings, file_list), file_list)
+
+    def run_stream(self, postings, file_list):
+        return and_not_stream(doc_stream(file_list), self.child.stream(postings, file_list))
+
+    def label(self):
+        return "NOT"
+
+    def children(self):
+        return [self.child]
+
+    def inputs(self):
+        return [self.child]
+
+
+class PlanAnd(PlanNode):
+    ''' n-ary AND: positive operands by increasing estimate, then the ~x operands '''
+
+    def __init__(self, operands, num_of_doc):
+        self.positives = sorted([op for op in operands if not isinstance(op, PlanNot)],
+                                key=lambda op: op.estimate)
+        self.negatives = sorted([op for op in operands if isinstance(op, PlanNot)],
+                                key=lambda op: op.estimate)
+        self.num_of_doc = num_of_doc
+        self.key = ('&', frozenset(op.key for op in operands))
+
+        if self.positives:
+            self.cost = sum(op.cost for op in self.positives)
+            estimate = self.positives[0].estimate
+            for op in self.positives[1:]:
+                self.cost += intersect_cost(estimate, op.estimate)
+                estimate = estimate * op.estimate / num_of_doc if num_of_doc else 0
+            for op in self.negatives:
+                self.cost += op.child.cost + estimate + op.child.estimate
+                estimate = estimate * op.estimate / num_of_doc if num_of_doc else 0
+        else:
+            # ~a & ~b <=> ~(a | b)
+            self.cost = sum(op.child.cost for op in self.negatives) + \
+                union_cost([op.child.estimate for op in self.negatives]) + num_of_doc
+            estimate = num_of_doc
+            for op in self.negatives:
+                estimate = estimate * op.estimate / num_of_doc if num_of_doc else 0
+        self.estimate = estimate
+
+    def run(self, postings, file_list):
+        if not self.positives:
+            # ~a & ~b <=> ~(a | b)
+            union = Skiplist([])
+            for op in self.negatives:
+                union = or_merge(union, op.child.eval(postings, file_list))
+            return not_merge(union, file_list)
+
+        result = self.positives[0].eval(postings, file_list)
+        for op in self.positives[1:]:
+            if result.frequency == 0:
+                return result
+            result = and_merge(result, op.eval(postings, file_list))
+        for op in self.negatives:
+            if result.frequency == 0:
+                return result
+            result = and_not_merge(result, op.child.eval(postings, file_list))
+        return result
+
+    def run_stream(self, postings, file_list):
+        if not self.positives:
+            # ~a & ~b <=> ~(a | b)
+            union = or_stream([op.child.stream(postings, file_list) for op in self.negatives])
+            return and_not_stream(doc_stream(file_list), union)
+
+        # the most selective operand drives the others, which skip towards its doc IDs
+        result = self.positives[0].stream(postings, file_list)
+        for op in self.positives[1:]:
+            result = and_stream(result, op.stream(postings, file_list))
+        for op in self.negatives:
+            result = and_not_stream(result, op.child.stream(postings, file_list))
+        return result
+
+    def label(self):
+        return "AND"
+
+    def children(self):
+        return self.positives + self.negatives
+
+    def inputs(self):
+        return self.positives + [op.child for op in self.negatives]
+
+
+class PlanOr(PlanNode):
+    ''' n-ary OR '''
+
+    def __init__(self, operands, num_of_doc):
+        self.operands = sorted(operands, key=lambda op: op.estimate)
+        self.num_of_doc = num_of_doc
+        self.all_negated = all(isinstance(op, PlanNot) for op in operands)
+        self.key = ('|', frozenset(op.key for op in operands))
+
+        if self.all_negated:
+            # ~a | ~b <=> ~(a & b)
+            self.inner = PlanAnd([op.child for op in operands], num_of_doc)
+            self.cost = self.inner.cost + num_of_doc
+            self.estimate = num_of_doc - self.inner.estimate
+        else:
+            self.cost = sum(op.cost for op in self.operands) + \
+                union_cost([op.estimate for op in self.operands])
+            missing = 1
+            for op in self.operands:
+                missing *= 1 - op.estimate / num_of_doc if num_of_doc else 0
+            self.estimate = num_of_doc * (1 - missing)
+
+    def run(self, postings, file_list):
+        if self.all_negated:
+            return not_merge(self.inner.eval(postings, file_list), file_list)
+        result = Skiplist([])
+        for op in self.operands:
+            result = or_merge(result, op.eval(postings, file_list))
+        return result
+
+    def run_stream(self, postings, file_list):
+        if self.all_negated:
+            return and_not_stream(doc_stream(file_list), self.inner.stream(postings, file_list))
+        return or_stream([op.stream(postings, file_list) for op in self.operands])
+
+    def label(self):
+        return "OR"
+
+    def children(self):
+        return self.operands
+
+    def inputs(self):
+        return [self.inner] if self.all_negated else self.operands
+
+
+class PlanFilter(PlanNode):
+    ''' conjunction & (x1 | x2 | ...) evaluated as (conjunction & x1) | (conjunction & x2) | ... '''
+
+    def __init__(self, conjunction, union, num_of_doc):
+        self.conjunction = conjunction
+        self.union = union
+        # the conjunction is a single operand or an AND of the other operands
+        operands = conjunction.key[1] if isinstance(
+            conjunction, (PlanAnd, PlanFilter)) else {conjunction.key}
+        self.key = ('&', frozenset(operands) | {union.key})
+        filtered = []
+        self.cost = conjunction.cost
+        for op in union.operands:
+            self.cost += op.cost + intersect_cost(conjunction.estimate, op.estimate)
+            filtered.append(conjunction.estimate * op.estimate /
+                            num_of_doc if num_of_doc else 0)
+        self.cost += union_cost(filtered)
+        self.estimate = conjunction.estimate * union.estimate / \
+            num_of_doc if num_of_doc else 0
+
+    def run(self, postings, file_list):
+        conjunction = self.conjunction.eval(postings, file_list)
+        result = Skiplist([])
+        if conjunction.frequency == 0:
+            return result
+        for op in self.union.operands:
+            if isinstance(op, PlanNot):
+                part = and_not_merge(conjunction, op.child.eval(postings, file_list))
+            else:
+                part = and_merge(conjunction, op.eval(postings, file_list))
+            result = or_merge(result, part)
+        return result
+
+    def run_stream(self, postings, file_list):
+        # streamed, the union is merged lazily anyway: no need to push the conjunction down
+        return and_stream(self.conjunction.stream(postings, file_list),
+                          self.union.stream(postings, file_list))
+
+    def label(self):
+        return "FILTER (pushed down into OR)"
+
+    def children(self):
+        return [self.conjunction] + self.union.operands
+
+    def inputs(self):
+        return [self.conjunction] + [op.child if isinstance(op, PlanNot) else op
+                                     for op in self.union.operands]
+
+
+############################################
+###########        Planner       ###########
+############################################
+def make_and(operands, num_of_doc):
+    ''' build the cheapest plan of a conjunction, pushing it down into a union if it pays '''
+    if len(operands) == 1:
+        return operands[0]
+    plan = PlanAnd(operands, num_of_doc)
+    unions = [op for op in plan.positives if isinstance(op, PlanOr) and not op.all_negated]
+    for union in sorted(unions, key=lambda op: -op.estimate):
+        rest = [op for op in operands if op is not union]
+        if not [op for op in rest if not isinstance(op, PlanNot)]:
+            continue
+        pushed = PlanFilter(make_and(rest, num_of_doc), union, num_of_doc)
+        if pushed.cost < plan.cost:
+            plan = pushed
+    return plan
+
+
+def make_term(term, dictionary):
+    entry = dictionary.get(term)
+    return PlanTerm(term, entry.frequency if entry else 0)
+
+
+def make_node(operator, operands, num_of_doc):
+    ''' plan of the n-ary & or | of the operands '''
+    # a & a <=> a, a | a <=> a
+    terms = set()
+    unique = []
+    for op in operands:
+        if isinstance(op, PlanTerm):
+            if op.term in terms:
+                continue
+            terms.add(op.term)
+        unique.append(op)
+    if operator == '&':
+        return make_and(unique, num_of_doc)
+    if len(unique) == 1:
+        return unique[0]
+    return PlanOr(unique, num_of_doc)
+
+
+def make_not(child, num_of_doc):
+    if isinstance(child, PlanNot):  # ~~a <=> a
+        return child.child
+    return PlanNot(child, num_of_doc)
+
+
+def compile_expression(expr, dictionary, num_of_doc, normalize, expand=None):
+    '''
+    turn a simplified boolean.py Expression into plan nodes, normalizing its
+    Symbols into terms; expand(word) returns the terms of a wildcard word, to
+    be OR'd, or None for a plain word
+    '''
+    if isinstance(expr, boolean.Symbol):
+        terms = expand(expr.obj) if expand is not None else None
+        if terms is None:
+            return make_term(normalize(expr.obj), dictionary)
+        if not terms:  # no term matches the wildcard
+            return make_not(make_term('__all__', dictionary), num_of_doc)
+        return make_node('|', [make_term(term, dictionary) for term in terms], num_of_doc)
+    if isinstance(expr, boolean.NOT):
+        return make_not(compile_expression(expr.args[0], dictionary, num_of_doc, normalize, expand), num_of_doc)
+    if isinstance(expr, (boolean.AND, boolean.OR)):
+        # simplify() already flattened the chains of the same operator
+        operands = [compile_expression(arg, dictionary, num_of_doc, normalize, expand) for arg in expr.args]
+        return make_node('&' if isinstance(expr, boolean.AND) else '|', operands, num_of_doc)
+    if str(expr) == "1":  # left by simplify(), e.g. in ~(a & ~a)
+        return make_term('__all__', dictionary)
+    if str(expr) == "0":
+        return make_not(make_term('__all__', dictionary), num_of_doc)
+    raise ValueError("cannot compile " + repr(expr))
+
+
+def set_cache(plan, cache, terms=False):
+    '''
+    let every node of a plan keep its result in the cache,
+    postings lists of terms too if terms is True
+    '''
+    if terms or not isinstance(plan, PlanTerm):
+        plan.cache = cache
+    for child in plan.inputs():
+        set_cache(child, cache, terms)
+
+
+def plan_terms(plan):
+    ''' Return the terms whose postings lists the evaluation of a plan reads, skipping cached results '''
+    if plan.cache is not None and plan.key in plan.cache:
+        return set()
+    if isinstance(plan, PlanTerm):
+        return {plan.term}
+    terms = set()
+    for child in plan.inputs():
+        terms |= plan_terms(child)
+    return terms
+
+
+def num_of_docs(dictionary):
+    return dictionary['__all__'].frequency if '__all__' in dictionary else 0
+
+
+def compile_query(expression, postings, normalize, cache=None, terms=False, expand=None):
+    '''
+    return the plan of a simplified boolean.py Expression, whose Symbols are
+    normalized into terms by normalize() (or expanded into terms by expand(),
+    see compile_expression), and keyed on the expression in the cache
+    '''
+    dictionary = postings.dictionary
+    plan = compile_expression(expression, dictionary, num_of_docs(dictionary), normalize, expand)
+    if cache is not None:
+        set_cache(plan, cache, terms)
+        if not isinstance(plan, PlanTerm):
+            plan.key = expression  # canonical form of the whole query
+    return plan
@@ -1,24 +1,34 @@
 #!/usr/bin/python3
 import getopt
+import os
 import re
-import string
 import sys
+from itertools import islice
+from multiprocessing import Pool
 
 import boolean
 import nltk
-from nltk.corpus import stopwords
-from nltk.stem import PorterStemmer
-from nltk.stem.wordnet import WordNetLemmatizer
 
-from utils import Entry, Leaf, Node, Posting, Skiplist, BooleanTree
+from cache import ResultCache, SharedResults
+from kgram import WILDCARD, KgramIndex
+from normalizer import get_normalizer, load_tables, save_tables, stats
+from planner import compile_query, plan_terms
+from termdict import load_dictionary
+from utils import Entry, MappedPosting, Posting, Skiplist, shard_path
 
-try:
-    import cPickle as pickle
-except ImportError:
-    import pickle
+compressed = False  # postings written by index.py -c
+mapped = False  # mmap the postings file instead of seek() / read()
+explain = False  # print the query plans with their cost estimates
+cache_bytes = 0  # bound of the query result cache in bytes, 0 for no cache
+table_file = None  # file of the normalization tables, read before and written after the search
+batch = False  # plan all queries first, and evaluate their shared sub-expressions once
+shards = 1  # shards of the index written by index.py --shards
+workers = os.cpu_count() or 1  # processes evaluating the queries on the shards
+kgram_file = None  # k-gram index written by index.py -k, to expand the wildcard words of the queries
+limit = 0  # print only the first N doc IDs of each result (-n N), 0 for all
+count = False  # print the number of docs matching each query instead of their doc IDs
 
-OPERATORS = {'~': 3, '&': 2, '|': 1,
-             '(': 0, ')': 0}  # operators and precedences
+WILDCARD_MARKER = "WILDCARDSTAR"  # a * in a word, through boolean.py (lowercased in its Symbols)
 
 
 def normalize(word, stem=True, stopword=False, lemma=False):
@@ -29,28 +39,18 @@ def normalize(word, stem=True, stopword=False, lemma=False):
     if word == "":
         return "IGNORE"
     ''' do stemming, ( stopword removal, lemmatization)'''
-    ps = PorterStemmer()
-    stemmed_tokens = set()  # multiple term entries in a single document are merged
-    if not stopword:
-        stop_words = set()
-    else:  # stopword removal
-        stop_words = set(stopwords.words("english"))
-
-    if word not in stop_words:
-        # stemming
-        if not lemma:
-            token = ps.stem(word)
-        else:
-            # lemmatization
-            lem = WordNetLemmatizer()
-            token = ps.stem(lem.lemmatize(word, "v"))
-    else:
+    token = get_normalizer(stopword, lemma)(word)  # memoised, shared by the whole process
+    if token is None:  # stop word
         token = "IGNORE"
 
     return token
 
 
-def preprocess_query(q):
+def preprocess_query(q, wildcards=False):
+
+    if wildcards:
+        # keep the * of the words (comput*, *ology), not those between the words
+        q = re.sub(r"(?<=\w)\*|\*(?=\w)", WILDCARD_MARKER, q)
 
     # avoid case like "AND and"
     replacements = {'AND': ' & ', 'NOT': ' ~ ', 'OR': ' | ', ':': '', ',': '',
@@ -64,77 +64,153 @@ def preprocess_query(q):
     return q_math
 
 
-def process_token(token):
-    if token not in OPERATORS:
-        return normalize(token)
-    else:
-        return token
+def expand_wildcard(kgrams):
+    ''' Return the function expanding a wildcard Symbol into the terms it matches, None for a plain word '''
+    marker = WILDCARD_MARKER.lower()
 
+    def expand(word):
+        word = str(word)
+        if marker not in word:
+            return None
+        pattern = word.replace("invalidpunct", "").replace(marker, WILDCARD)
+        return kgrams.expand(pattern, get_normalizer())
 
-def get_input(query):
-    repeat_case = {"(": " ( ", ")": " ) ", "&": " & ", "~": " ~ ", "|": " | "}
-    q = re.sub('({})'.format('|'.join(map(re.escape, repeat_case.keys()))),
-               lambda m: repeat_case[m.group()], query)
-    return list(q.split())
+    return expand
 
 
-def add_node(output, operator):
-    ''' add a Node into output queue, and add previous Node as operands '''
-    if operator != '~':
-        right, left = output.pop(), output.pop()
-        output.append(Node(left, right, operator))
-    else:
-        output.append(Node(output.pop(), None, operator))
-
-
-def shunting(tokens):
-    ''' based on Shunting-yard_algorithm, produce a tree of operators with the query terms at the leaf '''
-
-    # empty query
-    if len(tokens) == 0:
-        return Leaf('__Empty__')
-
-    # read tokens
-    # - case1: if not operands, add it to output queue
-    # - case2: if (, put it on stack
-    # - case3: if ), empty the stack in the queue until find a ( to match, otherwise error
-    # - case4: if other operands, o1 take o2 from op stack when op1 <= op2 and put o2 in queue,
-    #          then put o1 in stack
-
-    outq = []  # output queue
-    stack = []
-    for token in tokens:
-        if token not in OPERATORS:
-            outq.append(Leaf(token))  # add term to outq
-        elif token == '(':
-            stack.append(token)
-        elif token == ')':
-            pop = ''
-            while len(stack) != 0 and pop != '(':
-                pop = stack.pop()
-                if pop != '(':
-                    add_node(outq, pop)
-            if pop != '(':
-                raise Exception("Mismatching parenthesis", pop, stack)
-        else:
-            while len(stack) != 0:
-                pop = stack.pop()
-                if OPERATORS[token] <= OPERATORS[pop]:
-                    add_node(outq, pop)
-                else:
-                    stack.append(pop)
-                    break
-            stack.append(token)
-
-    # if left some tokens, add to queue
-    # unless unexpected parenthesis
-    while len(stack) > 0:
-        if stack[-1] in "()":
-            raise Exception("Unexpected parenthesis!")
+def parse_query(query, wildcards=False):
+    ''' Return the simplified boolean.py expression of a query line '''
+    query = preprocess_query(query, wildcards)
+    algebra = boolean.BooleanAlgebra()
+    # Simplify query, e.g. tautology
+    return algebra.parse(query, simplify=True)
+
+
+def result_line(docs):
+    '''
+    Return the result line of a query from its doc IDs, a postings list or a
+    sorted iterator: the first `limit` of them with -n, their number with --count
+    '''
+    if count:
+        # the length of a NOT result (Complement) is known without enumerating it
+        return str(docs.get_length() if hasattr(docs, "get_length") else len(docs))
+    if limit:
+        docs = islice(docs, limit)
+    return " ".join(map(str, docs))
+
+
+def run_batch(queries, postings, file_list, kgrams=None):
+    """
+    parse and plan all the queries first, sharing their common terms and
+    sub-expressions in a DAG, then evaluate the queries in order: each postings
+    list is read and each shared sub-expression is merged only once
+    """
+    shared = SharedResults()
+    expand = expand_wildcard(kgrams) if kgrams is not None else None
+    plans = []
+    for query in queries:
+        expression = parse_query(query, kgrams is not None)
+        if str(expression) in ("0", "1"):
+            plans.append(str(expression))
+            continue
+        plan = compile_query(expression, postings, normalize, shared, terms=True, expand=expand)
+        if explain:
+            print(str(expression))
+            print("\n".join(plan.explain()))
+        shared.add_plan(plan)
+        plans.append(plan)
+
+    for plan in plans:
+        if plan == "0":
+            result = []
+        elif plan == "1":
+            result = file_list
         else:
-            add_node(outq, stack.pop())
+            # read the postings lists of the query not shared yet in a few large reads
+            postings.prefetch(plan_terms(plan))
+            result = plan.eval(postings, file_list)
+        # NOT results are lazy Complements, enumerated only here
+        yield result_line(result)
+    print(shared.stats())
+
 
-    return outq.pop()
+def search_queries(queries, dictionary_file, posting_file, kgrams=None):
+    """
+    perform searching on the queries with the given dictionary file and
+    postings file (and KgramIndex for the wildcard words, if any),
+    yielding the result line of each query
+    """
+    ''' load dictionary and postings '''
+    # dict(k,v) -> token, Entry(frequency, offset, size)
+    # postings -> the dict containing the entries and metadata of the postings file
+    # skiplist -> list of all doc IDs
+    dictionary = load_dictionary(dictionary_file, Entry)  # pickled, or front-coded by index.py -f
+    if mapped:
+        postings = MappedPosting(dictionary, posting_file, compressed)
+    else:
+        postings = Posting(dictionary, posting_file, compressed)
+    file_list = postings['__all__']
+    if batch:
+        yield from run_batch(queries, postings, file_list, kgrams)
+        return
+    cache = ResultCache(cache_bytes) if cache_bytes > 0 else None
+    expand = expand_wildcard(kgrams) if kgrams is not None else None
+
+    ''' process query, and yield the query result '''
+    for query in queries:
+        expression = parse_query(query, kgrams is not None)
+        # special cases after simplification
+        if str(expression) == "0":
+            yield result_line([])
+            continue
+        elif str(expression) == "1":
+            yield result_line(file_list)
+            continue
+
+        # the simplified expression is canonical: an equivalent query was cached under it
+        result = cache.get(expression) if cache is not None else None
+        if result is None:
+            # compile the expression into a plan, by the document frequencies of its terms
+            plan = compile_query(expression, postings, normalize, cache, expand=expand)
+            if explain:
+                print(str(expression))
+                print("\n".join(plan.explain()))
+            # read the postings lists of the query in a few large reads
+            postings.prefetch(plan_terms(plan))
+            if limit and not count:
+                # merged lazily by generators, which stop after the first `limit` doc IDs
+                result = plan.stream(postings, file_list)
+            else:
+                result = plan.eval(postings, file_list)
+
+        # NOT results are lazy Complements, enumerated only here
+        yield result_line(result)
+
+    if cache is not None:
+        print(cache.stats())
+
+
+def set_options(options):
+    ''' set the options of the command line in a worker process '''
+    globals().update(options)
+
+
+def load_kgrams(path):
+    ''' Return the KgramIndex written by index.py -k to path, None without -k '''
+    if path is None:
+        return None
+    with open(path, mode="rb") as kgram_in:
+        return KgramIndex.load(kgram_in)
+
+
+def search_shard(task):
+    ''' Return the result lines of the queries on the k-th shard, run by a worker process '''
+    k, dict_file, postings_file, queries = task
+    # every shard has the k-gram index of its own terms
+    kgrams = load_kgrams(shard_path(kgram_file, k) if kgram_file else None)
+    with open(shard_path(dict_file, k), mode="rb") as dictionary_file,\
+            open(shard_path(postings_file, k), mode="rb") as posting_file:
+        return list(search_queries(queries, dictionary_file, posting_file, kgrams))
 
 
 def run_search(dict_file, postings_file, queries_file, results_file):
@@ -144,81 +220,110 @@ def run_search(dict_file, postings_file, queries_file, results_file):
     """
     print('running search on the queries...')
 
+    if shards > 1:
+        # evaluate the queries on every shard in a pool, the shards cover
+        # increasing ranges of doc IDs: the results are concatenated in shard order
+        with open(queries_file, encoding="utf8") as q_in:
+            queries = list(q_in)
+        options = {"compressed": compressed, "mapped": mapped, "explain": explain,
+                   "cache_bytes": cache_bytes, "batch": batch, "kgram_file": kgram_file,
+                   "limit": limit, "count": count}
+        pool = Pool(min(workers, shards), initializer=set_options, initargs=(options,))
+        shard_results = pool.map(search_shard, [(k, dict_file, postings_file, queries)
+                                                for k in range(shards)])
+        pool.close()
+        pool.join()
+        with open(results_file, mode="w", encoding="utf8") as q_out:
+            for lines in zip(*shard_results):
+                if count:
+                    print(sum(map(int, lines)), end='\n', file=q_out)
+                    continue
+                # each shard gave its first `limit` doc IDs, in increasing ranges
+                line = " ".join(line for line in lines if line)
+                if limit:
+                    line = " ".join(line.split()[:limit])
+                print(line, end='\n', file=q_out)
+        return
+
     with open(dict_file, mode="rb") as dictionary_file,\
             open(postings_file, mode="rb") as posting_file,\
             open(queries_file, encoding="utf8") as q_in,\
             open(results_file, mode="w", encoding="utf8") as q_out:
-
-        ''' load dictionary and postings '''
-        # dict(k,v) -> token, Entry(frequency, offset, size)
-        # postings -> the dict containing the entries and metadata of the postings file
-        # skiplist -> list of all doc IDs
-        dictionary = pickle.load(dictionary_file)
-        postings = Posting(dictionary, posting_file)
-        file_list = postings['__all__']
-
-        ''' process query, and write the query result to result file '''
-        for query in q_in:
-            query = preprocess_query(query)
-            algebra = boolean.BooleanAlgebra()
-            # Simplify query, e.g. tautology
-            expression = algebra.parse(query, simplify=True)
-            # special cases after simplification
-            if str(expression) == "0":
-                print("", end='\n', file=q_out)
-                continue
-            elif str(expression) == "1":
-                print(" ".join(map(str, file_list)), end='\n', file=q_out)
-                continue
-
-            print(" ".join(map(str, shunting(get_input(str(expression))).eval(
-                postings, file_list).list)), end='\n', file=q_out)
-
-            # add posting skiplist and list of all docIDs to corresponding symbol
-            # for sym in expression.symbols:
-            #     if normalize(sym) == "IGNORE":
-            #         norm_sym = str(normalize(sym))
-            #         setattr(sym, "obj", norm_sym)
-            #         setattr(sym, "skiplist", postings[norm_sym])
-            #         setattr(sym, "list", postings[norm_sym].list)
-            #         setattr(sym, "file_list", file_list.list)
-
-            # evaluate the query
-            # args[]: list of sub-terms
-            # For symbols and base elements this tuple is empty,
-            # for boolean functions it contains one or more symbols, elements or sub-expressions.
-            # print(" ".join(map(str, expression.evaluate_query(expression.args).list)),
-            #       end='\n', file=q_out)
+        for line in search_queries(q_in, dictionary_file, posting_file, load_kgrams(kgram_file)):
+            print(line, end='\n', file=q_out)
 
 
 def usage():
     # test on my PC: $python3 search.py -d dictionary.txt -p postings.txt -q queries.txt -o output.txt
     print("usage: " +
-          sys.argv[0] + " -d dictionary-file -p postings-file -q file-of-queries -o output-file-of-results")
-
-
-dictionary_file = postings_file = file_of_queries = output_file_of_results = None
-
-try:
-    opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:o:')
-except getopt.GetoptError:
-    usage()
-    sys.exit(2)
-
-for o, a in opts:
-    if o == '-d':
-        dictionary_file = a
-    elif o == '-p':
-        postings_file = a
-    elif o == '-q':
-        file_of_queries = a
-    elif o == '-o':
-        file_of_output = a
-    else:
-        assert False, "unhandled option"
-
-if dictionary_file == None or postings_file == None or file_of_queries == None or file_of_output == None:
-    usage()
-    sys.exit(2)
-
-run_search(dictionary_file, postings_file, file_of_queries, file_of_output)
+          sys.argv[0] + " -d dictionary-file -p postings-file -q file-of-queries -o output-file-of-results [-c] [-m] [-e] [-r cache-bytes] [-t table-file] [-b] [-k kgram-file] [-n N | --count] [--shards N [--workers N]]")
+    print("tips:\n"
+          "  -c  read compressed (gap + variable-byte) postings\n"
+          "  -m  memory-map the postings file\n"
+          "  -e  print the query plans with their cost estimates\n"
+          "  -r  cache the results of queries and sub-queries, up to cache-bytes\n"
+          "  -t  start from the normalization table of table-file, and save it there\n"
+          "  -b  batch: evaluate the terms and sub-expressions shared by the queries once (no -r cache)\n"
+          "  -k  expand the wildcard words of the queries (comput*, *ology) with the k-gram index written by index.py -k\n"
+          "  -n  print only the first N doc IDs of each result, stopping the merges there\n"
+          "  --count  print the number of docs matching each query instead of their doc IDs\n"
+          "  --shards  search the N shards written by index.py --shards in a pool of processes\n"
+          "  --workers  processes of the pool, the number of CPUs by default\n")
+
+
+# worker processes import this module: only run the command line in the main process
+if __name__ == "__main__":
+
+    dictionary_file = postings_file = file_of_queries = output_file_of_results = None
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:o:cmer:t:bk:n:', ['shards=', 'workers=', 'count'])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-d':
+            dictionary_file = a
+        elif o == '-p':
+            postings_file = a
+        elif o == '-q':
+            file_of_queries = a
+        elif o == '-o':
+            file_of_output = a
+        elif o == '-c':
+            compressed = True
+        elif o == '-m':
+            mapped = True
+        elif o == '-e':
+            explain = True
+        elif o == '-r':
+            cache_bytes = int(a)
+        elif o == '-t':
+            table_file = a
+        elif o == '-b':
+            batch = True
+        elif o == '-k':
+            kgram_file = a
+        elif o == '-n':
+            limit = int(a)
+        elif o == '--count':
+            count = True
+        elif o == '--shards':
+            shards = int(a)
+        elif o == '--workers':
+            workers = int(a)
+        else:
+            assert False, "unhandled option"
+
+    if dictionary_file == None or postings_file == None or file_of_queries == None or file_of_output == None:
+        usage()
+        sys.exit(2)
+
+    if table_file:
+        load_tables(table_file)
+    run_search(dictionary_file, postings_file, file_of_queries, file_of_output)
+    if table_file:
+        save_tables(table_file)
+    for line in stats():
+        print(line)
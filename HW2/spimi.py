@@ -0,0 +1,90 @@
+'''
+Single-pass in-memory indexing (SPIMI) with a bounded memory budget.
+
+build_index adds the postings of each document to SpimiBlocks.postings, a
+defaultdict of postings values (set of doc IDs, or dict of doc ID -> token),
+and calls SpimiBlocks.charge() after every document. When the estimated size
+of the postings in memory passes the budget, they are flushed as a block:
+a temporary file holding the pickled (term, postings) pairs sorted by term.
+
+SpimiBlocks.merge() then k-way merges the blocks by term. Documents are read
+in increasing doc ID order, so the postings of a term in block k all come
+before those in block k+1, and merging a term only concatenates them with
+update(). Only one block entry per block and one merged term are in memory.
+'''
+import heapq
+import os
+import shutil
+import tempfile
+from collections import defaultdict
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+# rough size in memory of one posting: its share of the hash table of a
+# Python set / dict, the value stored for it and of the term string
+POSTING_BYTES = 100
+
+
+def read_block(path, k):
+    ''' yield the (term, k, postings) entries of the k-th block file, in term order '''
+    with open(path, mode="rb") as block_file:
+        while True:
+            try:
+                term, value = pickle.load(block_file)
+            except EOFError:
+                return
+            yield term, k, value
+
+
+class SpimiBlocks(object):
+    ''' postings in memory, flushed to sorted block files beyond a budget in bytes '''
+
+    def __init__(self, budget, factory):
+        self.budget = budget
+        self.factory = factory  # type of the postings values, set or dict
+        self.postings = defaultdict(factory)
+        self.size = 0  # estimated bytes of self.postings
+        self.block_dir = tempfile.mkdtemp(prefix="spimi")
+        self.blocks = []  # paths of the block files
+
+    def charge(self, num_postings):
+        ''' count the postings added for a document, and flush a block when over budget '''
+        self.size += num_postings * POSTING_BYTES
+        if self.size >= self.budget:
+            self.flush()
+
+    def flush(self):
+        ''' write the postings in memory as a block sorted by term, and empty them '''
+        if not self.postings:
+            return
+        path = os.path.join(self.block_dir, "block%d" % len(self.blocks))
+        with open(path, mode="wb") as block_file:
+            for term in sorted(self.postings):
+                pickle.dump((term, self.postings[term]), block_file)
+        self.blocks.append(path)
+        self.postings = defaultdict(self.factory)
+        self.size = 0
+
+    def merge(self):
+        '''
+        yield every term with its postings merged from all blocks, in term order,
+        then remove the block files
+        '''
+        self.flush()
+        try:
+            # the block index breaks ties on equal terms, keeping the doc order
+            blocks = [read_block(path, k) for k, path in enumerate(self.blocks)]
+            current, merged = None, None
+            for term, _, value in heapq.merge(*blocks, key=lambda item: item[:2]):
+                if term != current:
+                    if current is not None:
+                        yield current, merged
+                    current, merged = term, self.factory()
+                merged.update(value)
+            if current is not None:
+                yield current, merged
+        finally:
+            shutil.rmtree(self.block_dir, ignore_errors=True)
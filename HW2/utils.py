@@ -1,6 +1,13 @@
+import heapq
 import math
+import mmap
+import os
+from array import array
 from collections import namedtuple
 
+from bitmap import Bitmap
+from intersect import intersect
+
 try:
     import cPickle as pickle
 except ImportError:
@@ -18,23 +25,141 @@ the token, the offset of the postings file, the size of the list
 Entry = namedtuple("Entry", ['frequency', 'offset', 'size'])
 
 
+############################################
+###########        Shards        ###########
+############################################
+def shard_ranges(file_names, shards):
+    ''' split the sorted doc IDs into shards contiguous ranges of about the same number of docs '''
+    return [file_names[k * len(file_names) // shards:(k + 1) * len(file_names) // shards]
+            for k in range(shards)]
+
+
+def shard_path(path, k):
+    ''' file of the k-th shard of an index file written by index.py --shards '''
+    return "%s.%d" % (path, k)
+
+
+############################################
+###########      Compression     ###########
+############################################
+'''
+Compressed postings := one record per term, laid out as
+    vb(number of doc IDs) vb(number of skips) | vb gaps | skip block
+where the doc IDs are stored as variable-byte encoded gaps (d1, d2-d1, ...)
+and the skip block is a raw array('i') of skip target indices, one for each
+skip position 0, step, 2*step, ... (step = floor(sqrt(number of doc IDs)))
+'''
+
+
+# first byte of a compressed record holding a Bitmap instead of doc ID gaps
+# (it would encode a postings list of 0 doc IDs, which is never written)
+BITMAP_MARKER = b"\x80"
+
+
+def skip_targets(length):
+    ''' indices that the evenly placed skip pointers of a postings list jump to '''
+    targets = array('i')
+    # for postings with relatively short length(<9), do nothing
+    if length > 9:
+        skip_distance = int(math.floor(math.sqrt(length)))
+        for cursor in range(0, length, skip_distance):
+            targets.append(min(cursor + skip_distance, length - 1))
+    return targets
+
+
+def vb_encode(number):
+    ''' variable-byte encode one non-negative int, the last byte has its high bit set '''
+    out = bytearray()
+    while True:
+        out.insert(0, number & 0x7f)
+        if number < 128:
+            break
+        number >>= 7
+    out[-1] |= 0x80
+    return out
+
+
+def vb_decode(buf, start, count):
+    ''' decode `count` variable-byte ints from buf[start:], return (ints, end position) '''
+    numbers = []
+    n = 0
+    pos = start
+    while len(numbers) < count:
+        byte = buf[pos]
+        pos += 1
+        if byte < 128:
+            n = (n << 7) | byte
+        else:
+            numbers.append((n << 7) | (byte & 0x7f))
+            n = 0
+    return numbers, pos
+
+
+def encode_postings(doc_ids, skips=None):
+    ''' gap + variable-byte encode a sorted list of doc IDs, followed by its skip block '''
+    if skips is None:
+        skips = array('i')
+    out = vb_encode(len(doc_ids)) + vb_encode(len(skips))
+    prev = 0
+    for doc_id in doc_ids:
+        out += vb_encode(doc_id - prev)
+        prev = doc_id
+    return bytes(out) + skips.tobytes()
+
+
+def decode_postings(buf):
+    ''' inverse of encode_postings: return (sorted doc IDs, skip target indices) '''
+    (length, skip_count), pos = vb_decode(buf, 0, 2)
+    gaps, pos = vb_decode(buf, pos, length)
+    doc_ids = []
+    prev = 0
+    for gap in gaps:
+        prev += gap
+        doc_ids.append(prev)
+    skips = array('i')
+    skips.frombytes(buf[pos:pos + skip_count * skips.itemsize])
+    return doc_ids, skips
+
+
 ############################################
 ###########       Skiplist       ###########
 ############################################
+def parse_skippointer(loaded):
+    '''
+    read a postings list pickled by an older index.py, which stored the
+    string "orignal_id:jump_id" at skip positions, return (doc IDs, skips)
+    '''
+    doc_ids = array('i', sorted(
+        map(lambda x: int(x.split(":")[0]) if (isinstance(x, str)) else x, loaded)))
+    if any(isinstance(x, str) for x in loaded):
+        return doc_ids, skip_targets(len(doc_ids))
+    return doc_ids, array('i')
+
+
 class Skiplist(object):
     ''' a data structure that imitate a list of docIDs with skip pointers '''
-    # read stored info from disk (I stored the string "orignal_index : jump_index"
-    # at skip position when doing indexing)
-
-    def __init__(self, set_in):
-        lst = list(set_in)
-        self.loaded_list = lst
-        self.list = sorted(
-            list(map(lambda x: int(x.split(":")[0]) if (isinstance(x, str)) else x, lst)))
-        self.frequency = len(lst)
+    # backed by two integer arrays built at indexing time (see apply_skippointer):
+    # list  -> the sorted doc IDs
+    # skips -> skips[k] is the index that the skip pointer at index k*step jumps to
+
+    def __init__(self, doc_ids, skips=None):
+        self.list = doc_ids if isinstance(
+            doc_ids, array) else array('i', doc_ids)
+        self.skips = skips if skips is not None else array('i')
+        self.frequency = len(self.list)
         self.step = int(math.floor(math.sqrt(self.frequency)))
         self.cursor = 0  # cursor position
 
+    def skip(self, index, compare_id):
+        ''' follow the skip pointers from `index` as long as they do not pass compare_id '''
+        skips, step, ids = self.skips, self.step, self.list
+        while skips and index % step == 0:
+            target = skips[index // step]
+            if target == index or ids[target] > compare_id:
+                break
+            index = target
+        return index
+
     def __iter__(self):
         ''' Initialize, return itself '''
         self.cursor = 0
@@ -46,124 +171,266 @@ class Skiplist(object):
         if self.cursor >= self.frequency:
             raise StopIteration
 
-        doc_id = self.loaded_list[self.cursor]
-        if isinstance(doc_id, str):
-            temp_id = int(doc_id.split(":")[1])
-            doc_id = int(doc_id.split(":")[0])
-            # check for potential skip
-            if (self.frequency > 9) and compare_id:
-                # obtain the value of the skip pointer
-                if temp_id <= compare_id:  # if successful skip
-                    self.cursor += self.step
-                    doc_id = temp_id
+        # check for potential skip
+        if compare_id:
+            self.cursor = self.skip(self.cursor, compare_id)
 
         # increment cursor position prepare for next comparison
+        doc_id = self.list[self.cursor]
         self.cursor += 1
         return doc_id
 
     def get_length(self):
         return self.frequency
 
+
+class Complement(object):
+    '''
+    a lazy view of the docs of `universe` that are not in `excluded`, the
+    result of NOT: it is never built, merges rewrite it into "and not"
+    merges of `excluded`, and its doc IDs are only enumerated on output
+    '''
+
+    def __init__(self, excluded, universe):
+        self.excluded = excluded  # Skiplist or Bitmap, a subset of universe
+        self.universe = universe  # Skiplist or Bitmap of all doc IDs
+        self.frequency = universe.frequency - excluded.frequency
+
+    def __iter__(self):
+        ''' stream the doc IDs of universe, skipping those of excluded '''
+        if isinstance(self.universe, Bitmap) and isinstance(self.excluded, Bitmap):
+            return iter(self.universe - self.excluded)
+        return self.stream()
+
+    def stream(self):
+        excluded = iter(self.excluded.list)
+        skip = next(excluded, None)
+        for doc_id in self.universe.list:
+            while skip is not None and skip < doc_id:
+                skip = next(excluded, None)
+            if doc_id != skip:
+                yield doc_id
+
+    @property
+    def list(self):
+        ''' the doc IDs, built only when asked for '''
+        return array('i', self)
+
+    def get_length(self):
+        return self.frequency
+
 ############################################
 ###########       Posting        ###########
 ############################################
+# coalesce() and the read_run() of Posting and MappedPosting are the same in HW2, HW3 and HW4
+COALESCE_GAP = 64 * 1024  # postings at most this many bytes apart are read together
+MAX_RUN_BYTES = 4 * 1024 * 1024  # a read of more postings stops at about this size
+MAX_RUN_LISTS = 512  # and at this many postings, half of the usual IOV_MAX of preadv()
+
+
+def coalesce(extents, gap=COALESCE_GAP):
+    '''
+    Group the (term, offset, size) extents of postings into runs of nearby
+    postings, each read with a single read: in offset order, postings
+    starting at most gap bytes after the end of the current run join it
+
+    @param extents: list[(str, int, int)]
+    @return list of runs, lists of extents sorted by offset
+    '''
+    runs = []
+    run, start, end = [], 0, 0
+    for extent in sorted(extents, key=lambda extent: extent[1]):
+        _, offset, size = extent
+        if run and (offset - end > gap or offset + size - start > MAX_RUN_BYTES
+                    or len(run) >= MAX_RUN_LISTS):
+            runs.append(run)
+            run = []
+        if not run:
+            start = end = offset
+        run.append(extent)
+        end = max(end, offset + size)
+    if run:
+        runs.append(run)
+    return runs
 
 
 class Posting(object):
     ''' a data structure that matches dictionary term and postings (docIDs) '''
 
-    def __init__(self, dicionary, posting_file):
+    def __init__(self, dicionary, posting_file, compressed=False):
         self.dictionary = dicionary
         self.posting_file = posting_file
+        self.compressed = compressed  # postings written by index.py -c
+        self.prefetched = dict()  # term -> postings list of the current query, see prefetch
+        self.reads = 0  # reads of the postings file
+
+    def read(self, val):
+        ''' Return the bytes of the postings list stored at the given Entry '''
+        self.reads += 1
+        self.posting_file.seek(val.offset)
+        return self.posting_file.read(val.size)
+
+    def read_run(self, run):
+        '''
+        Return the bytes of each extent of a run, read at once
+
+        @param run: list[(str, int, int)], extents sorted by offset
+        @return list[bytes]
+        '''
+        self.reads += 1
+        start = run[0][1]
+        if hasattr(os, "preadv"):
+            # scatter the run into a buffer per postings, and per gap between them
+            buffers, bufs, cursor = [], [], start
+            for _, offset, size in run:
+                if offset > cursor:
+                    buffers.append(bytearray(offset - cursor))
+                buf = bytearray(size)
+                buffers.append(buf)
+                bufs.append(buf)
+                cursor = offset + size
+            os.preadv(self.posting_file.fileno(), buffers, start)
+            return bufs
+        end = max(offset + size for _, offset, size in run)
+        self.posting_file.seek(start)
+        buf = memoryview(self.posting_file.read(end - start))
+        return [buf[offset - start:offset - start + size] for _, offset, size in run]
+
+    def fetch_many(self, terms):
+        '''
+        yield (term, postings list) for each of the terms, reading the lists
+        with a few large reads of nearby byte ranges (see coalesce) in the order
+        of the postings file, and decoding them in the same pass
+        '''
+        extents = []
+        for term in set(terms):
+            if term in self.dictionary:
+                val = self.dictionary[term]
+                extents.append((term, val.offset, val.size))
+            else:
+                yield term, Skiplist([])
+        for run in coalesce(extents):
+            for (term, _, _), buf in zip(run, self.read_run(run)):
+                yield term, self.decode(buf)
+
+    def prefetch(self, terms):
+        ''' load the working set of a query up front, replacing the one of the previous query '''
+        self.prefetched = dict()  # release the previous working set first
+        self.prefetched = dict(self.fetch_many(terms))
 
     def __getitem__(self, term):
         # implement of evaluation of self[key]
-        ''' Return the associated Skiplist to a key or an empty Skiplist '''
+        ''' Return the associated Skiplist (or Bitmap) to a key or an empty Skiplist '''
+        if term in self.prefetched:
+            return self.prefetched[term]
         if term in self.dictionary:
             val = self.dictionary[term]  # Entry
-            self.posting_file.seek(val.offset)
-            return Skiplist(pickle.loads(self.posting_file.read(val.size)))
+            return self.decode(self.read(val))
         else:
             return Skiplist([])
 
-
-############################################
-###########      BooleanTree     ###########
-############################################
-class BooleanTree(object):
-    ''' a Boolean Tree represents a query '''
-
-    def __init__(self, left, right, value):
-        self.left = left    # left subtree
-        self.right = right  # right subtree
-        self.value = value  # an operand or an operator
-
-    def eval(self, dictionary, file_list):
-        ''' recursively evaluate the Boolean Tree to return a list of docs that results from the operations '''
-        # @params:
-        # dictionary: Postings dict
-        # file_list: list of all the doc ids
-
-        def left(): return self.left.eval(dictionary, file_list)
-
-        def right(): return self.right.eval(dictionary, file_list)
-
-        def sub_left(): return self.left.left.eval(dictionary, file_list)
-
-        def sub_right(): return self.right.left.eval(dictionary, file_list)
-
-        if self.value == "&":
-            if self.left.value == '~' and self.right.value == '~':
-                # ~a&~b <=> ~(a|b)
-                return not_merge(or_merge(sub_left(), sub_right()), file_list)
-            elif self.left.value == '~':  # ~a&b
-                return and_not_merge(right(), sub_left())
-            elif self.right.value == '~':  # a&~b
-                return and_not_merge(left(), sub_right())
-            return and_merge(left(), right())
-        elif self.value == '|':
-            if self.left.value == '~' and self.right.value == '~':
-                # ~a|~b <=> ~(a&b)
-                return not_merge(and_merge(sub_left(), sub_right()), file_list)
-            return or_merge(left(), right())
-        else:
-            return not_merge(left(), file_list)
-
-
-class Node(BooleanTree):
-    def __init__(self, left, right, value):
-        BooleanTree.__init__(self, left, right, value)
-
-
-class Leaf(BooleanTree):
-    def __init__(self, value):
-        BooleanTree.__init__(self, None, None, value)
-
-    def eval(self, dictionary, file_list):
-        return dictionary[self.value]
+    def decode(self, buf):
+        ''' Return the Skiplist stored in the bytes of a postings list '''
+        if self.compressed:
+            if buf[0] == BITMAP_MARKER[0]:
+                return Bitmap.from_bytes(buf, 1)
+            return Skiplist(*decode_postings(buf))
+        loaded = pickle.loads(buf)
+        if isinstance(loaded, Bitmap):  # dense postings list
+            return loaded
+        if isinstance(loaded, tuple):  # (doc IDs, skips)
+            return Skiplist(*loaded)
+        return Skiplist(*parse_skippointer(loaded))
+
+
+class MappedPosting(Posting):
+    '''
+    a Posting that maps the whole postings file into memory once, and
+    decodes every postings list from a slice of it without seek() / read()
+    '''
+
+    def __init__(self, dicionary, posting_file, compressed=False):
+        Posting.__init__(self, dicionary, posting_file, compressed)
+        self.buffer = memoryview(
+            mmap.mmap(posting_file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def read(self, val):
+        ''' Return a zero-copy view of the postings list stored at the given Entry '''
+        return self.buffer[val.offset:val.offset + val.size]
+
+    def read_run(self, run):
+        '''
+        Return zero-copy views of the extents of a run: the mapping
+        needs no reads
+
+        @param run: list[(str, int, int)], extents sorted by offset
+        @return list[memoryview]
+        '''
+        return [self.buffer[offset:offset + size] for _, offset, size in run]
+
+
+def hybrid_merge(l1, l2, op):
+    '''
+    merge two postings lists when at least one of them is a Bitmap:
+    word-parallel if both are, otherwise the sparse list probes the bitmap
+    '''
+    b1, b2 = isinstance(l1, Bitmap), isinstance(l2, Bitmap)
+    if op == '&':  # l1 & l2
+        if b1 and b2:
+            return l1 & l2
+        bitmap, sparse = (l1, l2) if b1 else (l2, l1)
+        return Skiplist(bitmap.filter(sparse.list))
+    if op == '|':  # l1 | l2
+        return (l1 if b1 else Bitmap.from_list(l1.list)) | (l2 if b2 else Bitmap.from_list(l2.list))
+    # l1 & ~l2
+    if b1 and b2:
+        return l1 - l2
+    if b2:
+        return Skiplist(l2.filter(l1.list, keep=False))
+    return l1 - Bitmap.from_list(l2.list)
+
+
+def complement_merge(l1, l2, op):
+    '''
+    merge two postings lists when at least one of them is a Complement,
+    rewritten with De Morgan's laws into merges of the excluded lists,
+    so that the result is a Complement again or a plain postings list
+    '''
+    c1, c2 = isinstance(l1, Complement), isinstance(l2, Complement)
+    if op == '&':  # l1 & l2
+        if c1 and c2:  # ~a & ~b <=> ~(a | b)
+            return Complement(or_merge(l1.excluded, l2.excluded), l1.universe)
+        if c1:
+            return and_not_merge(l2, l1.excluded)
+        return and_not_merge(l1, l2.excluded)
+    if op == '|':  # l1 | l2
+        if c1 and c2:  # ~a | ~b <=> ~(a & b)
+            return Complement(and_merge(l1.excluded, l2.excluded), l1.universe)
+        complement, other = (l1, l2) if c1 else (l2, l1)
+        # ~a | b <=> ~(a & ~b)
+        return Complement(and_not_merge(complement.excluded, other), complement.universe)
+    # l1 & ~l2
+    if c2:  # l1 & ~~b <=> l1 & b
+        return and_merge(l1, l2.excluded)
+    # ~a & ~l2 <=> ~(a | l2)
+    return Complement(or_merge(l1.excluded, l2), l1.universe)
 
 
 def and_merge(l1, l2):
     # return l1 & l2
-    out = []
-    i1, i2 = iter(l1), iter(l2)
-    try:
-        e1, e2 = next(i1, False), next(i2, False)
-        while e1 and e2:
-            if e1 == e2:
-                out.append(e1)
-                e1, e2 = next(i1, False), next(i2, False)
-            elif e1 < e2:
-                e1 = i1.__next__(e2)
-            else:
-                e2 = i2.__next__(e1)
-    except StopIteration:
-        pass
-    return Skiplist(out)
+    if isinstance(l1, Complement) or isinstance(l2, Complement):
+        return complement_merge(l1, l2, '&')
+    if isinstance(l1, Bitmap) or isinstance(l2, Bitmap):
+        return hybrid_merge(l1, l2, '&')
+    return Skiplist(intersect(l1.list, l2.list, l1.skips, l2.skips))
 
 
 def and_not_merge(l1, l2):
     # return l1 & ~l2
+    if isinstance(l1, Complement) or isinstance(l2, Complement):
+        return complement_merge(l1, l2, '-')
+    if isinstance(l1, Bitmap) or isinstance(l2, Bitmap):
+        return hybrid_merge(l1, l2, '-')
     out = []
     i1, i2 = iter(l1.list), iter(l2.list)
     e1, e2 = next(i1, False), next(i2, False)
@@ -184,6 +451,10 @@ def and_not_merge(l1, l2):
 
 def or_merge(l1, l2):
     # return l1 | l2
+    if isinstance(l1, Complement) or isinstance(l2, Complement):
+        return complement_merge(l1, l2, '|')
+    if isinstance(l1, Bitmap) or isinstance(l2, Bitmap):
+        return hybrid_merge(l1, l2, '|')
     out = []
     i1, i2 = iter(l1.list), iter(l2.list)
     e1, e2 = next(i1, False), next(i2, False)
@@ -211,19 +482,74 @@ def or_merge(l1, l2):
 
 def not_merge(l1, l2):
     # return ~l1, where l2 is the list with all doc ids
-    out = []
-    i1, i2 = iter(l1.list), iter(l2.list)
-    e1, e2 = next(i1, False), next(i2, False)
-    while e1 and e2:
-        if e1 == e2:
-            e1, e2 = next(i1, False), next(i2, False)
-        elif e1 < e2:
-            e1 = next(i1, False)
-        else:
-            out.append(e2)
-            e2 = next(i2, False)
-    if e2:
-        out.append(e2)
-        for e in i2:
-            out.append(e)
-    return Skiplist(out)
+    if isinstance(l1, Complement):  # ~~a <=> a
+        return l1.excluded
+    return Complement(l1, l2)
+
+
+############################################
+###########   Streaming merges   ###########
+############################################
+'''
+Generator-based variants of the merges, for search.py -n: they yield the
+doc IDs of the result one at a time in increasing order, so a consumer that
+stops after N doc IDs stops the whole merge tree there. Their inputs are sorted iterators made
+by doc_stream(); a Skiplist is its own iterator, whose __next__(compare_id)
+follows its skip pointers towards compare_id.
+'''
+
+
+def doc_stream(postings):
+    ''' Return a sorted iterator over the doc IDs of a Skiplist, Bitmap or Complement '''
+    if isinstance(postings, Skiplist):
+        # a fresh cursor over the same arrays: the Skiplist may be streamed twice
+        return Skiplist(postings.list, postings.skips)
+    return iter(postings)
+
+
+def advance(stream, target):
+    ''' next doc ID of a stream, skipping towards target when it is a Skiplist '''
+    if isinstance(stream, Skiplist):
+        return stream.__next__(target)
+    return next(stream)
+
+
+def and_stream(s1, s2):
+    # yield s1 & s2
+    try:
+        e1, e2 = next(s1), next(s2)
+        while True:
+            if e1 == e2:
+                yield e1
+                e1, e2 = next(s1), next(s2)
+            elif e1 < e2:
+                e1 = advance(s1, e2)
+            else:
+                e2 = advance(s2, e1)
+    except StopIteration:  # the end of either stream is the end of the result
+        return
+
+
+def and_not_stream(s1, s2):
+    # yield s1 & ~s2
+    e2 = next(s2, None)
+    for e1 in s1:
+        while e2 is not None and e2 < e1:
+            try:
+                e2 = advance(s2, e1)
+            except StopIteration:
+                e2 = None
+        if e1 != e2:
+            yield e1
+
+
+def or_stream(streams):
+    # yield s1 | s2 | ...
+    last = None
+    # heapq.merge ends with `yield from` its last iterator, which would
+    # rewind a Skiplist (its __iter__ resets the cursor): merge generators
+    streams = [(doc_id for doc_id in stream) for stream in streams]
+    for doc_id in heapq.merge(*streams):
+        if doc_id != last:
+            yield doc_id
+            last = doc_id
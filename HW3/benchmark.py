@@ -0,0 +1,235 @@
+#!/usr/bin/python3
+'''
+Benchmarks of the ranking of search.py on a file of queries and a pickled
+index, the postings being read before timing, so only the scoring and
+ranking are measured:
+    maxscore := the term-at-a-time scoring of search.py -a against MaxScore
+                (maxscore.py): the time to rank the top 10 of a query, and
+                the postings read out of all the postings of the query
+                terms; the top 10 of both must be the same
+    select   := the selection of the top 10 of the scored documents, a
+                sort of all of them against top_k() (ranking.py), by the
+                number of documents scored by the query
+    columnar := the pickled postings against the columnar postings of
+                index.py -c (columnar.py), converted from the same
+                postings: the time to load the postings of a query, and to
+                score and rank it term at a time or vectorised, by the
+                number of terms of the query
+    positions := the phrase matching of -x (interection() then verify()) on
+                the pickled postings against the columnar postings of
+                index.py -c -x, the positions delta + variable-byte
+                encoded and decoded only for the candidate documents: the
+                bytes of the postings of a query, and the time to load
+                them and match the phrase, by the number of words of the
+                phrase; the matching documents must be the same
+'''
+import getopt
+import sys
+import time
+from collections import defaultdict
+
+import search
+from columnar import decode, encode, score_columns, top_scores
+from maxscore import maxscore_top_k
+from ranking import top_k
+from search import (Entry, Posting, TOP_K, interection, load_dictionary, pickle, query_postings, query_vector,
+                    score_documents, verify)
+
+
+def bench_maxscore(queries):
+    exhaustive_time = maxscore_time = 0.0
+    total = read = 0
+    for lists, allowed in queries:
+        if any(max_weight == 0 for (_, _, max_weight) in lists):
+            print("the index has no max weights: rebuild it with index.py")
+            return
+
+        start = time.perf_counter()
+        expected = score_documents(lists, allowed).most_common(TOP_K)
+        exhaustive_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        best, query_read = maxscore_top_k(lists, TOP_K, allowed)
+        maxscore_time += time.perf_counter() - start
+
+        assert [doc_id for (doc_id, _) in best] == [doc_id for (doc_id, _) in expected]
+        total += sum(len(term_postings) for (_, term_postings, _) in lists)
+        read += query_read
+
+    count = max(len(queries), 1)
+    print("%d queries, %.1f postings a query" % (len(queries), total / count))
+    print("term at a time: %.1fus a query, all the postings scored" % (exhaustive_time / count * 1e6))
+    print("MaxScore: %.1fus a query, %d of %d postings read (%.1f%% skipped)" % (
+        maxscore_time / count * 1e6, read, total, 100 * (1 - read / max(total, 1))))
+
+
+def bench_select(queries, rounds=5):
+    # number of documents scored, rounded down to a power of 10 -> [queries, sort, top_k]
+    buckets = defaultdict(lambda: [0, 0.0, 0.0])
+    for lists, allowed in queries:
+        scores = score_documents(lists, allowed)
+        if not scores:
+            continue
+        bucket = buckets[10 ** (len(str(len(scores))) - 1)]
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:TOP_K]
+        bucket[1] += (time.perf_counter() - start) / rounds
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            best = top_k(scores, TOP_K, tiebreak=lambda doc_id: doc_id)
+        bucket[2] += (time.perf_counter() - start) / rounds
+
+        assert best == ranked
+        bucket[0] += 1
+
+    for size, (count, sort_time, select_time) in sorted(buckets.items()):
+        print("%d+ documents scored (%d queries): sort %.1fus, top_k %.1fus a query" % (
+            size, count, sort_time / count * 1e6, select_time / count * 1e6))
+
+
+def bench_columnar(queries, rounds=3):
+    slots = 1 + max((max(term_postings) for lists, _ in queries for (_, term_postings, _) in lists if term_postings),
+                    default=0)
+    # number of query terms -> [queries, unpickle, decode, term at a time, vectorised, same top 10]
+    buckets = defaultdict(lambda: [0, 0.0, 0.0, 0.0, 0.0, 0])
+    for lists, allowed in queries:
+        if not lists:
+            continue
+        bucket = buckets[len(lists)]
+        pickled = [pickle.dumps(term_postings) for (_, term_postings, _) in lists]
+        encoded = [encode(term_postings) for (_, term_postings, _) in lists]
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for data in pickled:
+                pickle.loads(data)
+        bucket[1] += (time.perf_counter() - start) / rounds
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            columns = [decode(data) for data in encoded]
+        bucket[2] += (time.perf_counter() - start) / rounds
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            expected = top_k(score_documents(lists, allowed), TOP_K)
+        bucket[3] += (time.perf_counter() - start) / rounds
+
+        q_columns = [(q_weight, term_columns) for ((q_weight, _, _), term_columns) in zip(lists, columns)]
+        start = time.perf_counter()
+        for _ in range(rounds):
+            best = top_scores(score_columns(q_columns, slots, allowed), TOP_K)
+        bucket[4] += (time.perf_counter() - start) / rounds
+
+        # the float32 weights may only reorder documents of nearly the same score
+        bucket[0] += 1
+        bucket[5] += [doc_id for (doc_id, _) in best] == [doc_id for (doc_id, _) in expected]
+
+    for terms, (count, unpickle, load, exhaustive, vectorised, same) in sorted(buckets.items()):
+        print("%d terms (%d queries): load %.1fus -> %.1fus, score %.1fus -> %.1fus (%.1fx), same top %d: %d" % (
+            terms, count, unpickle / count * 1e6, load / count * 1e6, exhaustive / count * 1e6,
+            vectorised / count * 1e6, exhaustive / max(vectorised, 1e-9), TOP_K, same))
+
+
+def bench_positions(phrases, rounds=3):
+    # number of words of the phrase -> [queries, pickled bytes, encoded bytes, unpickle and match, decode and match]
+    buckets = defaultdict(lambda: [0, 0, 0, 0.0, 0.0])
+    for tokens, term_postings in phrases:
+        if len(tokens) < 2 or not all(term_postings.values()):
+            continue  # no phrase, or a word of no document
+        if not all(hasattr(token, "pos") for postings_dict in term_postings.values()
+                   for token in postings_dict.values()):
+            print("the index has no positions: rebuild it with index.py -x")
+            return
+        bucket = buckets[len(tokens)]
+        terms = list(term_postings)
+        pickled = {term: pickle.dumps(postings_dict) for term, postings_dict in term_postings.items()}
+        encoded = {term: encode(postings_dict, positional=True) for term, postings_dict in term_postings.items()}
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            loaded = {term: pickle.loads(data) for term, data in pickled.items()}
+            expected = verify(interection(terms, loaded), tokens, loaded)
+        bucket[3] += (time.perf_counter() - start) / rounds
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            columns = {term: decode(data) for term, data in encoded.items()}
+            matched = verify(interection(terms, columns), tokens, columns)
+        bucket[4] += (time.perf_counter() - start) / rounds
+
+        assert sorted(matched) == sorted(expected)
+        bucket[0] += 1
+        bucket[1] += sum(len(data) for data in pickled.values())
+        bucket[2] += sum(len(data) for data in encoded.values())
+
+    for words, (count, pickled_size, encoded_size, unpickle, load) in sorted(buckets.items()):
+        print("%d words (%d queries): %.0f -> %.0f bytes, load and match %.1fus -> %.1fus (%.1fx)" % (
+            words, count, pickled_size / count, encoded_size / count, unpickle / count * 1e6,
+            load / count * 1e6, unpickle / max(load, 1e-9)))
+
+
+BENCHMARKS = {
+    'maxscore': bench_maxscore,
+    'select': bench_select,
+    'columnar': bench_columnar,
+    'positions': bench_positions,
+}
+
+
+def run_benchmark(dict_file, postings_file, queries_file, names):
+    with open(dict_file, mode="rb") as dictionary_file,\
+            open(postings_file, mode="rb") as posting_file,\
+            open(queries_file, encoding="utf8") as q_in:
+        num_of_doc = pickle.load(dictionary_file)
+        dictionary = load_dictionary(dictionary_file, Entry, Entry)
+        postings = Posting(dictionary, posting_file)
+        vectors = [query_vector(query, dictionary, num_of_doc) for query in q_in]
+        queries = [query_postings(*vector, postings) for vector in vectors]
+        # the phrase and the postings of its words, for positions: a word of no
+        # document (left in the dictionary by query_vector) has no postings
+        phrases = [(tokens, {term: postings[term] if dictionary[term].size > 0 else {} for term in terms})
+                   for (tokens, terms, _) in vectors]
+    for name in names:
+        print("== " + name + " ==")
+        BENCHMARKS[name](phrases if name == 'positions' else queries)
+
+
+def usage():
+    # test on my PC: $python3 benchmark.py -d dictionary.txt -p postings.txt -q queries.txt -b select
+    print("usage: " +
+          sys.argv[0] + " -d dictionary-file -p postings-file -q file-of-queries [-x] [-b benchmark]")
+    print("benchmarks: " + ", ".join(BENCHMARKS))
+
+
+dictionary_file = postings_file = file_of_queries = None
+benchmarks = list(BENCHMARKS)
+
+try:
+    opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:xb:')
+except getopt.GetoptError:
+    usage()
+    sys.exit(2)
+
+for o, a in opts:
+    if o == '-d':
+        dictionary_file = a
+    elif o == '-p':
+        postings_file = a
+    elif o == '-q':
+        file_of_queries = a
+    elif o == '-x':
+        search.phrasal_query = True
+    elif o == '-b':
+        benchmarks = a.split(",")
+    else:
+        assert False, "unhandled option"
+
+if dictionary_file == None or postings_file == None or file_of_queries == None or any(b not in BENCHMARKS for b in benchmarks):
+    usage()
+    sys.exit(2)
+
+run_benchmark(dictionary_file, postings_file, file_of_queries, benchmarks)
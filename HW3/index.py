@@ -3,14 +3,18 @@ import getopt
 import math
 import sys
 from collections import defaultdict
+from multiprocessing import Pool
 
 import nltk
-from nltk.corpus import PlaintextCorpusReader, stopwords
-from nltk.stem import PorterStemmer
-from nltk.stem.wordnet import WordNetLemmatizer
+from nltk.corpus import PlaintextCorpusReader
 from nltk.tokenize import RegexpTokenizer, sent_tokenize, word_tokenize
 
-from utils import Entry, Token, PhrasalToken, normalize, get_tf
+import columnar
+from kgram import KgramIndex
+from normalizer import get_normalizer, load_tables, save_tables, stats
+from spimi import SpimiBlocks
+from termdict import write_dictionary
+from utils import Entry, Token, PhrasalToken, normalize, get_tf, shard_path, shard_ranges
 
 try:
     import cPickle as pickle
@@ -18,6 +22,14 @@ except ImportError:
     import pickle
 
 phrasal_query = False  # operate phrase query
+memory_budget = 0  # MB of postings kept in memory before flushing a SPIMI block, 0 for no limit
+workers = 1  # processes analysing the documents
+shards = 1  # indexes written, each for a range of doc IDs
+front_coded = False  # write the dictionary as a sorted front-coded term dictionary (termdict.py)
+kgram_file = None  # file of the k-gram index of the terms, for wildcard queries
+columnar_postings = False  # write the postings as arrays of doc IDs and weights (columnar.py)
+corpus = None  # corpus reader of the process (set by open_corpus)
+table_file = None  # file of the normalization tables, read before and written after the build
 
 def tokenize(paragraph):
     '''
@@ -46,26 +58,76 @@ def stemming(words, stopword=False, lemma=False):
     @param words: a list of strings
     @return stemmed_tokens: a list of strings
     '''
-    ps = PorterStemmer()
-    stemmed_tokens = list()  # multiple term entries in a single document are merged
+    # memoised, shared by the whole process; as before, the stop words
+    # are removed unless stopword is True
+    normalize_word = get_normalizer(not stopword, lemma)
+    stemmed_tokens = list()
     for w in words:
+        token = normalize_word(w)
+        if token is not None:  # not a stop word
+            stemmed_tokens.append(token)
+    return stemmed_tokens
+
+
+def open_corpus(in_dir, phrasal):
+    ''' open the corpus in this process, also run by every worker process '''
+    global corpus, phrasal_query
+    corpus = PlaintextCorpusReader(in_dir, '.*')
+    phrasal_query = phrasal
+
+
+def analyse(fn):
+    '''
+    Analyse a document: tokenization, stemming and weighted token frequency.
 
-        if stopword:
-            stop_words = set()
-        else:  # stopword removal
-            stop_words = set(stopwords.words("english"))
-
-        if w not in stop_words:
-            # stemming
-            if lemma:
-                # lemmatization
-                lem = WordNetLemmatizer()
-                token = ps.stem(lem.lemmatize(w, "v"))
+    @param fn: the document ID
+    @return (number of tokens, list of (token, Token or PhrasalToken)) in the
+            order of the first occurrence of every token
+    '''
+    content = corpus.raw(str(fn))  # read file content
+    words = tokenize(content)  # tokenization: content -> words
+    tokens = stemming(words)  # stemming
+
+    if phrasal_query:
+        token_len = defaultdict(list)
+    else:
+        token_len = defaultdict(int)
+    # count the apeearing times of the token in the file
+    term_pos = 0
+    for token in tokens:
+        if phrasal_query:
+            if token in token_len.keys():
+                token_len[token][0] += 1
+                token_len[token][1].append(term_pos)
             else:
-                token = ps.stem(w)
-            stemmed_tokens.append(token)
+                token_len[token] = [1, [term_pos]]
+        else:
+            token_len[token] += 1
 
-    return stemmed_tokens
+        term_pos += 1
+
+    ''' 
+    Generate weighted token frequency.
+    
+    Generate the list of token, (frequency, weighted_token_frequency)
+    '''
+    items = list()
+    if phrasal_query:
+
+        weighted_tokenfreq = normalize(
+            [get_tf(y[0]) for (x, y) in token_len.items()])
+
+        for ((token, freq), w_tf) in zip(token_len.items(), weighted_tokenfreq):
+            items.append((token, PhrasalToken(freq[0], freq[1], w_tf)))
+    else:
+
+        weighted_tokenfreq = normalize(
+            [get_tf(y) for (x, y) in token_len.items()])
+
+        for ((token, freq), w_tf) in zip(token_len.items(), weighted_tokenfreq):
+            items.append((token, Token(freq, w_tf)))
+
+    return len(tokens), items
 
 
 def build_index(in_dir, out_dict, out_postings):
@@ -76,57 +138,75 @@ def build_index(in_dir, out_dict, out_postings):
     print('indexing...')
 
     ''' Create a sorted list of the files inside the directory '''
-    corpus = PlaintextCorpusReader(in_dir, '.*')
+    open_corpus(in_dir, phrasal_query)
     file_names_str = corpus.fileids()
     file_names = sorted(map(int, file_names_str))
 
-    ''' Load corpus and generate the postings dictionary '''
-    postings = defaultdict(dict)
-    tokens = list()
-    for fn in file_names:
-        
-        content = corpus.raw(str(fn))  # read file content
-        words = tokenize(content)  # tokenization: content -> words
-        tokens = stemming(words)  # stemming
-
-        if phrasal_query:
-            token_len = defaultdict(list)
-        else:
-            token_len = defaultdict(int)
-        # count the apeearing times of the token in the file
-        term_pos = 0
-        for token in tokens:
-            if phrasal_query:
-                if token in token_len.keys():
-                    token_len[token][0] += 1
-                    token_len[token][1].append(term_pos)
-                else:
-                    token_len[token] = [1, [term_pos]]
-            else:
-                token_len[token] += 1
-
-            term_pos += 1
-
-        ''' 
-        Generate weighted token frequency.
-        
-        Generate dictionary of key -> token, value -> a dict with k,v 
-        as file_name, (frequency, weighted_token_frequency)
-        '''
-        if phrasal_query:
+    if workers > 1:
+        # analyse the documents in a pool, getting their tokens back in doc ID order
+        pool = Pool(workers, initializer=open_corpus, initargs=(in_dir, phrasal_query))
+        documents = pool.imap(analyse, file_names,
+                              chunksize=max(1, len(file_names) // (workers * 16)))
+    else:
+        documents = map(analyse, file_names)
+
+    if shards > 1:
+        # document-partitioned shards: each indexes a range of doc IDs
+        global_dictionary = defaultdict(Entry)
+        for k, shard_names in enumerate(shard_ranges(file_names, shards)):
+            dictionary = write_index(shard_names, documents,
+                                     shard_path(out_dict, k), shard_path(out_postings, k))
+            for key, val in dictionary.items():
+                total = global_dictionary[key]
+                global_dictionary[key] = Entry(total.frequency + val.frequency,
+                                               max_weight=max(total.max_weight, val.max_weight))
+        # the dictionary file keeps the statistics of the whole collection,
+        # for the idf of the query terms: document frequencies, no postings
+        with open(out_dict, mode="wb") as dictionary_file:
+            pickle.dump(len(file_names), dictionary_file)
+            dump_dictionary(global_dictionary, dictionary_file)
+        dictionary = global_dictionary
+    else:
+        dictionary = write_index(file_names, documents, out_dict, out_postings)
+    if workers > 1:
+        pool.close()
+        pool.join()
 
-            weighted_tokenfreq = normalize(
-                [get_tf(y[0]) for (x, y) in token_len.items()])
+    # the k-gram index of all the terms: the wildcard words are expanded with the query weights
+    if kgram_file:
+        with open(kgram_file, mode="wb") as kgram_out:
+            KgramIndex(dictionary).dump(kgram_out)
 
-            for ((token, freq), w_tf) in zip(token_len.items(), weighted_tokenfreq):
-                postings[token][fn] = PhrasalToken(freq[0], freq[1], w_tf)
-        else:
 
-            weighted_tokenfreq = normalize(
-                [get_tf(y) for (x, y) in token_len.items()])
+def write_index(file_names, documents, out_dict, out_postings):
+    """
+    index the documents of file_names, taking their tokens from documents (in
+    the same order), then output the dictionary file and postings file
 
-            for ((token, freq), w_tf) in zip(token_len.items(), weighted_tokenfreq):
-                postings[token][fn] = Token(freq, w_tf)
+    @return the dictionary: DefaultDict[str, Entry]
+    """
+    ''' Load corpus and generate the postings dictionary '''
+    if memory_budget:
+        # SPIMI: flush sorted blocks of postings to temporary files over the budget
+        blocks = SpimiBlocks(memory_budget * 1024 * 1024, dict)
+        postings = blocks.postings
+    else:
+        postings = defaultdict(dict)
+    # zip() stops at the end of file_names, before taking the next document
+    for fn, (num_tokens, items) in zip(file_names, documents):
+        for token, value in items:
+            postings[token][fn] = value
+
+        if memory_budget:
+            # the positions of phrasal tokens are counted as postings too
+            blocks.charge(len(items) + (num_tokens if phrasal_query else 0))
+            postings = blocks.postings  # emptied by a flush
+
+    if memory_budget:
+        # k-way merge of the blocks, in term order
+        postings = blocks.merge()
+    else:
+        postings = postings.items()
 
     ''' 
     Output dictionary and postings files 
@@ -139,21 +219,46 @@ def build_index(in_dir, out_dict, out_postings):
     # write postings file
     dictionary = defaultdict(Entry)
     with open(out_postings, mode="wb") as postings_file:
-        for key, value in postings.items():
+        if columnar_postings:
+            # the scores of search.py are an array indexed by doc ID
+            columnar.write_header(postings_file, file_names[-1] + 1 if file_names else 0)
+        for key, value in postings:
             '''
             len(value) := the document frequency of the token
                        := how many times the token appears in all documents
             offset := current writing position of the postings file
             size := the number of characters written in postings file, in terms of 
                     this token
+            max_weight := the largest weight of the token in a document, the
+                          upper bound of its score used by search.py (MaxScore)
             '''
             offset = postings_file.tell()
-            size = postings_file.write(pickle.dumps(value))
-            dictionary[key] = Entry(len(value), offset, size)
+            max_weight = max(token.weight for token in value.values())
+            if columnar_postings:
+                size = postings_file.write(columnar.encode(value, phrasal_query))
+                max_weight = float(columnar.np.float32(max_weight))  # the weights are float32
+            else:
+                size = postings_file.write(pickle.dumps(value))
+            dictionary[key] = Entry(len(value), offset, size, max_weight)
 
     # write dictionary file
     with open(out_dict, mode="wb") as dictionary_file:
         pickle.dump(len(file_names), dictionary_file)
+        dump_dictionary(dictionary, dictionary_file)
+
+    return dictionary
+
+
+def dump_dictionary(dictionary, dictionary_file):
+    '''
+    Write the dictionary of the terms, pickled, or front-coded with -f
+
+    @param dictionary: DefaultDict[str, Entry]
+    @param dictionary_file: file opened in binary mode
+    '''
+    if front_coded:
+        write_dictionary(dictionary, dictionary_file)
+    else:
         pickle.dump(dictionary, dictionary_file)
 
 
@@ -164,36 +269,66 @@ def usage():
     # supporting phrasal query:
     # $ python3 index.py -i /Users/yu/nltk_data/corpora/reuters/training/ -d dictionary.txt -p postings.txt -x
     print("usage: " +
-          sys.argv[0] + " -i directory-of-documents -d dictionary-file -p postings-file")
+          sys.argv[0] + " -i directory-of-documents -d dictionary-file -p postings-file [-x] [-f] [-c] [-k kgram-file] [-s memory-budget] [--workers N] [--shards N] [-t table-file]")
     print("tips:\n"
           "  -i  directory of the reuters training data\n"
           "  -d  dictionary file path\n"
           "  -p  postings file path\n"
-          "  -x  enable phrasal query\n")
-
-
-input_directory = output_file_dictionary = output_file_postings = None
-
-try:
-    opts, args = getopt.getopt(sys.argv[1:], 'i:d:p:x')
-except getopt.GetoptError:
-    usage()
-    sys.exit(2)
-
-for o, a in opts:
-    if o == '-i':  # input directory
-        input_directory = a
-    elif o == '-d':  # dictionary file
-        output_file_dictionary = a
-    elif o == '-p':  # postings file
-        output_file_postings = a
-    elif o == '-x':  # operate phrase query
-        phrasal_query = True
-    else:
-        assert False, "unhandled option"
-
-if input_directory == None or output_file_postings == None or output_file_dictionary == None:
-    usage()
-    sys.exit(2)
-
-build_index(input_directory, output_file_dictionary, output_file_postings)
+          "  -x  enable phrasal query\n"
+          "  -f  write a sorted front-coded dictionary, memory-mapped by search.py\n"
+          "  -c  write columnar postings (arrays of doc IDs and weights, with -x encoded positions, needs NumPy), scored vectorised by search.py\n"
+          "  -k  write the k-gram index of the terms to kgram-file, for the wildcard queries of search.py -k\n"
+          "  -s  build the index in SPIMI blocks of at most memory-budget MB of postings\n"
+          "  --workers  analyse the documents in N processes\n"
+          "  --shards  write N indexes, each for a range of doc IDs, to dictionary-file.k and postings-file.k\n"
+          "  -t  start from the normalization table of table-file, and save it there\n")
+
+
+# worker processes import this module: only run the command line in the main process
+if __name__ == "__main__":
+
+    input_directory = output_file_dictionary = output_file_postings = None
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'i:d:p:xfck:s:t:', ['workers=', 'shards='])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-i':  # input directory
+            input_directory = a
+        elif o == '-d':  # dictionary file
+            output_file_dictionary = a
+        elif o == '-p':  # postings file
+            output_file_postings = a
+        elif o == '-x':  # operate phrase query
+            phrasal_query = True
+        elif o == '-f':  # front-coded dictionary
+            front_coded = True
+        elif o == '-c':  # columnar postings
+            columnar_postings = True
+        elif o == '-k':  # k-gram index
+            kgram_file = a
+        elif o == '-s':  # SPIMI memory budget (MB)
+            memory_budget = float(a)
+        elif o == '--workers':  # document analysis processes
+            workers = int(a)
+        elif o == '--shards':  # doc ID range shards
+            shards = int(a)
+        elif o == '-t':  # normalization table file
+            table_file = a
+        else:
+            assert False, "unhandled option"
+
+    if input_directory == None or output_file_postings == None or output_file_dictionary == None:
+        usage()
+        sys.exit(2)
+
+    if table_file:
+        load_tables(table_file)
+    build_index(input_directory, output_file_dictionary, output_file_postings)
+    if table_file:
+        save_tables(table_file)
+    for line in stats():
+        print(line)
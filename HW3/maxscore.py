@@ -0,0 +1,117 @@
+'''
+Document-at-a-time top-k retrieval with MaxScore (Turtle & Flood), which
+skips the documents that cannot enter the top k.
+
+The score of a document is the sum over the query terms of
+q_weight * weight, so a term can add at most its upper bound
+q_weight * max_weight, the largest weight of the term in a document being
+kept in its dictionary Entry by index.py. With the terms sorted by upper
+bound, and theta the k-th best score so far, the longest prefix of terms whose
+bounds add up to less than theta is non-essential: a document containing only
+those terms cannot enter the top k. The postings lists of the essential
+terms are merged in doc ID order, and a document found there looks up
+the non-essential terms in their postings (dicts) from the largest bound
+down, and is dropped as soon as its score so far plus the bounds of the
+terms left is below theta. As theta grows, more terms become non-essential and
+their postings lists are no longer walked.
+
+maxscore_top_k() returns exactly the top k of the term-at-a-time scoring of
+search.py: the scores are summed in the same order of the terms, and ties
+are broken the same way as Counter.most_common() (by first insertion: the
+first term containing the document, then the doc ID), in a TopK
+accumulator (ranking.py).
+'''
+from heapq import heapify, heappop, heappush
+
+from ranking import TopK
+
+SLACK = 1e-9  # relative margin of the bounds, against the rounding of float sums
+
+
+def maxscore_top_k(lists, k, allowed=None):
+    '''
+    Return the k best (doc ID, score), best first, and the number of
+    postings read (walked in a list, or looked up)
+
+    @param lists - (query weight, postings, max weight) of the query terms,
+                   in the order of the term-at-a-time scoring; the postings
+                   are dicts of doc ID -> Token in doc ID order, as written by
+                   index.py, and the query weights are > 0
+    @param k - number of documents: int
+    @param allowed - the doc IDs that may be ranked (-x), None for all: set
+    '''
+    if k <= 0:
+        return [], 0
+    n = len(lists)
+    bounds = [q_weight * max_weight for (q_weight, _, max_weight) in lists]
+    order = sorted(range(n), key=lambda i: bounds[i])
+    rank = [0] * n  # position of a term in order
+    prefix = [0.0]  # prefix[j]: sum of the j smallest bounds
+    for j, i in enumerate(order):
+        rank[i] = j
+        prefix.append(prefix[-1] + bounds[i])
+    non_essential = 0  # the terms order[:non_essential]
+
+    # cursors of the postings lists, merged with a heap of (doc ID, term)
+    cursors = [iter(postings.items()) for (_, postings, _) in lists]
+    current = [None] * n  # the Token at the cursor of each term
+    heads = []
+    for i, cursor in enumerate(cursors):
+        for doc_id, value in cursor:
+            current[i] = value
+            heads.append((doc_id, i))
+            break
+    heapify(heads)
+
+    top = TopK(k)
+    threshold = None  # the score of the k-th best document, once there are k
+    read = 0
+    while heads:
+        doc_id = heads[0][0]
+        contributions = [None] * n
+        partial = 0.0
+        while heads and heads[0][0] == doc_id:
+            _, i = heappop(heads)
+            if rank[i] < non_essential:
+                continue  # dropped: looked up below instead
+            read += 1
+            contributions[i] = lists[i][0] * current[i].weight
+            partial += contributions[i]
+            for next_id, value in cursors[i]:
+                current[i] = value
+                heappush(heads, (next_id, i))
+                break
+        if allowed is not None and doc_id not in allowed:
+            continue
+
+        # the non-essential terms, while the document can still enter the top k
+        pruned = False
+        for j in range(non_essential - 1, -1, -1):
+            if (partial + prefix[j + 1]) * (1 + SLACK) < threshold:
+                pruned = True
+                break
+            i = order[j]
+            value = lists[i][1].get(doc_id)
+            read += 1
+            if value is not None:
+                contributions[i] = lists[i][0] * value.weight
+                partial += contributions[i]
+        if pruned:
+            continue
+
+        # the exact score, summed in the order of the terms like a Counter
+        score = 0
+        first = None
+        for i, contribution in enumerate(contributions):
+            if contribution is not None:
+                score += contribution
+                if first is None:
+                    first = i
+        if not top.push(doc_id, score, tie=(first, doc_id)):
+            continue
+        threshold = top.threshold
+        if threshold is not None:
+            while non_essential < n and prefix[non_essential + 1] * (1 + SLACK) < threshold:
+                non_essential += 1
+
+    return top.items(), read
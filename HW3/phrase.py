@@ -0,0 +1,143 @@
+'''
+Positional matching of the phrase queries (-x), walking the sorted lists of
+the positions of the words in a document in lockstep, their cursors only
+moving forward:
+    phrase(lists) := the positions p of the first word of a phrase with
+        p + i a position of its i-th word, i.e. where the phrase starts
+    near(left, right, k) := the positions of right within k words of a
+        position of left, before or after it: the operator NEAR/k
+Both are generators of sorted positions, so that a query of phrases joined
+by NEAR/k (e.g. "fertility treatment" NEAR/5 clinic: the first words of
+the phrases at most 5 words apart) is matched in a pipeline, stopping at
+its first match when only a boolean hit is needed (match()), or counted.
+
+A query keeps its NEAR/k operators among its stemmed tokens as operator
+tokens, NEAR/k in upper case, which no stemmed word can be.
+'''
+import re
+from bisect import bisect_left
+from collections import defaultdict
+
+NEAR = re.compile(r"\s+NEAR/(\d+)\s+")  # the operator in a query, with its k
+OPERATOR = "NEAR/%d"
+
+
+def split_near(query):
+    ''' Return the parts of a query between its NEAR/k operators, and the k between each two '''
+    parts = NEAR.split(query)
+    return parts[::2], [int(k) for k in parts[1::2]]
+
+
+def operator_token(k):
+    ''' Return the token of the operator NEAR/k, kept among the tokens of a query '''
+    return OPERATOR % k
+
+
+def is_operator(token):
+    return token.startswith("NEAR/")
+
+
+def split_tokens(tokens):
+    '''
+    Return the phrases (lists of tokens) of the tokens of a query between
+    its operator tokens, and the k of the NEAR/k between each two; a phrase
+    left empty (e.g. of stop words only) is dropped with its operator
+    '''
+    phrases, distances = [[]], []
+    for token in tokens:
+        if is_operator(token):
+            phrases.append([])
+            distances.append(int(token.split("/")[1]))
+        else:
+            phrases[-1].append(token)
+    kept = [(words, k) for words, k in zip(phrases, [None] + distances) if words]
+    return [words for words, _ in kept], [k for _, k in kept[1:]]
+
+
+def phrase(lists):
+    '''
+    Generate the positions where a phrase starts, in order, by leapfrogging:
+    the cursor of each word in turn moves to the first start >= the start
+    proposed by the previous words, found by binary search from where it
+    was, until the positions of all the words agree
+
+    @param lists - the sorted positions of each word of the phrase, in order
+    '''
+    n = len(lists)
+    if n == 0 or not all(lists):
+        return
+    cursors = [0] * n
+    start = lists[0][0]
+    agreed = 0  # the words in a row agreeing on start
+    i = 0
+    while True:
+        positions = lists[i]
+        j = cursors[i] = bisect_left(positions, start + i, cursors[i])
+        if j == len(positions):
+            return  # the i-th word is over: no more matches
+        if positions[j] - i != start:
+            start = positions[j] - i
+            agreed = 0
+        agreed += 1
+        if agreed == n:
+            yield start
+            start += 1
+            agreed = 0
+        i = (i + 1) % n
+
+
+def near(left, right, k):
+    '''
+    Generate the positions of right within k words of a position of
+    left, in order
+
+    @param left, right - sorted positions: iterables
+    '''
+    left = iter(left)
+    closest = next(left, None)  # the first position of left >= the position of right - k
+    for position in right:
+        while closest is not None and closest < position - k:
+            closest = next(left, None)
+        if closest is None:
+            return
+        if closest <= position + k:
+            yield position
+
+
+def positions_of(candidates, terms, postings):
+    '''
+    Return the doc ID -> term -> sorted positions of the terms in the
+    candidate documents, reading the positions of those documents only
+
+    @param candidates - doc IDs containing all the terms
+    @param postings - term -> doc ID -> PhrasalToken (pickled postings), or
+                      Columns (columnar postings)
+    '''
+    positions = defaultdict(dict)
+    for term in terms:
+        term_postings = postings[term]
+        if hasattr(term_postings, "positions_in"):  # Columns: decoded for the candidates
+            found = term_postings.positions_in(candidates)
+        else:
+            found = {doc_id: term_postings[doc_id].pos for doc_id in candidates if doc_id in term_postings}
+        for doc_id, pos in found.items():
+            positions[doc_id][term] = pos
+    return positions
+
+
+def match(phrases, distances, positions, count=False):
+    '''
+    Return the number of matches of a query in a document, or with count
+    False 1 at its first match, 0 if none
+
+    @param phrases, distances - the query, as returned by split_tokens()
+    @param positions - term -> sorted positions in the document: dict
+    '''
+    if not phrases:
+        return 0
+    starts = phrase([positions.get(term, []) for term in phrases[0]])
+    for words, k in zip(phrases[1:], distances):
+        starts = near(starts, phrase([positions.get(term, []) for term in words]), k)
+    if count:
+        return sum(1 for _ in starts)
+    return 1 if next(starts, None) is not None else 0
@@ -0,0 +1,92 @@
+'''
+Ranking of scored documents, without sorting all of them:
+    top_k(scores, k, tiebreak) := the k best (doc ID, score) of a mapping
+        of doc ID -> score (e.g. a Counter) or of (doc ID, score) pairs,
+        best first, by partial selection with a heap of size k: O(n log k)
+        instead of O(n log n) for the n scored documents, and k of them
+        kept instead of a sorted copy of all; k None ranks all of them
+    TopK := an accumulator of the k best documents offered one at a time
+        (scoring document at a time, maxscore.py), in a min-heap of size k
+        whose root is the k-th best: its threshold is the score a document
+        has to beat to enter
+
+Documents of the same score are ranked by tiebreak(doc ID), smaller
+first, or else in the order they are given, like Counter.most_common().
+'''
+import heapq
+from operator import itemgetter
+
+
+def top_k(scores, k, tiebreak=None):
+    '''
+    Return the k best (doc ID, score), best first
+
+    @param scores - doc ID -> score, or (doc ID, score) pairs
+    @param k - number of documents, None for all: int
+    @param tiebreak - key of the doc IDs ranking the documents of the same
+                      score, smaller first; None for the order of scores
+    '''
+    items = scores.items() if hasattr(scores, "items") else scores
+    if tiebreak is None:
+        if k is None:
+            return sorted(items, key=itemgetter(1), reverse=True)
+        return heapq.nlargest(k, items, key=itemgetter(1))
+    key = lambda item: (-item[1], tiebreak(item[0]))
+    if k is None:
+        return sorted(items, key=key)
+    return heapq.nsmallest(k, items, key=key)
+
+
+def negate(tie):
+    ''' Return the reverse order of a tie: a number or a tuple of numbers '''
+    if isinstance(tie, tuple):
+        return tuple(-x for x in tie)
+    return -tie
+
+
+class TopK(object):
+    ''' the k best of the documents pushed one at a time '''
+
+    def __init__(self, k, tiebreak=None):
+        '''
+        @param k - number of documents kept: int
+        @param tiebreak - as for top_k()
+        '''
+        self.k = k
+        self.tiebreak = tiebreak
+        self.heap = []  # (score, negated tie, doc ID), the k-th best at the root
+        self.pushed = 0
+
+    def __len__(self):
+        return len(self.heap)
+
+    @property
+    def threshold(self):
+        ''' the score of the k-th best document, None while there are fewer '''
+        if self.k > 0 and len(self.heap) == self.k:
+            return self.heap[0][0]
+        return None
+
+    def push(self, doc_id, score, tie=None):
+        '''
+        Offer a document, Return whether it is in the top k
+
+        @param tie - rank of the document among those of the same score,
+                     smaller first: a number or a tuple of numbers;
+                     tiebreak(doc_id), or the order of the pushes, by default
+        '''
+        if tie is None:
+            tie = self.pushed if self.tiebreak is None else self.tiebreak(doc_id)
+        self.pushed += 1
+        entry = (score, negate(tie), doc_id)
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, entry)
+            return True
+        if self.k > 0 and entry > self.heap[0]:
+            heapq.heapreplace(self.heap, entry)
+            return True
+        return False
+
+    def items(self):
+        ''' Return the (doc ID, score) of the top k, best first '''
+        return [(doc_id, score) for (score, _, doc_id) in sorted(self.heap, reverse=True)]
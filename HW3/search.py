@@ -1,20 +1,27 @@
 #!/usr/bin/python3
 import getopt
+import os
 import re
 import string
 import sys
 from collections import Counter, defaultdict
+from itertools import chain
 from math import log10 as log
-import array
+from multiprocessing import Pool
 
 import nltk
-from nltk.corpus import stopwords
-from nltk.stem import PorterStemmer
-from nltk.stem.wordnet import WordNetLemmatizer
 from nltk.tokenize import sent_tokenize, word_tokenize
 
 
-from utils import Entry, Posting, Token, get_tf, normalize, preprocess
+from columnar import score_columns, top_scores
+from intersect import intersect_many
+from kgram import KgramIndex
+from maxscore import maxscore_top_k
+from normalizer import get_normalizer, load_tables, save_tables, stats
+from phrase import is_operator, match, operator_token, positions_of, split_near, split_tokens
+from ranking import top_k
+from termdict import load_dictionary
+from utils import Entry, MappedPosting, Posting, Token, get_tf, normalize, preprocess, shard_path
 
 try:
     import cPickle as pickle
@@ -23,33 +30,64 @@ except ImportError:
 
 TOP_K = 10
 phrasal_query = False
+mapped = False  # mmap the postings file instead of seek() / read()
+table_file = None  # file of the normalization tables, read before and written after the search
+shards = 1  # shards of the index written by index.py --shards
+workers = os.cpu_count() or 1  # processes scoring the queries on the shards
+kgram_file = None  # k-gram index written by index.py -k, to expand the wildcard words of the queries
+exhaustive = False  # score every posting term-at-a-time instead of MaxScore
 
+WILDCARD_WORD = re.compile(r"[\w*]*(?:\w\*|\*\w)[\w*]*")  # comput*, *ology
 
-def get_term_freq(query):
+
+def get_term_freq(query, kgrams=None):
     ''' 
     Tokenize a given query, and do stemming.
-    Count the term frequency in the query
+    Count the term frequency in the query.
+    With a k-gram index, the wildcard words of the query are expanded into
+    the terms they match, each counted once, and left out of the tokens
+    (and of the phrase with -x). The NEAR/k operators of the query are
+    kept among the tokens, as operator tokens (phrase.py), but not counted.
 
     @param query The query string: str
+    @param kgrams The k-gram index of the terms: KgramIndex, or None
     @return tokens A list contains all the tokens appeared in the query string: list[str]
             term_count A dictionary where records the counts of the terms in the query: DefaultDict[str: int]
     '''
 
-    # tokenize the query string
-    tokens = [word for sent in sent_tokenize(query) for word in word_tokenize(sent)]
-
-    # stem the tokens
-    ps = PorterStemmer()
-    tokens = [ps.stem(token.lower()) for token in tokens]
+    normalize_word = get_normalizer()
+    expanded = []
+    if kgrams is not None:
+        for pattern in WILDCARD_WORD.findall(query):
+            expanded.extend(kgrams.expand(pattern.lower(), normalize_word))
+        query = WILDCARD_WORD.sub(" ", query)
+
+    # tokenize the query string, the words between the NEAR/k operators
+    # (with -x) joined by their operator tokens
+    parts, distances = split_near(query)
+    if distances:  # "fertility treatment" NEAR/5 clinic
+        parts = [part.strip().strip('"') for part in parts]
+    tokens = []
+    for i, part in enumerate(parts):
+        if i > 0:
+            tokens.append(operator_token(distances[i - 1]))
+
+        # stem the tokens (memoised, shared by the whole process)
+        tokens.extend(normalize_word(word.lower())
+                      for sent in sent_tokenize(part) for word in word_tokenize(sent))
     # tokens = [ps.stem(token.lower()) for token in query.split()]
 
     # get the term count
     term_count = defaultdict(int)
     for token in tokens:
-        term_count[token] += 1
+        if not is_operator(token):
+            term_count[token] += 1
+    # OR of the terms matching the wildcards
+    for term in expanded:
+        term_count[term] += 1
 
     # get the set of tokens
-    terms = list(set(tokens))
+    terms = list(set(token for token in tokens if not is_operator(token)))
 
     return tokens, terms, term_count
 
@@ -71,118 +109,60 @@ def interection(terms, postings_dict):
     ''' perform posting list intersection to retrieve a list of candidate doc IDs '''
     if len(terms) == 0:
         return []
-            
-    # optimize the order of the merge
-    costs = list()
+
+    lists = list()
     for term in terms:
         try:
-            doc_ids = list(postings_dict[term].keys())
-        except: # some might be empty Token, which can go wrong
-            doc_ids = []
-        costs.append((term, len(doc_ids)))
-    costs.sort(key = lambda key: key[1])
-
-    # initial result, assigned as the posting list of the first term
-    try:
-        result = sorted(list(postings_dict[costs[0][0]].keys()))
-    except:
-        result = []
+            lists.append(sorted(postings_dict[term].keys()))
+        except:  # some might be empty Token, which can go wrong
+            lists.append([])
 
-    ''' perform pairwise merge '''
-    for i in range(1, len(costs)):
-        term = costs[i][0]
+    # merge from the shortest list, picking linear merge or galloping
+    # search by the ratio of the list lengths
+    return intersect_many(lists)
 
-        try:
-            postings = sorted(list(postings_dict[term].keys()))
-        except:  # some might be empty Token, which can go wrong
-            postings = []
-
-        p1 = p2 = 0
-        len1, len2 = len(result), len(postings)
-        temp = array.array('i')
-        while p1 < len1 and p2 < len2:
-            doc1 = result[p1]
-            doc2 = postings[p2]
-            if doc1 == doc2:
-                temp.append(doc1)
-                p1, p2 = p1 + 1, p2 + 1
-            elif doc1 < doc2:
-                p1 += 1
-            else:
-                p2 += 1
-        result = temp
-
-    return list(result)
-
-def verify(candidate, tokens, postings_dict):
+def verify(candidate, tokens, postings_dict, count=False):
     ''' 
-    see if the qeury is in the candidate file, as the terms 
-    should appear one by one, side by side 
+    see if the query is in the candidate file, as the terms of a phrase
+    should appear one by one, side by side, and the phrases joined by
+    NEAR/k within k words of each other, by merging the positions of the
+    terms in each candidate (phrase.py)
 
     @param candidate The candidate doc IDs
-    @param tokens The stemmed words list in the query
+    @param tokens The stemmed words list in the query, with its NEAR/k operators
     @param postings_dict The dictionary containing the pos info
+    @param count Return the doc ID -> number of matches of the documents
+                 matching, instead of stopping at the first match of each
     '''
-    if len(tokens) <= 1:
+    if len(tokens) <= 1 and not count:
         return candidate
 
-    positions = defaultdict(dict)
-    candidate = set(candidate)
+    phrases, distances = split_tokens(tokens)
+    positions = positions_of(candidate, set(chain.from_iterable(phrases)), postings_dict)
+    if count:
+        matches = {doc_id: match(phrases, distances, positions[doc_id], count=True) for doc_id in candidate}
+        return {doc_id: n for doc_id, n in matches.items() if n > 0}
+    return [doc_id for doc_id in candidate if match(phrases, distances, positions[doc_id])]
 
-    # get postions for docs
-    for i, token in enumerate(tokens):
-        try:
-            for doc_id, val in postings_dict[token].items():
-                if doc_id in candidate:
-                    positions[doc_id][i] = val.pos
-        except:
-            continue
-
-    # judging every doc
-    ans = []
-    flag = False
-    for doc in positions.keys():
-        term1_positions = positions[doc][0]
-        length = len(positions[doc].keys())
-        for pos in term1_positions:
-            for i in range(1,length):
-                if (pos+i) in positions[doc][i]:
-                    flag = True
-                else:
-                    flag = False
-                    break
-        if flag == True:
-            ans.append(doc)
-
-    return ans
-
-
-def find_10_most_relevant(query, dictionary, postings, num_of_doc):
+
+def query_vector(query, dictionary, num_of_doc, kgrams=None):
     '''
-    Compute cosine similarity between the query and each document, i.e.,
-    the lnc tf-idf for the tuples (term, frequency).
-    Compute the score for each document containing one of those terms in 
-    the query.
-    Return (at most) 10 most relavant document id (sorted) by score.
+    Tokenize and stem a query, and weight its terms: the ltc tf-idf of
+    each term, normalized.
 
     @param query - The query string: str
     @param dictonary - The dictionary containing the doc frequency of a
                         token: DefaultDict[int, Entry]
-    @param postings - The postings dictionary containing a mapping of 
-                        doc ID to the weight for a given token: Posting
     @param num_of_doc - The number of the documents indexed
+    @param kgrams - The k-gram index expanding the wildcard words: KgramIndex, or None
+    @return tokens, terms and the list of (term, query weight)
     '''
 
     '''
     Get tokens (stemmed words in the query), terms (set of tokens), 
     and the dictionary of term frequency in the query: DefaultDict[str, int]
     '''
-    tokens, terms, term_freq = get_term_freq(query)
-    
-    if phrasal_query:
-        doc_candidate = interection(terms, postings)
-        doc_to_rank = verify(doc_candidate, tokens, postings)
-
+    tokens, terms, term_freq = get_term_freq(query, kgrams)
 
     # Compute cosine similarity between the query and each document,
     # with the weights follow the tf×idf calculation, and then do
@@ -190,19 +170,160 @@ def find_10_most_relevant(query, dictionary, postings, num_of_doc):
     query_weight = normalize([get_tf(freq) * get_idf(num_of_doc, dictionary[term].frequency)
                             for (term, freq) in term_freq.items()])
 
-    # Compute the score for each document containing one of those
-    # terms in the query.
+    return tokens, terms, list(zip(term_freq, query_weight))
+
+
+def query_postings(tokens, terms, weights, postings):
+    '''
+    Read the postings of the terms of a query.
+
+    @param tokens, terms, weights - The query, as returned by query_vector
+    @param postings - The postings dictionary containing a mapping of 
+                        doc ID to the weight for a given token: Posting
+    @return lists - (query weight, postings, max weight) of the terms that
+                    score documents, in the order of weights
+            allowed - the doc IDs matching the phrase with -x, else None: set
+    '''
+    # read the postings of all query terms in a few large reads
+    postings.prefetch(term for (term, _) in weights)
+
+    # a query of wildcard words only has no phrase to match
+    allowed = None
+    if phrasal_query and len(tokens) > 0:
+        doc_candidate = interection(terms, postings)
+        allowed = set(verify(doc_candidate, tokens, postings))
+
+    # a shard may have no document with a term of the collection
+    lists = [(q_weight, postings[term], postings.dictionary[term].max_weight)
+             for (term, q_weight) in weights
+             if q_weight > 0 and term in postings.dictionary]
+    return lists, allowed
+
+
+def score_documents(lists, allowed=None):
+    '''
+    Compute the score for each document containing one of the terms
+    in the query, term at a time.
+
+    @param lists, allowed - The postings of the query, as returned by query_postings
+    @return score: Counter[int, float]
+    '''
     score = Counter()
-    for ((term, _), q_weight) in zip(term_freq.items(), query_weight):
-        if q_weight > 0:
-            ''' get the postings lists of the term, update the score '''
-            for doc_id, value in postings[term].items():
-                if phrasal_query and (doc_id not in doc_to_rank):
-                    continue
-                score[doc_id] += q_weight * value.weight
+    for (q_weight, term_postings, _) in lists:
+        ''' get the postings lists of the term, update the score '''
+        for doc_id, value in term_postings.items():
+            if allowed is not None and (doc_id not in allowed):
+                continue
+            score[doc_id] += q_weight * value.weight
+    return score
+
+
+def rank_documents(tokens, terms, weights, postings):
+    '''
+    Return the (at most) TOP_K (doc ID, score) of a query, best first.
+
+    The documents are scored at a time with MaxScore (maxscore.py), which
+    skips the documents that cannot enter the top TOP_K, and gives the
+    same ranking as scoring all of them term at a time, which is done with
+    -a, for an index without the max weights of the terms, and with -x:
+    the few documents matching the phrase seldom fill the top TOP_K, so
+    that nothing would be skipped. Columnar postings (index.py -c) are
+    scored term at a time into an array, vectorised (columnar.py).
+
+    @param tokens, terms, weights - The query, as returned by query_vector
+    @param postings - The postings dictionary: Posting
+    '''
+    lists, allowed = query_postings(tokens, terms, weights, postings)
+    if postings.slots is not None and not exhaustive:
+        scores = score_columns([(q_weight, columns) for (q_weight, columns, _) in lists],
+                               postings.slots, allowed)
+        return top_scores(scores, TOP_K)
+    if exhaustive or allowed is not None or any(max_weight == 0 for (_, _, max_weight) in lists):
+        return top_k(score_documents(lists, allowed), TOP_K)
+    return maxscore_top_k(lists, TOP_K, allowed)[0]
+
+
+def find_10_most_relevant(query, dictionary, postings, num_of_doc, kgrams=None):
+    '''
+    Compute cosine similarity between the query and each document, i.e.,
+    the lnc tf-idf for the tuples (term, frequency).
+    Compute the score for each document containing one of those terms in 
+    the query.
+    Return (at most) 10 most relavant document id (sorted) by score.
+
+    @param query - The query string: str
+    @param dictonary - The dictionary containing the doc frequency of a
+                        token: DefaultDict[int, Entry]
+    @param postings - The postings dictionary containing a mapping of 
+                        doc ID to the weight for a given token: Posting
+    @param num_of_doc - The number of the documents indexed
+    @param kgrams - The k-gram index expanding the wildcard words: KgramIndex, or None
+    '''
+    tokens, terms, weights = query_vector(query, dictionary, num_of_doc, kgrams)
 
     ''' rank and get result '''
-    return [doc_id for (doc_id, _) in score.most_common(TOP_K)]
+    return [doc_id for (doc_id, _) in rank_documents(tokens, terms, weights, postings)]
+
+
+def load_kgrams(path):
+    ''' Return the KgramIndex written by index.py -k to path, None without -k '''
+    if path is None:
+        return None
+    with open(path, mode="rb") as kgram_in:
+        return KgramIndex.load(kgram_in)
+
+
+def set_options(options):
+    ''' set the options of the command line in a worker process '''
+    globals().update(options)
+
+
+def search_shard(task):
+    '''
+    Score the queries on the k-th shard, run by a worker process
+
+    @param task - (k, dictionary file, postings file, list of query_vector)
+    @return the (at most) TOP_K (doc ID, score) of the shard, for each query
+    '''
+    k, dict_file, postings_file, vectors = task
+    with open(shard_path(dict_file, k), mode="rb") as dictionary_file,\
+            open(shard_path(postings_file, k), mode="rb") as posting_file:
+        pickle.load(dictionary_file)  # number of documents of the shard
+        dictionary = load_dictionary(dictionary_file, Entry, Entry)  # pickled, or front-coded by index.py -f
+        if mapped:
+            postings = MappedPosting(dictionary, posting_file)
+        else:
+            postings = Posting(dictionary, posting_file)
+        return [rank_documents(tokens, terms, weights, postings)
+                for tokens, terms, weights in vectors]
+
+
+def run_shards(dict_file, postings_file, queries_file, results_file):
+    '''
+    Perform searching on the shards written by index.py --shards: the
+    query weights are computed once from the statistics of the whole
+    collection (the dictionary file), every shard scores its documents in
+    a pool of processes, and the top TOP_K of the shards are merged.
+    '''
+    with open(dict_file, mode="rb") as dictionary_file,\
+            open(queries_file, encoding="utf8") as q_in:
+        num_of_doc = pickle.load(dictionary_file)
+        dictionary = load_dictionary(dictionary_file, Entry, Entry)  # pickled, or front-coded by index.py -f
+        kgrams = load_kgrams(kgram_file)
+        vectors = [query_vector(query, dictionary, num_of_doc, kgrams) for query in q_in]
+
+    options = {"phrasal_query": phrasal_query, "mapped": mapped, "exhaustive": exhaustive}
+    pool = Pool(min(workers, shards), initializer=set_options, initargs=(options,))
+    shard_results = pool.map(search_shard, [(k, dict_file, postings_file, vectors)
+                                            for k in range(shards)])
+    pool.close()
+    pool.join()
+
+    with open(results_file, mode="w", encoding="utf8") as q_out:
+        for tops in zip(*shard_results):
+            # global top-k of the local ones, as the scores only depend on the document
+            best = top_k(chain(*tops), TOP_K)
+            print(*[doc_id for (doc_id, _) in best], end='\n', file=q_out)
 
 
 def run_search(dict_file, postings_file, queries_file, results_file):
@@ -212,6 +333,10 @@ def run_search(dict_file, postings_file, queries_file, results_file):
     """
     print('running search on the queries...')
 
+    if shards > 1:
+        run_shards(dict_file, postings_file, queries_file, results_file)
+        return
+
     with open(dict_file, mode="rb") as dictionary_file,\
             open(postings_file, mode="rb") as posting_file,\
             open(queries_file, encoding="utf8") as q_in,\
@@ -224,8 +349,12 @@ def run_search(dict_file, postings_file, queries_file, results_file):
         - postings  -> list of tuples (doc ID, token frequency)
         '''
         num_of_doc = pickle.load(dictionary_file)
-        dictionary = pickle.load(dictionary_file)
-        postings = Posting(dictionary, posting_file)
+        dictionary = load_dictionary(dictionary_file, Entry, Entry)  # pickled, or front-coded by index.py -f
+        if mapped:
+            postings = MappedPosting(dictionary, posting_file)
+        else:
+            postings = Posting(dictionary, posting_file)
+        kgrams = load_kgrams(kgram_file)
 
         ''' 
         process query, and write the query result (i.e., the 10 
@@ -233,45 +362,72 @@ def run_search(dict_file, postings_file, queries_file, results_file):
         '''
         for query in q_in:
             print(*find_10_most_relevant(query, dictionary,
-                                         postings, num_of_doc), end='\n', file=q_out)
+                                         postings, num_of_doc, kgrams), end='\n', file=q_out)
 
 
 def usage():
     # test on my PC: $python3 search.py -d dictionary.txt -p postings.txt -q queries.txt -o output.txt
     # test on my PC: $python3 search.py -d dictionary.txt -p postings.txt -q queries.txt -o output.txt -x
     print("usage: " +
-          sys.argv[0] + " -d dictionary-file -p postings-file -q file-of-queries -o output-file-of-results")
+          sys.argv[0] + " -d dictionary-file -p postings-file -q file-of-queries -o output-file-of-results [-x] [-m] [-a] [-t table-file] [-k kgram-file] [--shards N [--workers N]]")
     print("tips:\n"
           "  -d  dictionary file path\n"
           "  -p  postings file path\n"
           "  -q  queries file path\n"
           "  -o  search results file path\n"
-          "  -x  enable phrasal query\n")
+          "  -x  enable phrasal query\n"
+          "  -m  memory-map the postings file\n"
+          "  -a  score all the postings term at a time, instead of skipping documents with MaxScore\n"
+          "  -t  start from the normalization table of table-file, and save it there\n"
+          "  -k  expand the wildcard words of the queries (comput*, *ology) with the k-gram index written by index.py -k\n"
+          "  --shards  search the N shards written by index.py --shards in a pool of processes\n"
+          "  --workers  processes of the pool, the number of CPUs by default\n")
 
-dictionary_file = postings_file = file_of_queries = output_file_of_results = None
+# worker processes import this module: only run the command line in the main process
+if __name__ == "__main__":
 
-try:
-    opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:o:x')
-except getopt.GetoptError:
-    usage()
-    sys.exit(2)
-
-for o, a in opts:
-    if o == '-d':
-        dictionary_file = a
-    elif o == '-p':
-        postings_file = a
-    elif o == '-q':
-        file_of_queries = a
-    elif o == '-o':
-        file_of_output = a
-    elif o == '-x':
-        phrasal_query = True
-    else:
-        assert False, "unhandled option"
+    dictionary_file = postings_file = file_of_queries = output_file_of_results = None
 
-if dictionary_file == None or postings_file == None or file_of_queries == None or file_of_output == None:
-    usage()
-    sys.exit(2)
-
-run_search(dictionary_file, postings_file, file_of_queries, file_of_output)
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:o:xmat:k:', ['shards=', 'workers='])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-d':
+            dictionary_file = a
+        elif o == '-p':
+            postings_file = a
+        elif o == '-q':
+            file_of_queries = a
+        elif o == '-o':
+            file_of_output = a
+        elif o == '-x':
+            phrasal_query = True
+        elif o == '-m':
+            mapped = True
+        elif o == '-a':
+            exhaustive = True
+        elif o == '-t':
+            table_file = a
+        elif o == '-k':
+            kgram_file = a
+        elif o == '--shards':
+            shards = int(a)
+        elif o == '--workers':
+            workers = int(a)
+        else:
+            assert False, "unhandled option"
+
+    if dictionary_file == None or postings_file == None or file_of_queries == None or file_of_output == None:
+        usage()
+        sys.exit(2)
+
+    if table_file:
+        load_tables(table_file)
+    run_search(dictionary_file, postings_file, file_of_queries, file_of_output)
+    if table_file:
+        save_tables(table_file)
+    for line in stats():
+        print(line)
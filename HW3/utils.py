@@ -1,10 +1,14 @@
 import math
+import mmap
+import os
 import re
 import string
 from collections import namedtuple
 from math import log10 as log
 from math import sqrt
 
+from columnar import decode, read_header
+
 try:
     import cPickle as pickle
 except ImportError:
@@ -77,10 +81,11 @@ def normalize(list_to_norm):
 '''
 Entry := an entry of the dictionary, containing the frequency of 
 the token, the offset of the postings file, the size of the list
-(of docIDs) corresponding inside the postings file
+(of docIDs) corresponding inside the postings file, and the largest
+weight of the token in a document (0 in the indexes of earlier versions)
 '''
-Entry = namedtuple("Entry", ['frequency', 'offset', 'size'])
-Entry.__new__.__defaults__ = (0, 0, 0)
+Entry = namedtuple("Entry", ['frequency', 'offset', 'size', 'max_weight'])
+Entry.__new__.__defaults__ = (0, 0, 0, 0.0)
 
 
 '''
@@ -92,6 +97,59 @@ Token.__new__.__defaults__ = (0, 0)
 PhrasalToken = namedtuple("PhrasalToken", ['frequency', "pos", 'weight'])
 PhrasalToken.__new__.__defaults__ = (0, [], 0)
 
+
+def shard_ranges(file_names, shards):
+    '''
+    Split the sorted doc IDs into shards contiguous ranges of about the
+    same number of docs
+
+    @param file_names: list[int]
+    @return list[list[int]]
+    '''
+    return [file_names[k * len(file_names) // shards:(k + 1) * len(file_names) // shards]
+            for k in range(shards)]
+
+
+def shard_path(path, k):
+    '''
+    Return the file of the k-th shard of an index file written by
+    index.py --shards
+    '''
+    return "%s.%d" % (path, k)
+
+
+# coalesce() and the read_run() of Posting and MappedPosting are the same in HW2, HW3 and HW4
+COALESCE_GAP = 64 * 1024  # postings at most this many bytes apart are read together
+MAX_RUN_BYTES = 4 * 1024 * 1024  # a read of more postings stops at about this size
+MAX_RUN_LISTS = 512  # and at this many postings, half of the usual IOV_MAX of preadv()
+
+
+def coalesce(extents, gap=COALESCE_GAP):
+    '''
+    Group the (term, offset, size) extents of postings into runs of nearby
+    postings, each read with a single read: in offset order, postings
+    starting at most gap bytes after the end of the current run join it
+
+    @param extents: list[(str, int, int)]
+    @return list of runs, lists of extents sorted by offset
+    '''
+    runs = []
+    run, start, end = [], 0, 0
+    for extent in sorted(extents, key=lambda extent: extent[1]):
+        _, offset, size = extent
+        if run and (offset - end > gap or offset + size - start > MAX_RUN_BYTES
+                    or len(run) >= MAX_RUN_LISTS):
+            runs.append(run)
+            run = []
+        if not run:
+            start = end = offset
+        run.append(extent)
+        end = max(end, offset + size)
+    if run:
+        runs.append(run)
+    return runs
+
+
 ############################################
 ##########     Class: Posting    ###########
 ############################################
@@ -114,6 +172,10 @@ class Posting(object):
         '''
         self.dictionary = dicionary
         self.posting_file = posting_file
+        self.prefetched = dict()  # term -> postings of the current query, see prefetch
+        self.reads = 0  # reads of the postings file
+        # the largest doc ID + 1 of columnar postings (index.py -c), None when pickled
+        self.slots = read_header(posting_file)
 
     def __getitem__(self, term):
         '''
@@ -125,9 +187,125 @@ class Posting(object):
         @param term: int
         @return Term(token_freq, weight)
         '''
-        if term in self.dictionary:
-            val = self.dictionary[term]  # val: Entry
-            self.posting_file.seek(val.offset)
-            return pickle.loads(self.posting_file.read(val.size))
+        if term in self.prefetched:
+            return self.prefetched[term]
+        val = self.dictionary.get(term)  # val: Entry
+        # the defaultdict has empty entries of the query terms not indexed
+        if val is not None and val.size > 0:
+            return self.load(self.read(val))
         else:
             return Token(0, 0)
+
+    def read(self, val):
+        '''
+        Return the bytes of the postings stored at the given entry
+
+        @param val: Entry
+        @return bytes
+        '''
+        self.reads += 1
+        self.posting_file.seek(val.offset)
+        return self.posting_file.read(val.size)
+
+    def read_run(self, run):
+        '''
+        Return the bytes of each extent of a run, read at once
+
+        @param run: list[(str, int, int)], extents sorted by offset
+        @return list[bytes]
+        '''
+        self.reads += 1
+        start = run[0][1]
+        if hasattr(os, "preadv"):
+            # scatter the run into a buffer per postings, and per gap between them
+            buffers, bufs, cursor = [], [], start
+            for _, offset, size in run:
+                if offset > cursor:
+                    buffers.append(bytearray(offset - cursor))
+                buf = bytearray(size)
+                buffers.append(buf)
+                bufs.append(buf)
+                cursor = offset + size
+            os.preadv(self.posting_file.fileno(), buffers, start)
+            return bufs
+        end = max(offset + size for _, offset, size in run)
+        self.posting_file.seek(start)
+        buf = memoryview(self.posting_file.read(end - start))
+        return [buf[offset - start:offset - start + size] for _, offset, size in run]
+
+    def fetch_many(self, terms):
+        '''
+        Yield (term, postings) for each of the terms, reading the postings
+        with a few large reads of nearby byte ranges (see coalesce) in the
+        order of the postings file, and unpickling them in the same pass
+
+        @param terms: iterable of str
+        '''
+        extents = []
+        for term in set(terms):
+            val = self.dictionary.get(term)  # val: Entry
+            # the defaultdict has empty entries of the query terms not indexed
+            if val is not None and val.size > 0:
+                extents.append((term, val.offset, val.size))
+            else:
+                yield term, Token(0, 0)
+        for run in coalesce(extents):
+            for (term, _, _), buf in zip(run, self.read_run(run)):
+                yield term, self.load(buf)
+
+    def load(self, buf):
+        '''
+        Return the postings of a term from their bytes: a pickled dict, or
+        the Columns of columnar postings
+
+        @param buf: bytes
+        '''
+        if self.slots is not None:
+            return decode(buf)
+        return pickle.loads(buf)
+
+    def prefetch(self, terms):
+        '''
+        Load the postings of the terms of a query up front, replacing
+        those of the previous query
+
+        @param terms: iterable of str
+        '''
+        self.prefetched = dict()  # release the previous working set first
+        self.prefetched = dict(self.fetch_many(terms))
+
+
+class MappedPosting(Posting):
+    ''' 
+    A Posting that maps the whole postings file into memory once, 
+    and unpickles every postings from a slice of the mapping, so 
+    that no seek() / read() is done when querying.
+    '''
+
+    def __init__(self, dicionary, posting_file):
+        '''
+        @param dictionary: DefaultDict[str, Entry]
+        @param posting_file: txt file
+        '''
+        Posting.__init__(self, dicionary, posting_file)
+        self.buffer = memoryview(
+            mmap.mmap(posting_file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def read(self, val):
+        '''
+        Return a zero-copy view of the postings stored at the given entry
+
+        @param val: Entry
+        @return memoryview
+        '''
+        return self.buffer[val.offset:val.offset + val.size]
+
+    def read_run(self, run):
+        '''
+        Return zero-copy views of the extents of a run: the mapping
+        needs no reads
+
+        @param run: list[(str, int, int)], extents sorted by offset
+        @return list[memoryview]
+        '''
+        return [self.buffer[offset:offset + size] for _, offset, size in run]
@@ -0,0 +1,279 @@
+'''
+Columnar postings, written by index.py -c instead of the pickled dicts of
+doc ID -> Token: the postings of a term are parallel arrays of doc IDs
+(int32) and weights (float32), read as NumPy arrays over the bytes of the
+postings file instead of unpickled into a namedtuple a document. A query
+is scored by adding q_weight * weights of every term into a dense float32
+array of the scores of all the documents, indexed by doc ID, and its top k
+are selected with a partition of the array instead of a sort.
+
+The postings file is laid out as
+    MAGIC | int64 number of score slots (the largest doc ID + 1)
+    for every term, on a multiple of 4 bytes:
+        int32 number of documents n | int32 doc IDs[n] (sorted) | float32 weights[n]
+        [| int32 size of the lengths | lengths[n] | positions]
+        | padding to 4 bytes
+so that the arrays are aligned; Posting recognises it by MAGIC.
+
+With the positions (index.py -x of HW3, always in HW4), the positions of
+the term in a document are delta + variable-byte encoded (the gaps between
+them, 7 bits a byte, the last byte of a number with its high bit set, as
+vb_encode() of HW2), and lengths are the variable-byte sizes of those of
+each document. The offsets of the documents in positions are the sums of
+the lengths, computed with NumPy without reading the positions, so only
+the documents left by the intersection of the doc IDs have their positions
+decoded, all of them at once with NumPy (positions_in()).
+
+The weights are rounded to float32, so that the scores may differ from
+those of the pickled postings in the last digits, and documents of the
+same score are ranked by doc ID.
+'''
+import struct
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError:  # only the columnar postings need NumPy
+    np = None
+
+MAGIC = b"COLUMNAR"
+HEADER = struct.Struct("<q")  # after MAGIC: the number of score slots
+COUNT = struct.Struct("<i")  # the number of documents of a term
+DOC_ID, WEIGHT = "<i4", "<f4"
+
+'''
+ColumnToken := the (weight, positions) of a term in a document, as the
+Token of the pickled postings
+'''
+ColumnToken = namedtuple("ColumnToken", ['weight', 'pos'])
+ColumnToken.__new__.__defaults__ = (0, None)
+
+
+def require_numpy():
+    if np is None:
+        raise ImportError("the columnar postings of index.py -c need NumPy")
+
+
+def write_header(postings_file, slots):
+    ''' write the header of a columnar postings file, at its start '''
+    postings_file.write(MAGIC + HEADER.pack(slots))
+
+
+def read_header(postings_file):
+    '''
+    Return the number of score slots of a columnar postings file, or None
+    for pickled postings, keeping the position of the file
+    '''
+    position = postings_file.tell()
+    postings_file.seek(0)
+    header = postings_file.read(len(MAGIC) + HEADER.size)
+    postings_file.seek(position)
+    if len(header) == len(MAGIC) + HEADER.size and header.startswith(MAGIC):
+        return HEADER.unpack_from(header, len(MAGIC))[0]
+    return None
+
+
+def vb_encode(numbers):
+    ''' Return the variable-byte encoding of a list of numbers >= 0 '''
+    data = bytearray()
+    for number in numbers:
+        encoded = bytearray([number & 0x7f | 0x80])  # the last byte has the high bit set
+        number >>= 7
+        while number:
+            encoded.insert(0, number & 0x7f)
+            number >>= 7
+        data += encoded
+    return data
+
+
+def vb_decode(data):
+    '''
+    Return the numbers encoded by vb_encode() in an array of bytes,
+    vectorised: the 7 bits of every byte are shifted by 7 a byte left to
+    the end of its number, and the bytes of each number summed
+
+    @param data: numpy.ndarray of uint8
+    @return numpy.ndarray of int64
+    '''
+    ends = np.flatnonzero(data & 0x80)
+    if len(ends) == len(data):  # all the numbers below 128, a byte each
+        return (data & 0x7f).astype(np.int64)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    shifts = 7 * (np.repeat(ends, ends - starts + 1) - np.arange(len(data)))
+    return np.add.reduceat((data & 0x7f).astype(np.int64) << shifts, starts)
+
+
+def encode_positions(positions):
+    ''' Return the delta + variable-byte encoding of a sorted list of positions '''
+    return vb_encode([position - last for position, last in zip(positions, [0] + positions)])
+
+
+def encode(postings, positional=False):
+    '''
+    Return the bytes of the columns of the postings of a term
+
+    @param postings - doc ID -> Token (with pos if positional), in doc ID order: dict
+    '''
+    require_numpy()
+    doc_ids = np.fromiter(postings.keys(), dtype=DOC_ID, count=len(postings))
+    weights = np.fromiter((token.weight for token in postings.values()),
+                          dtype=WEIGHT, count=len(postings))
+    data = COUNT.pack(len(postings)) + doc_ids.tobytes() + weights.tobytes()
+    if positional:
+        blocks = [encode_positions(token.pos) for token in postings.values()]
+        lengths = vb_encode([len(block) for block in blocks])
+        data += COUNT.pack(len(lengths)) + lengths + b"".join(blocks)
+    return data + b"\0" * (-len(data) % 4)
+
+
+def decode(buf):
+    ''' Return the Columns of the bytes of a term written by encode(), without copying them '''
+    require_numpy()
+    n = COUNT.unpack_from(buf)[0]
+    doc_ids = np.frombuffer(buf, dtype=DOC_ID, count=n, offset=COUNT.size)
+    weights = np.frombuffer(buf, dtype=WEIGHT, count=n, offset=COUNT.size + 4 * n)
+    end = COUNT.size + 8 * n
+    if len(buf) - end <= 3:  # only the padding is left: no positions
+        return Columns(doc_ids, weights)
+    size = COUNT.unpack_from(buf, end)[0]
+    lengths = memoryview(buf)[end + COUNT.size:end + COUNT.size + size]
+    positions = memoryview(buf)[end + COUNT.size + size:]
+    return Columns(doc_ids, weights, lengths, positions)
+
+
+class Columns(object):
+    '''
+    the postings of a term: the arrays doc_ids and weights, and the
+    positions of the term in each document (with -x), encoded and
+    decoded a document at a time, with the keys() and items() of the
+    pickled dicts for the phrase matching
+    '''
+
+    def __init__(self, doc_ids, weights, lengths=None, positions=None):
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.lengths = lengths
+        self.positions = positions
+        self.offsets = None
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def keys(self):
+        return self.doc_ids.tolist()
+
+    def get_offsets(self):
+        ''' Return the offsets of the positions of each document, and of their end: numpy.ndarray '''
+        if self.offsets is None:
+            self.offsets = np.zeros(len(self.doc_ids) + 1, dtype=np.int64)
+            np.cumsum(vb_decode(np.frombuffer(self.lengths, dtype=np.uint8)), out=self.offsets[1:])
+        return self.offsets
+
+    def decode_positions(self, at):
+        '''
+        Return the lists of the positions of the term in the documents at
+        some indexes, decoded together: the bytes of those documents are
+        gathered, their gaps decoded at once and summed from 0 again at
+        the start of each document
+
+        @param at - indexes of the documents, in doc ID order: numpy.ndarray
+        '''
+        if len(at) == 0:
+            return []
+        offsets = self.get_offsets()
+        starts = offsets[at]
+        sizes = offsets[at + 1] - starts
+        firsts = np.cumsum(sizes) - sizes  # the first byte of each document in data
+        data = np.frombuffer(self.positions, dtype=np.uint8)[
+            np.arange(firsts[-1] + sizes[-1]) + np.repeat(starts - firsts, sizes)]
+        gaps = vb_decode(data)
+        counts = np.add.reduceat((data >> 7).astype(np.int64), firsts)  # positions a document
+        ends = np.cumsum(counts)
+        positions = np.cumsum(gaps)
+        positions -= np.repeat(positions[ends - counts] - gaps[ends - counts], counts)
+        positions = positions.tolist()
+        return [positions[end - count:end] for end, count in zip(ends.tolist(), counts.tolist())]
+
+    def get_positions(self, i):
+        ''' Return the list of the positions of the term in the i-th document, or None '''
+        if self.positions is None:
+            return None
+        return self.decode_positions(np.array([i]))[0]
+
+    def positions_in(self, doc_ids):
+        '''
+        Return the doc ID -> list of positions of the documents of doc_ids
+        with the term, decoding the positions of those only: dict
+        '''
+        wanted = np.fromiter(sorted(doc_ids), dtype=np.int64, count=len(doc_ids))
+        if self.positions is None or len(wanted) == 0 or len(self.doc_ids) == 0:
+            return {}
+        at = np.minimum(np.searchsorted(self.doc_ids, wanted), len(self.doc_ids) - 1)
+        at = at[self.doc_ids[at] == wanted]
+        return dict(zip(self.doc_ids[at].tolist(), self.decode_positions(at)))
+
+    def get_weights(self, doc_ids):
+        '''
+        Return the weights of the term in some documents, 0 in those
+        without it, by binary search in the doc IDs (in doc ID order)
+
+        @param doc_ids: numpy.ndarray
+        @return numpy.ndarray of float32
+        '''
+        at = np.minimum(np.searchsorted(self.doc_ids, doc_ids), len(self.doc_ids) - 1)
+        return np.where(self.doc_ids[at] == doc_ids, self.weights[at], 0)
+
+    def items(self):
+        weights = self.weights.tolist()
+        if self.positions is None:
+            tokens = [ColumnToken(weight) for weight in weights]
+        else:
+            positions = self.decode_positions(np.arange(len(weights)))
+            tokens = [ColumnToken(weight, pos) for weight, pos in zip(weights, positions)]
+        return zip(self.doc_ids.tolist(), tokens)
+
+
+def score_columns(lists, slots, allowed=None):
+    '''
+    Return the scores of all the documents of a query, as a dense array
+
+    @param lists - (query weight, Columns) of the terms of the query
+    @param slots - the largest doc ID + 1: int
+    @param allowed - the doc IDs that may be ranked (-x), None for all: set
+    @return numpy.ndarray of float32, indexed by doc ID
+    '''
+    require_numpy()
+    scores = np.zeros(slots, dtype=np.float32)
+    for q_weight, columns in lists:
+        # a doc ID appears once in the postings of a term: no need for np.add.at
+        scores[columns.doc_ids] += np.float32(q_weight) * columns.weights
+    if allowed is not None:
+        mask = np.zeros(slots, dtype=bool)
+        mask[np.fromiter(allowed, dtype=np.int64, count=len(allowed))] = True
+        scores[~mask] = 0
+    return scores
+
+
+def top_scores(scores, k):
+    '''
+    Return the k best (doc ID, score) of dense scores, best first: the
+    k-th best score is found by np.partition, and only the documents
+    scoring at least as much are sorted, by score then doc ID (unlike
+    argpartition, which would pick any of the documents tied at the k-th
+    score)
+
+    @param scores - scores indexed by doc ID, 0 for a document not scored: numpy.ndarray
+    '''
+    candidates = np.flatnonzero(scores)
+    if len(candidates) > k > 0:
+        kth = len(candidates) - k
+        threshold = np.partition(scores[candidates], kth)[kth]
+        candidates = candidates[scores[candidates] >= threshold]
+    best = candidates[np.lexsort((candidates, -scores[candidates]))[:max(k, 0)]]
+    return list(zip(best.tolist(), scores[best].tolist()))
+
+
+def scored(scores):
+    ''' Return the doc ID -> score of the documents with a score, in doc ID order: dict '''
+    doc_ids = np.flatnonzero(scores)
+    return dict(zip(doc_ids.tolist(), scores[doc_ids].tolist()))
@@ -5,11 +5,13 @@ import sys
 from collections import defaultdict
 
 import nltk
-from nltk.corpus import PlaintextCorpusReader, stopwords
-from nltk.stem import PorterStemmer
-from nltk.stem.wordnet import WordNetLemmatizer
+from nltk.corpus import PlaintextCorpusReader
 from nltk.tokenize import RegexpTokenizer, sent_tokenize, word_tokenize
 
+from normalizer import get_normalizer, load_tables, save_tables, stats
+import columnar
+import ngram
+from termdict import write_dictionary
 from utils import Entry, Token, PhrasalToken, normalize, get_tf, preprocess
 from uk2us import uk2us
 
@@ -22,6 +24,10 @@ except ImportError:
     import pickle
 
 phrasal_query = True  # operate phrase query
+front_coded = False  # write the dictionary as a sorted front-coded term dictionary (termdict.py)
+columnar_postings = False  # write the postings as arrays of doc IDs and weights (columnar.py)
+table_file = None  # file of the normalization tables, read before and written after the build
+ngram_file = None  # file of the biword and triword index of the phrases (ngram.py)
 
 def tokenize(paragraph):
     '''
@@ -49,29 +55,13 @@ def stemming(words, stopword=True, lemma=True):
     @param words: a list of strings
     @return stemmed_tokens: a list of strings
     '''
-    ps = PorterStemmer()
-    stemmed_tokens = list()  # multiple term entries in a single document are merged
-    stem_dict = defaultdict(dict)
+    # memoised for the whole process, not only within one document
+    normalize_word = get_normalizer(stopword, lemma)
+    stemmed_tokens = list()
     for w in words:
-        if w in stem_dict:
-            stemmed_tokens.append(stem_dict[w])
-            continue
-        if stopword:
-            stop_words = set(stopwords.words("english"))
-        else:  # stopword removal
-            stop_words = set()
-
-
-        if w not in stop_words:
-            # stemming
-            if lemma:
-                # lemmatization
-                lem = WordNetLemmatizer()
-                token = ps.stem(lem.lemmatize(w, "v"))
-            else:
-                token = ps.stem(w)
+        token = normalize_word(w)
+        if token is not None:  # not a stop word
             stemmed_tokens.append(token)
-            stem_dict[w] = token
     return stemmed_tokens
 
 
@@ -99,6 +89,7 @@ def build_index(in_dir, out_dict, out_postings):
 
     ''' Load corpus and generate the postings dictionary '''
     postings = defaultdict(dict)
+    phrase_postings = defaultdict(list)  # n-gram -> doc IDs, for ngram_file
     tokens = list()
     docsInfo = defaultdict(dict)
     # docs_to_terms = defaultdict(dict)
@@ -119,6 +110,9 @@ def build_index(in_dir, out_dict, out_postings):
         words = tokenize(uk2us(content))  # tokenization: content -> words
         tokens = stemming(words, stopword = True, lemma = True)  # stemming
         # docs_to_terms[docID] = tokens
+        if ngram_file:
+            for gram in ngram.ngrams(tokens):
+                phrase_postings[gram].append(docID)
 
         if phrasal_query:
             token_len = defaultdict(list)
@@ -169,6 +163,9 @@ def build_index(in_dir, out_dict, out_postings):
     # write postings file
     dictionary = defaultdict(Entry)
     with open(out_postings, mode="wb") as postings_file:
+        if columnar_postings:
+            # the scores of search.py are an array indexed by doc ID
+            columnar.write_header(postings_file, len(rows))
         for key, value in postings.items():
             '''
             len(value) := the document frequency of the token
@@ -176,8 +173,24 @@ def build_index(in_dir, out_dict, out_postings):
             offset := current writing position of the postings file
             '''
             offset = postings_file.tell()
-            pickle.dump(value, postings_file)
+            if columnar_postings:
+                postings_file.write(columnar.encode(value, phrasal_query))
+            else:
+                pickle.dump(value, postings_file)
             dictionary[key] = Entry(len(value), offset)
+        postings_size = postings_file.tell()
+
+    # write the n-gram file, and compare its size with the positions
+    if ngram_file:
+        with open(ngram_file, mode="wb") as phrase_file:
+            grams_size, dict_size = ngram.write_ngrams(phrase_postings, phrase_file)
+        words = defaultdict(int)
+        for gram in phrase_postings:
+            words[gram.count(" ") + 1] += 1
+        print("n-grams: %d biwords, %d triwords, %d postings" % (
+            words[2], words[3], sum(len(doc_ids) for doc_ids in phrase_postings.values())))
+        print("n-gram file: %.1f MB (postings %.1f MB, dictionary %.1f MB), positional postings %.1f MB" % (
+            (grams_size + dict_size) / 1e6, grams_size / 1e6, dict_size / 1e6, postings_size / 1e6))
 
     # write dictionary file
     with open(out_dict, mode="wb") as dictionary_file:
@@ -189,7 +202,10 @@ def build_index(in_dir, out_dict, out_postings):
         print("docsInfo done.")
         # pickle.dump(docs_to_terms, dictionary_file)
         # print("docs_to_terms done")
-        pickle.dump(dictionary, dictionary_file)
+        if front_coded:
+            write_dictionary(dictionary, dictionary_file)
+        else:
+            pickle.dump(dictionary, dictionary_file)
         print("dictionary done")
 
 
@@ -200,18 +216,22 @@ def usage():
     # supporting phrasal query:
     # $ python3 index.py -i /Users/yu/nltk_data/corpora/reuters/training/ -d dictionary.txt -p postings.txt -x
     print("usage: " +
-          sys.argv[0] + " -i directory-of-documents -d dictionary-file -p postings-file")
+          sys.argv[0] + " -i directory-of-documents -d dictionary-file -p postings-file [-x] [-f] [-c] [-b ngram-file] [-t table-file]")
     print("tips:\n"
           "  -i  directory of the reuters training data\n"
           "  -d  dictionary file path\n"
           "  -p  postings file path\n"
-          "  -x  enable phrasal query\n")
+          "  -x  enable phrasal query\n"
+          "  -f  write a sorted front-coded dictionary, memory-mapped by search.py\n"
+          "  -c  write columnar postings (arrays of doc IDs and weights, encoded positions), scored vectorised by search.py\n"
+          "  -b  write the biword and triword index of the phrases to ngram-file\n"
+          "  -t  start from the normalization table of table-file, and save it there\n")
 
 
 input_directory = output_file_dictionary = output_file_postings = None
 
 try:
-    opts, args = getopt.getopt(sys.argv[1:], 'i:d:p:x')
+    opts, args = getopt.getopt(sys.argv[1:], 'i:d:p:xfcb:t:')
 except getopt.GetoptError:
     usage()
     sys.exit(2)
@@ -225,6 +245,14 @@ for o, a in opts:
         output_file_postings = a
     elif o == '-x':  # operate phrase query
         phrasal_query = True
+    elif o == '-f':  # front-coded dictionary
+        front_coded = True
+    elif o == '-c':  # columnar postings
+        columnar_postings = True
+    elif o == '-b':  # n-gram file
+        ngram_file = a
+    elif o == '-t':  # normalization table file
+        table_file = a
     else:
         assert False, "unhandled option"
 
@@ -232,4 +260,10 @@ if input_directory == None or output_file_postings == None or output_file_dictio
     usage()
     sys.exit(2)
 
+if table_file:
+    load_tables(table_file)
 build_index(input_directory, output_file_dictionary, output_file_postings)
+if table_file:
+    save_tables(table_file)
+for line in stats():
+    print(line)
@@ -0,0 +1,131 @@
+'''
+Intersection of sorted postings lists (doc IDs).
+
+intersect() picks the merge by the ratio of the list lengths:
+    - linear_merge   := two-pointer merge, for lists of similar length
+    - skip_merge     := two-pointer merge following skip pointers, when the
+                        long list has them (see below)
+    - gallop_merge   := exponential search of every doc ID of the short list
+                        in the long list, when one list is much longer
+intersect_many() intersects k lists, shortest first.
+
+Skip pointers are given as an integer sequence `skips`, where skips[k] is
+the index that the skip pointer at index k*step jumps to, with
+step = floor(sqrt(length of the list)) (see HW2 utils.skip_targets).
+'''
+from bisect import bisect_left
+from math import floor, sqrt
+
+# thresholds on len(long list) / len(short list), timed in CPython on random lists
+LINEAR_RATIO = 4    # below: linear merge
+GALLOP_RATIO = 8    # from: galloping search, in between: skip pointers if any
+
+
+def linear_merge(l1, l2):
+    ''' intersect two sorted lists with a two-pointer merge '''
+    out = []
+    p1 = p2 = 0
+    len1, len2 = len(l1), len(l2)
+    while p1 < len1 and p2 < len2:
+        doc1, doc2 = l1[p1], l2[p2]
+        if doc1 == doc2:
+            out.append(doc1)
+            p1, p2 = p1 + 1, p2 + 1
+        elif doc1 < doc2:
+            p1 += 1
+        else:
+            p2 += 1
+    return out
+
+
+def follow_skips(ids, skips, step, index, compare_id):
+    ''' return the index after `index` when looking for compare_id, jumping along the skip pointers '''
+    jumped = index
+    while index % step == 0:
+        target = skips[index // step]
+        if target == index or ids[target] > compare_id:
+            break
+        index = target
+    return index if index != jumped else index + 1
+
+
+def skip_merge(l1, l2, skips1=None, skips2=None):
+    ''' intersect two sorted lists with a two-pointer merge that follows skip pointers '''
+    out = []
+    p1 = p2 = 0
+    len1, len2 = len(l1), len(l2)
+    step1 = max(int(floor(sqrt(len1))), 1)
+    step2 = max(int(floor(sqrt(len2))), 1)
+    while p1 < len1 and p2 < len2:
+        doc1, doc2 = l1[p1], l2[p2]
+        if doc1 == doc2:
+            out.append(doc1)
+            p1, p2 = p1 + 1, p2 + 1
+        elif doc1 < doc2:
+            if skips1 and p1 % step1 == 0:
+                p1 = follow_skips(l1, skips1, step1, p1, doc2)
+            else:
+                p1 += 1
+        else:
+            if skips2 and p2 % step2 == 0:
+                p2 = follow_skips(l2, skips2, step2, p2, doc1)
+            else:
+                p2 += 1
+    return out
+
+
+def gallop_merge(short, long):
+    ''' intersect a short sorted list with a long one, by exponential search in the long list '''
+    out = []
+    lo, n = 0, len(long)
+    for doc_id in short:
+        # double the probe distance until passing doc_id, then binary search
+        bound = 1
+        while lo + bound < n and long[lo + bound] < doc_id:
+            bound *= 2
+        lo = bisect_left(long, doc_id, lo + bound // 2, min(lo + bound + 1, n))
+        if lo == n:
+            break
+        if long[lo] == doc_id:
+            out.append(doc_id)
+            lo += 1
+    return out
+
+
+def intersect(l1, l2, skips1=None, skips2=None):
+    ''' intersect two sorted lists, choosing the merge by the ratio of their lengths '''
+    if len(l1) > len(l2):
+        l1, l2, skips1, skips2 = l2, l1, skips2, skips1
+    if len(l1) == 0:
+        return []
+    ratio = len(l2) / len(l1)
+    if ratio < LINEAR_RATIO:
+        return linear_merge(l1, l2)
+    if ratio < GALLOP_RATIO:
+        if skips1 or skips2:
+            return skip_merge(l1, l2, skips1, skips2)
+        return linear_merge(l1, l2)
+    return gallop_merge(l1, l2)
+
+
+def intersect_many(lists, skips=None):
+    '''
+    intersect k sorted lists, starting from the shortest one so that the
+    intermediate result stays as small as possible
+
+    @param lists: list of sorted lists of doc IDs
+    @param skips: optional list of the skip pointers of each list
+    '''
+    if len(lists) == 0:
+        return []
+    if skips is None:
+        skips = [None] * len(lists)
+    order = sorted(zip(lists, skips), key=lambda pair: len(pair[0]))
+    result, result_skips = order[0]
+    result = list(result)
+    for lst, lst_skips in order[1:]:
+        if len(result) == 0:
+            break
+        result = intersect(result, lst, result_skips, lst_skips)
+        result_skips = None
+    return result
@@ -0,0 +1,108 @@
+'''
+Biword and triword index of the phrases (index.py -b): the documents of
+every n consecutive tokens of a document, n in N, so that a phrase of 2 or
+3 words is answered by a single lookup instead of the intersection of the
+postings of its words and the matching of their positions (verify()).
+
+An n-gram is the stemmed tokens of n consecutive positions of the
+positional index joined by a space, e.g. "fertil treatment", so that the
+documents of the n-gram of a phrase are exactly those verify() finds. A
+longer phrase gets the intersection of the triwords covering it, as
+candidates to verify; a single word and NEAR/k are left to the positional
+index.
+
+The n-gram file is laid out as
+    int64 offset of the dictionary
+    the postings of every n-gram: the doc IDs of its documents, delta +
+        variable-byte encoded (columnar.vb_encode)
+    the front-coded dictionary of the n-grams (termdict.py):
+        n-gram -> NgramEntry(offset)
+and both are memory-mapped by NgramIndex. The postings of an n-gram end
+where those of the next n-gram start, or at the dictionary for the last
+one, so that the dictionary keeps a single int64 column: most n-grams are
+in one or two documents, and their postings are only a few bytes.
+'''
+import mmap
+import struct
+from collections import namedtuple
+
+from columnar import np, vb_decode, vb_encode
+from intersect import intersect_many
+from phrase import is_operator
+from termdict import load_dictionary, write_dictionary
+
+N = (2, 3)  # words of the n-grams: biwords and triwords
+HEADER = struct.Struct("<q")  # the offset of the dictionary
+
+'''
+NgramEntry := the offset of the postings of an n-gram in the n-gram file
+'''
+NgramEntry = namedtuple("NgramEntry", ['offset'])
+
+
+def ngrams(tokens):
+    ''' Return the set of the n-grams of a list of tokens '''
+    return {" ".join(tokens[i:i + n]) for n in N for i in range(len(tokens) - n + 1)}
+
+
+def write_ngrams(postings, ngram_file):
+    '''
+    Write the n-gram index at the start of a file
+
+    @param postings - n-gram -> doc IDs, in increasing order
+    @return the bytes of the postings and of the dictionary
+    '''
+    ngram_file.write(HEADER.pack(0))
+    dictionary = {}
+    # in the order of the dictionary, the UTF-8 bytes, for the ends of the postings
+    for gram in sorted(postings, key=lambda gram: gram.encode("utf8")):
+        doc_ids = postings[gram]
+        dictionary[gram] = NgramEntry(ngram_file.tell())
+        ngram_file.write(vb_encode([doc_id - last for doc_id, last in zip(doc_ids, [0] + doc_ids[:-1])]))
+
+    start = ngram_file.tell()
+    write_dictionary(dictionary, ngram_file)
+    end = ngram_file.tell()
+    ngram_file.seek(0)
+    ngram_file.write(HEADER.pack(start))
+    ngram_file.seek(end)
+    return start - HEADER.size, end - start
+
+
+class NgramIndex(object):
+    ''' the n-gram index of a file written by write_ngrams() '''
+
+    def __init__(self, ngram_file):
+        self.end = HEADER.unpack(ngram_file.read(HEADER.size))[0]
+        ngram_file.seek(self.end)
+        self.dictionary = load_dictionary(ngram_file, NgramEntry)
+        self.buffer = memoryview(mmap.mmap(ngram_file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def __getitem__(self, gram):
+        ''' Return the doc IDs of the documents with an n-gram, in increasing order '''
+        i = self.dictionary.index(gram)
+        if i < 0:
+            return []
+        start = self.dictionary.entry_at(i).offset
+        end = self.dictionary.entry_at(i + 1).offset if i + 1 < len(self.dictionary) else self.end
+        data = np.frombuffer(self.buffer[start:end], dtype=np.uint8)
+        return np.cumsum(vb_decode(data)).tolist()
+
+    def lookup(self, tokens):
+        '''
+        Return the doc IDs of the documents that may have the phrase of
+        the tokens, in increasing order, and whether they all have it: the
+        n-gram of a phrase of 2 or 3 words, or the intersection of the
+        triwords covering a longer one; None for a single word or NEAR/k
+
+        @param tokens - the stemmed words of the query, as for verify()
+        '''
+        if len(tokens) < min(N) or any(is_operator(token) for token in tokens):
+            return None, False
+        n = max(N)
+        if len(tokens) <= n:
+            return self[" ".join(tokens)], True
+        starts = list(range(0, len(tokens) - n + 1, n))
+        if starts[-1] != len(tokens) - n:
+            starts.append(len(tokens) - n)  # the last words
+        return intersect_many([self[" ".join(tokens[i:i + n])] for i in starts]), False
@@ -0,0 +1,141 @@
+'''
+Process-wide memo of term normalization (stop word removal, lemmatization,
+stemming), shared by index.py and search.py.
+
+get_normalizer() returns one TermNormalizer per configuration, so that the
+PorterStemmer, the WordNetLemmatizer and the set of stop words are built
+once per process, and every surface form is only normalized once: the
+results are kept in a bounded LRU table of surface form -> term (None for
+a stop word).
+
+The tables of all normalizers of a process can be saved to a file
+(save_tables) and loaded by the next run (load_tables), which then starts
+warm. stats() reports the hit rate and the estimated time saved, from the
+average time of a normalization that missed the table.
+'''
+import os
+import time
+from collections import OrderedDict
+
+from nltk.corpus import stopwords
+from nltk.stem import PorterStemmer
+from nltk.stem.wordnet import WordNetLemmatizer
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+TABLE_SIZE = 200000  # surface forms kept by each normalizer
+
+normalizers = dict()  # configuration -> TermNormalizer of this process
+loaded_tables = dict()  # configuration -> table read by load_tables, not yet used
+
+
+class TermNormalizer(object):
+    ''' normalize words to terms, remembering the most recent surface forms '''
+
+    def __init__(self, stopword=False, lemma=False, prepare=None, size=TABLE_SIZE):
+        self.stemmer = PorterStemmer()
+        self.lemmatizer = WordNetLemmatizer() if lemma else None
+        self.stop_words = set(stopwords.words("english")) if stopword else set()
+        self.prepare = prepare  # applied to a word before stemming, e.g. uk2us
+        self.size = size
+        self.table = OrderedDict()  # surface form -> term, least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.miss_time = 0  # seconds spent normalizing the misses
+        # misses and their time in the runs that built a loaded table, to estimate the time saved
+        self.past_misses = 0
+        self.past_miss_time = 0
+
+    def load(self, saved):
+        ''' start from a table written by save_tables '''
+        self.table.update(saved["terms"])
+        self.past_misses += saved["misses"]
+        self.past_miss_time += saved["miss_time"]
+
+    def save(self):
+        return {"terms": list(self.table.items()),
+                "misses": self.past_misses + self.misses,
+                "miss_time": self.past_miss_time + self.miss_time}
+
+    def time_saved(self):
+        ''' estimated seconds saved by the hits, at the average time of a miss '''
+        misses = self.misses + self.past_misses
+        if misses == 0:
+            return 0
+        return self.hits * (self.miss_time + self.past_miss_time) / misses
+
+    def __call__(self, word):
+        ''' Return the term of a word, or None if it is a stop word '''
+        table = self.table
+        if word in table:
+            table.move_to_end(word)
+            self.hits += 1
+            return table[word]
+
+        start = time.perf_counter()
+        if word in self.stop_words:
+            token = None
+        else:
+            token = self.prepare(word) if self.prepare else word
+            if self.lemmatizer:
+                token = self.lemmatizer.lemmatize(token, "v")
+            token = self.stemmer.stem(token)
+        self.miss_time += time.perf_counter() - start
+        self.misses += 1
+
+        table[word] = token
+        if len(table) > self.size:
+            table.popitem(last=False)
+        return token
+
+
+def get_normalizer(stopword=False, lemma=False, prepare=None):
+    '''
+    Return the normalizer of this process for a configuration
+
+    @param stopword: remove the English stop words
+    @param lemma: lemmatize (as a verb) before stemming
+    @param prepare: function applied to every word before stemming
+    '''
+    key = (stopword, lemma, prepare.__name__ if prepare else None)
+    if key not in normalizers:
+        normalizers[key] = TermNormalizer(stopword, lemma, prepare)
+        if key in loaded_tables:
+            normalizers[key].load(loaded_tables.pop(key))
+    return normalizers[key]
+
+
+def load_tables(path):
+    ''' read the tables saved by a previous run, if the file exists '''
+    if not os.path.exists(path):
+        return
+    with open(path, mode="rb") as table_file:
+        loaded_tables.update(pickle.load(table_file))
+    for key, normalizer in normalizers.items():
+        if key in loaded_tables:
+            normalizer.load(loaded_tables.pop(key))
+
+
+def save_tables(path):
+    ''' write the tables of all normalizers of this process '''
+    tables = dict(loaded_tables)  # keep the tables of configurations not used by this run
+    for key, normalizer in normalizers.items():
+        tables[key] = normalizer.save()
+    with open(path, mode="wb") as table_file:
+        pickle.dump(tables, table_file)
+
+
+def stats():
+    ''' Return a line per normalizer with its hit rate and the time saved '''
+    lines = []
+    for (stopword, lemma, prepare), normalizer in normalizers.items():
+        lookups = normalizer.hits + normalizer.misses
+        lines.append("normalizer (stopword=%s, lemma=%s, prepare=%s): %d hits, %d misses "
+                     "(%.1f%% hit rate), about %.2fs saved" % (
+                         stopword, lemma, prepare, normalizer.hits, normalizer.misses,
+                         100 * normalizer.hits / lookups if lookups else 0,
+                         normalizer.time_saved()))
+    return lines
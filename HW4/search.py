@@ -1,10 +1,10 @@
 #!/usr/bin/python3
-import array
 import getopt
 import re
 import string
 import sys
 from collections import Counter, defaultdict
+from itertools import chain
 from math import log10 as log
 from math import sqrt
 import nltk
@@ -14,7 +14,14 @@ from nltk.stem.wordnet import WordNetLemmatizer
 from nltk.tokenize import sent_tokenize, word_tokenize
 
 from uk2us import uk2us
-from utils import Entry, Posting, Token, get_tf, normalize, preprocess, getCourtsPriority
+from columnar import Columns, np, score_columns, scored, top_scores
+from intersect import intersect_many
+from ngram import NgramIndex
+from normalizer import get_normalizer, load_tables, save_tables, stats
+from phrase import is_operator, match, operator_token, positions_of, split_near, split_tokens
+from ranking import top_k
+from termdict import load_dictionary
+from utils import Entry, MappedPosting, Posting, Token, get_tf, normalize, preprocess, getCourtsPriority
 
 try:
     import cPickle as pickle
@@ -23,6 +30,9 @@ except ImportError:
 
 boolean_query = False
 phrasal_query = False
+mapped = False  # mmap the postings file instead of seek() / read()
+table_file = None  # file of the normalization tables, read before and written after the search
+ngram_file = None  # the biword and triword index of the phrases, by index.py -b
 
 lesk_on = False # set for using lesk algorithm
 expand = False # set for using query expansion
@@ -36,6 +46,11 @@ stemmer = PorterStemmer()
 stopWords = set(stopwords.words('english'))
 
 
+def query_form(token):
+    ''' the form of a query token that is stemmed: lowercase, US spelling '''
+    return uk2us(token.lower())
+
+
 def get_term_freq(query, stopword=True):
     ''' 
     Tokenize a given query, do stemming and uk2us translation.
@@ -47,31 +62,34 @@ def get_term_freq(query, stopword=True):
     '''
 
     global phrasal_query
-    # tokenize the query string
-    if '"' in query:
+    # tokenize the query string: a phrase, or phrases and words joined by
+    # NEAR/k operators, whose tokens are kept between their words
+    parts, distances = split_near(query)
+    if '"' in query or distances:
         phrasal_query = True
-        query= query.strip().lstrip('"').rstrip('"')
-    tokens = [word for sent in sent_tokenize(query) for word in word_tokenize(sent)]
+        parts = [part.strip().strip('"') for part in parts]
 
-    # stem the tokens and do uk2us translation
-    ps = PorterStemmer()
+    # stem the tokens and do uk2us translation (memoised, shared by the whole process)
+    # stop words are removed if stopword is True
+    normalize_word = get_normalizer(stopword, prepare=query_form)
 
     filteredList = []
-    for token in tokens:
-        if stopword:
-            # Remove all stop words
-            if token not in stopWords:
-                filteredList.append(ps.stem(uk2us(token.lower())))
-        else:
-            filteredList.append(ps.stem(uk2us(token.lower())))
+    for i, part in enumerate(parts):
+        if i > 0:
+            filteredList.append(operator_token(distances[i - 1]))
+        for token in [word for sent in sent_tokenize(part) for word in word_tokenize(sent)]:
+            term = normalize_word(token)
+            if term is not None:
+                filteredList.append(term)
 
     # get the term count
     term_count = defaultdict(int)
     for token in filteredList:
-        term_count[token] += 1
+        if not is_operator(token):
+            term_count[token] += 1
 
     # get the set of tokens
-    terms = list(set(filteredList))
+    terms = list(set(token for token in filteredList if not is_operator(token)))
 
     return filteredList, terms, term_count
 
@@ -98,90 +116,40 @@ def intersection(terms, postings_dict):
     ''' perform posting list intersection to retrieve a list of candidate doc IDs '''
     if len(terms) == 0:
         return []
-            
-    # optimize the order of the merge
-    costs = list()
+
+    lists = list()
     for term in terms:
         try:
-            doc_ids = list(postings_dict[term].keys())
-        except: # some might be empty Token, which can go wrong
-            doc_ids = []
-        costs.append((term, len(doc_ids)))
-    costs.sort(key = lambda key: key[1])
-
-    # initial result, assigned as the posting list of the first term
-    try:
-        result = sorted(list(postings_dict[costs[0][0]].keys()))
-    except:
-        result = []
+            lists.append(sorted(postings_dict[term].keys()))
+        except:  # some might be empty Token, which can go wrong
+            lists.append([])
 
-    ''' perform pairwise merge '''
-    for i in range(1, len(costs)):
-        term = costs[i][0]
+    # merge from the shortest list, picking linear merge or galloping
+    # search by the ratio of the list lengths
+    return intersect_many(lists)
 
-        try:
-            postings = sorted(list(postings_dict[term].keys()))
-        except:  # some might be empty Token, which can go wrong
-            postings = []
-
-        p1 = p2 = 0
-        len1, len2 = len(result), len(postings)
-        temp = array.array('i')
-        while p1 < len1 and p2 < len2:
-            doc1 = result[p1]
-            doc2 = postings[p2]
-            if doc1 == doc2:
-                temp.append(doc1)
-                p1, p2 = p1 + 1, p2 + 1
-            elif doc1 < doc2:
-                p1 += 1
-            else:
-                p2 += 1
-        result = temp
-
-    return list(result)
-
-def verify(candidate, tokens, postings_dict):
+def verify(candidate, tokens, postings_dict, count=False):
     ''' 
-    see if the query is in the candidate file, as the terms 
-    should appear one by one, side by side 
+    see if the query is in the candidate file, as the terms of a phrase
+    should appear one by one, side by side, and the phrases joined by
+    NEAR/k within k words of each other, by merging the positions of the
+    terms in each candidate (phrase.py)
 
     @param candidate The candidate doc IDs
-    @param tokens The stemmed words list in the query
+    @param tokens The stemmed words list in the query, with its NEAR/k operators
     @param postings_dict The dictionary containing the pos info
+    @param count Return the doc ID -> number of matches of the documents
+                 matching, instead of stopping at the first match of each
     '''
-    if len(tokens) <= 1:
+    if len(tokens) <= 1 and not count:
         return candidate
 
-    positions = defaultdict(dict)
-    candidate = set(candidate)
-
-    # get postions for docs
-    for i, token in enumerate(tokens):
-        try:
-            for doc_id, val in postings_dict[token].items():
-                if doc_id in candidate:
-                    positions[doc_id][i] = val.pos
-        except:
-            continue
-
-    # judging every doc
-    ans = []
-    flag = False
-    for doc in positions.keys():
-        term1_positions = positions[doc][0]
-        length = len(positions[doc].keys())
-        for pos in term1_positions:
-            for i in range(1,length):
-                if (pos+i) in positions[doc][i]:
-                    flag = True
-                else:
-                    flag = False
-                    break
-        if flag == True:
-            ans.append(doc)
-
-    return ans
+    phrases, distances = split_tokens(tokens)
+    positions = positions_of(candidate, set(chain.from_iterable(phrases)), postings_dict)
+    if count:
+        matches = {doc_id: match(phrases, distances, positions[doc_id], count=True) for doc_id in candidate}
+        return {doc_id: n for doc_id, n in matches.items() if n > 0}
+    return [doc_id for doc_id in candidate if match(phrases, distances, positions[doc_id])]
 
 
 def singleBubbleSortPass(docIdResultsList, courts_dict, date_rank):
@@ -217,16 +185,27 @@ def pseudo_rel_feedback(postings,dictionary, most_rel_doc_id, query_weighted):
     alpha = 1 # the weight of the original query terms remains the same
     beta = 0.2 # the weight of the added terms from the most relevant documents
 
-    for term in dictionary:
+    rel_doc_ids = np.array(sorted(most_rel_doc_id), dtype=np.int32) if postings.slots is not None else None
+
+    # stream the postings of the whole dictionary in a few large reads
+    for term, term_postings in postings.fetch_many(dictionary):
+        if isinstance(term_postings, Columns):
+            # columnar postings (index.py -c): the weights of the term in the most relevant documents
+            weights = term_postings.get_weights(rel_doc_ids)
+            if weights.any():
+                feedback[term] = float(weights.sum())
+            continue
         try:
-            items = postings[term].items()
+            items = term_postings.items()
         except:
             continue
         for doc_id, freq in items:
             if doc_id in most_rel_doc_id:
                 if term not in feedback:
                     feedback[term] = 0
-                feedback[term] += postings[term][doc_id].weight #feedback holds the weight for each term in the new query
+                feedback[term] += term_postings[doc_id].weight #feedback holds the weight for each term in the new query
+    # fetch_many reads in postings file order: keep the terms in dictionary order
+    feedback = {term: feedback[term] for term in dictionary if term in feedback}
 
     prf_query = {}
     for term in query_weighted:
@@ -241,7 +220,7 @@ def pseudo_rel_feedback(postings,dictionary, most_rel_doc_id, query_weighted):
 
     return prf_query
 
-def execute_search(query, dictionary, postings, num_of_doc):
+def execute_search(query, dictionary, postings, num_of_doc, ngrams=None):
     '''
     Compute cosine similarity between the query and each document, i.e.,
     the lnc tf-idf for the tuples (term, frequency).
@@ -255,6 +234,7 @@ def execute_search(query, dictionary, postings, num_of_doc):
     @param postings - The postings dictionary containing a mapping of 
                         doc ID to the weight for a given token: Posting
     @param num_of_doc - The number of the documents indexed
+    @param ngrams - The n-grams of the phrases, or None: NgramIndex
     '''
 
     '''
@@ -272,9 +252,16 @@ def execute_search(query, dictionary, postings, num_of_doc):
 
     tokens, terms, term_freq = get_term_freq(query)
 
+    # read the postings of all query terms in a few large reads
+    postings.prefetch(terms)
+
     if phrasal_query:
-        doc_candidate = intersection(terms, postings)
-        doc_to_rank = verify(doc_candidate, tokens, postings)
+        # a phrase of 2 or 3 words is an n-gram: its documents need no
+        # positions; a longer one is verified in the documents of its n-grams
+        doc_candidate, exact = ngrams.lookup(tokens) if ngrams else (None, False)
+        if doc_candidate is None:
+            doc_candidate = intersection(terms, postings)
+        doc_to_rank = doc_candidate if exact else verify(doc_candidate, tokens, postings)
 
     # Compute cosine similarity between the query and each document,
     # with the weights follow the tf×idf calculation, and then do
@@ -282,6 +269,10 @@ def execute_search(query, dictionary, postings, num_of_doc):
     query_weight = normalize([get_tf(freq) * get_idf(num_of_doc, dictionary[term].frequency)
                             for (term, freq) in term_freq.items()])
 
+    if postings.slots is not None:
+        return score_columnar(postings, dictionary, term_freq, query_weight,
+                              set(doc_to_rank) if phrasal_query else None)
+
     # Compute the score for each document containing one of those
     # terms in the query.
     score = Counter()
@@ -296,7 +287,7 @@ def execute_search(query, dictionary, postings, num_of_doc):
                 score[doc_id] += q_weight * value.weight
     if not boolean_query and prf_on:
         ''' rank and get result'''
-        most_rel_docs = [doc_id for (doc_id, _) in score.most_common(K_MOST_RELEVANT)]
+        most_rel_docs = [doc_id for (doc_id, _) in top_k(score, K_MOST_RELEVANT)]
         new_query = pseudo_rel_feedback(postings,dictionary, most_rel_docs, query_vector)
 
         ''' normalizing the new query '''
@@ -304,20 +295,60 @@ def execute_search(query, dictionary, postings, num_of_doc):
         for term in new_query:
             new_query[term] = new_query[term] / norm
 
+        # read the postings of the expanded query in a few large reads
+        postings.prefetch(new_query)
         score = Counter()
         for term in new_query:
             try:
                 items = postings[term].items()
             except:
                 continue
-            for doc_id, freq in items:
+            for doc_id, token in items:
                 if phrasal_query and (doc_id not in doc_to_rank):
                     continue
-                score[doc_id] += new_query[term] * value.weight
+                score[doc_id] += new_query[term] * token.weight
     return score
 
 
 
+def columns_of(postings, query_vector):
+    ''' Return the (query weight, Columns) of the terms of a query vector with postings '''
+    lists = []
+    for term, q_weight in query_vector.items():
+        if q_weight > 0:
+            term_postings = postings[term]
+            if isinstance(term_postings, Columns):
+                lists.append((q_weight, term_postings))
+    return lists
+
+
+def score_columnar(postings, dictionary, term_freq, query_weight, allowed):
+    '''
+    execute_search() on columnar postings (index.py -c): the scores of a
+    query, and of its pseudo relevance feedback, are added up vectorised
+    into an array of the scores of all the documents (columnar.py)
+
+    @param term_freq, query_weight - the query vector of execute_search
+    @param allowed - the doc IDs matching the phrase, None for free text: set
+    @return score: Counter[int, float], of the documents with a score
+    '''
+    query_vector = dict(zip(term_freq, query_weight))
+    scores = score_columns(columns_of(postings, query_vector), postings.slots, allowed)
+    if not boolean_query and prf_on:
+        most_rel_docs = [doc_id for (doc_id, _) in top_scores(scores, K_MOST_RELEVANT)]
+        new_query = pseudo_rel_feedback(postings, dictionary, most_rel_docs, query_vector)
+
+        ''' normalizing the new query '''
+        norm = sqrt(sum([i * i for i in new_query.values()], 0))
+        for term in new_query:
+            new_query[term] = new_query[term] / norm
+
+        # read the postings of the expanded query in a few large reads
+        postings.prefetch(new_query)
+        scores = score_columns(columns_of(postings, new_query), postings.slots, allowed)
+    return Counter(scored(scores))
+
+
 def lesk(query):
     '''
     implementing the general Lesk Algorithm, with a slight modification - trying it on every word of the query,
@@ -397,13 +428,9 @@ def eval_and(scores1, scores2):
     note: 0 scores are possible because of normalization
     """
     result = Counter()
-    scores1_sorted = scores1.most_common()
-    max1 = scores1_sorted[0][1]
-    min1 = scores1_sorted[len(scores1) - 1][1]
-    scores2_sorted = scores2.most_common()
-    max2 = scores2_sorted[0][1]
-    min2 = scores2_sorted[len(scores2) - 1][1]
-    for doc_id, score1 in scores1_sorted:
+    max1, min1 = max(scores1.values()), min(scores1.values())
+    max2, min2 = max(scores2.values()), min(scores2.values())
+    for doc_id, score1 in scores1.items():
         score2 = scores2[doc_id]
         if score2 != 0:
             result[doc_id] = normalize_score(max1, min1, score1) + normalize_score(max2, min2, score2)
@@ -432,8 +459,15 @@ def run_search(dict_file, postings_file, query_file, results_file):
         real_ids = pickle.load(dictionary_file)
         docsInfo = pickle.load(dictionary_file)
         # docs_to_terms = pickle.load(dictionary_file)
-        dictionary = pickle.load(dictionary_file)
-        postings = Posting(dictionary, posting_file)
+        dictionary = load_dictionary(dictionary_file, Entry, Entry)  # pickled, or front-coded by index.py -f
+        if mapped:
+            postings = MappedPosting(dictionary, posting_file)
+        else:
+            postings = Posting(dictionary, posting_file)
+        ngrams = None
+        if ngram_file:
+            with open(ngram_file, mode="rb") as phrase_file:
+                ngrams = NgramIndex(phrase_file)  # memory-mapped: the file is not read after
 
         ''' 
         process query, and write the query result (i.e., the 10 
@@ -445,7 +479,7 @@ def run_search(dict_file, postings_file, query_file, results_file):
         if len(subqueries) > 1:
             global boolean_query
             boolean_query = True
-        subresults = [execute_search(subquery, dictionary, postings, num_of_doc) for subquery in subqueries]
+        subresults = [execute_search(subquery, dictionary, postings, num_of_doc, ngrams) for subquery in subqueries]
         # merge results of subqueries
         subresults.sort(key=len)
         result = []
@@ -453,18 +487,16 @@ def run_search(dict_file, postings_file, query_file, results_file):
             subresults[1] = eval_and(subresults[0], subresults[1])
             subresults.pop(0)
 
-        result = [doc_id for (doc_id, score) in subresults[0].most_common()]
+        # every matching document is printed: rank all of them in a single
+        # sort, by score then doc ID before the court passes
+        tiebreak = (lambda doc_id: doc_id) if court_rank else None
+        result = [doc_id for (doc_id, _) in top_k(subresults[0], None, tiebreak)]
 
         if court_rank:
-            topList = sorted(([subresults[0][docId], docId]
-                                for docId in result), key=lambda pair: (-pair[0], pair[1]))
-            # print(topList)
-            docIdResultsList = [pair[1] for pair in topList]
-
             for x in range(10):
                 #Use bubble sort passes to "bubble" higher priority court documents up slightly
                 #without affecting the overall ranking greatly
-                result = singleBubbleSortPass(docIdResultsList, docsInfo, date_rank)
+                result = singleBubbleSortPass(result, docsInfo, date_rank)
 
         for x in range(len(result)):
             result[x] = real_ids[result[x]]
@@ -475,19 +507,22 @@ def usage():
     # test on my PC: $python3 search.py -d dictionary.txt -p postings.txt -q queries.txt -o output.txt
     # test on my PC: $python3 search.py -d dictionary.txt -p postings.txt -q queries.txt -o output.txt -x
     print("usage: " +
-          sys.argv[0] + " -d dictionary-file -p postings-file -q file-of-queries -o output-file-of-results")
+          sys.argv[0] + " -d dictionary-file -p postings-file -q file-of-queries -o output-file-of-results [-m] [-b ngram-file] [-t table-file]")
     print("tips:\n"
           "  -d  dictionary file path\n"
           "  -p  postings file path\n"
           "  -q  queries file path\n"
-          "  -o  search results file path\n")
+          "  -o  search results file path\n"
+          "  -m  memory-map the postings file\n"
+          "  -b  answer the phrases of 2 or 3 words from the n-gram file of index.py -b\n"
+          "  -t  start from the normalization table of table-file, and save it there\n")
 
 if __name__ == "__main__":
 
     dictionary_file = postings_file = file_of_queries = output_file_of_results = None
 
     try:
-        opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:o:x')
+        opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:o:xmb:t:')
     except getopt.GetoptError:
         usage()
         sys.exit(2)
@@ -501,6 +536,12 @@ if __name__ == "__main__":
             file_of_queries = a
         elif o == '-o':
             file_of_output = a
+        elif o == '-m':
+            mapped = True
+        elif o == '-b':
+            ngram_file = a
+        elif o == '-t':
+            table_file = a
         else:
             assert False, "unhandled option"
 
@@ -508,4 +549,10 @@ if __name__ == "__main__":
         usage()
         sys.exit(2)
 
+    if table_file:
+        load_tables(table_file)
     run_search(dictionary_file, postings_file, file_of_queries, file_of_output)
+    if table_file:
+        save_tables(table_file)
+    for line in stats():
+        print(line)
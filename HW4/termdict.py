@@ -0,0 +1,244 @@
+'''
+Sorted, front-coded term dictionary, opened with mmap instead of unpickled.
+
+write_dictionary() writes a dict of term -> Entry (any namedtuple of ints
+and floats) at the current position of the dictionary file, laid out as
+    MAGIC | padding to 8 bytes
+    header: number of terms, number of fields, terms per block, number of blocks
+    type codes: one int64 per field, the array type code of its column
+    block offsets: one int64 per block, into the term blocks
+    one column per field of the entries, in term order: int64 ('q'), or
+        double ('d') for a field holding a float
+    term blocks: the UTF-8 terms sorted by bytes, BLOCK_SIZE terms a block;
+        the first term of a block is stored as vb(length) bytes, and every
+        other term as vb(length of the prefix shared with the previous term)
+        vb(length of the rest) rest
+All arrays are aligned on 8 bytes from the start of the file.
+
+load_dictionary() reads the dictionary at the current position of the file:
+a TermDictionary over a read-only mmap of the file when the file starts
+there with MAGIC, or else the pickled dict of earlier versions. Opening a
+TermDictionary reads only the header, so it takes the same time for any
+vocabulary, and the pages of the mapping are shared by every process that
+opens the same file. A term is looked up by binary search on the first
+terms of the blocks, then a scan of at most BLOCK_SIZE terms.
+'''
+import mmap
+from array import array
+from bisect import bisect_right
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+MAGIC = b"TERMDICT"
+BLOCK_SIZE = 16  # terms of a front-coded block
+HEADER_FIELDS = 4
+INT, FLOAT = 'q', 'd'  # type codes of the columns, both 8 bytes
+
+
+def write_vb(out, number):
+    ''' append a variable-byte int to a bytearray, 7 bits a byte, the last byte has its high bit set '''
+    while number >= 128:
+        out.append(number & 0x7f)
+        number >>= 7
+    out.append(number | 0x80)
+
+
+def read_vb(buf, pos):
+    ''' Return the variable-byte int at pos of a buffer, and the position after it '''
+    number = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        number |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            return number, pos
+        shift += 7
+
+
+def padding(position):
+    return -position % 8
+
+
+def write_dictionary(dictionary, dictionary_file):
+    ''' write a dict of term -> Entry as a sorted, front-coded term dictionary '''
+    terms = sorted(term.encode("utf8") for term in dictionary)
+    num_fields = len(next(iter(dictionary.values()))) if dictionary else 0
+
+    blocks = bytearray()
+    block_offsets = array('q')
+    previous = b""
+    for i, term in enumerate(terms):
+        if i % BLOCK_SIZE == 0:
+            block_offsets.append(len(blocks))
+            write_vb(blocks, len(term))
+            blocks += term
+        else:
+            prefix = 0
+            limit = min(len(term), len(previous))
+            while prefix < limit and term[prefix] == previous[prefix]:
+                prefix += 1
+            write_vb(blocks, prefix)
+            write_vb(blocks, len(term) - prefix)
+            blocks += term[prefix:]
+        previous = term
+
+    # a field of floats (e.g. the max weight of a term) is a column of doubles
+    typecodes = [INT] * num_fields
+    for entry in dictionary.values():
+        for field, value in enumerate(entry):
+            if isinstance(value, float):
+                typecodes[field] = FLOAT
+    columns = [array(typecode) for typecode in typecodes]
+    for term in terms:
+        for column, value in zip(columns, dictionary[term.decode("utf8")]):
+            column.append(value)
+
+    dictionary_file.write(MAGIC)
+    dictionary_file.write(b"\0" * padding(dictionary_file.tell()))
+    dictionary_file.write(array('q', [len(terms), num_fields, BLOCK_SIZE, len(block_offsets)]).tobytes())
+    dictionary_file.write(array('q', map(ord, typecodes)).tobytes())
+    dictionary_file.write(block_offsets.tobytes())
+    for column in columns:
+        dictionary_file.write(column.tobytes())
+    dictionary_file.write(blocks)
+
+
+class TermDictionary(object):
+    '''
+    read-only mapping of term -> Entry over a dictionary written by
+    write_dictionary, looked up in the mmap of the file
+    '''
+
+    def __init__(self, dictionary_file, start, entry, default=None):
+        '''
+        @param dictionary_file: file opened in binary mode
+        @param start: position of MAGIC in the file
+        @param entry: namedtuple type of the entries
+        @param default: type of the entry returned for a missing term (like a
+                        defaultdict, but nothing is inserted), None to raise KeyError
+        '''
+        self.buffer = memoryview(mmap.mmap(dictionary_file.fileno(), 0, access=mmap.ACCESS_READ))
+        self.entry = entry
+        self.default = default
+        pos = start + len(MAGIC)
+        pos += padding(pos)
+        header = self.buffer[pos:pos + HEADER_FIELDS * 8].cast('q')
+        self.num_terms, num_fields, self.block_size, num_blocks = header
+        pos += HEADER_FIELDS * 8
+        typecodes = [chr(code) for code in self.buffer[pos:pos + num_fields * 8].cast('q')]
+        pos += num_fields * 8
+        self.block_offsets = self.buffer[pos:pos + num_blocks * 8].cast('q')
+        pos += num_blocks * 8
+        self.columns = []
+        for typecode in typecodes:
+            self.columns.append(self.buffer[pos:pos + self.num_terms * 8].cast(typecode))
+            pos += self.num_terms * 8
+        self.blocks = self.buffer[pos:]
+        self.first_terms = FirstTerms(self)
+
+    def first_term(self, block):
+        ''' Return the first term of a block, as bytes '''
+        length, pos = read_vb(self.blocks, self.block_offsets[block])
+        return bytes(self.blocks[pos:pos + length])
+
+    def block_terms(self, block):
+        ''' yield the terms of a block, as bytes '''
+        pos = self.block_offsets[block]
+        length, pos = read_vb(self.blocks, pos)
+        term = bytes(self.blocks[pos:pos + length])
+        pos += length
+        yield term
+        count = min(self.block_size, self.num_terms - block * self.block_size)
+        for _ in range(count - 1):
+            prefix, pos = read_vb(self.blocks, pos)
+            length, pos = read_vb(self.blocks, pos)
+            term = term[:prefix] + bytes(self.blocks[pos:pos + length])
+            pos += length
+            yield term
+
+    def index(self, term):
+        ''' Return the position of a term in the sorted terms, or -1 '''
+        key = term.encode("utf8")
+        block = bisect_right(self.first_terms, key) - 1
+        if block < 0:
+            return -1
+        for i, candidate in enumerate(self.block_terms(block)):
+            if candidate == key:
+                return block * self.block_size + i
+            if candidate > key:
+                break
+        return -1
+
+    def entry_at(self, i):
+        return self.entry(*(column[i] for column in self.columns))
+
+    def __len__(self):
+        return self.num_terms
+
+    def __contains__(self, term):
+        return self.index(term) >= 0
+
+    def __getitem__(self, term):
+        i = self.index(term)
+        if i >= 0:
+            return self.entry_at(i)
+        if self.default is not None:
+            return self.default()
+        raise KeyError(term)
+
+    def get(self, term, default=None):
+        i = self.index(term)
+        return self.entry_at(i) if i >= 0 else default
+
+    def __iter__(self):
+        ''' the terms, in sorted order '''
+        for block in range(len(self.block_offsets)):
+            for term in self.block_terms(block):
+                yield term.decode("utf8")
+
+    def keys(self):
+        return iter(self)
+
+    def items(self):
+        for i, term in enumerate(self):
+            yield term, self.entry_at(i)
+
+    def values(self):
+        for i in range(self.num_terms):
+            yield self.entry_at(i)
+
+
+class FirstTerms(object):
+    '''
+    the first term of every block, as a sequence for bisect, decoded on demand:
+    every lookup probes the same few blocks first, so they are kept decoded
+    '''
+
+    def __init__(self, dictionary):
+        self.dictionary = dictionary
+        self.decoded = {}
+
+    def __len__(self):
+        return len(self.dictionary.block_offsets)
+
+    def __getitem__(self, block):
+        term = self.decoded.get(block)
+        if term is None:
+            term = self.decoded[block] = self.dictionary.first_term(block)
+        return term
+
+
+def load_dictionary(dictionary_file, entry, default=None):
+    '''
+    read the dictionary at the current position of the file: a TermDictionary
+    if one was written there by write_dictionary, or else a pickled dict
+    '''
+    start = dictionary_file.tell()
+    if dictionary_file.read(len(MAGIC)) == MAGIC:
+        return TermDictionary(dictionary_file, start, entry, default)
+    dictionary_file.seek(start)
+    return pickle.load(dictionary_file)
@@ -1,5 +1,7 @@
 import ast
 import math
+import mmap
+import os
 import re
 import string
 from collections import namedtuple
@@ -8,6 +10,8 @@ from math import sqrt
 
 from nltk.stem.porter import PorterStemmer
 
+from columnar import decode, read_header
+
 try:
     import cPickle as pickle
 except ImportError:
@@ -131,6 +135,38 @@ Token.__new__.__defaults__ = (0, 0)
 PhrasalToken = namedtuple("PhrasalToken", ["pos", 'weight'])
 PhrasalToken.__new__.__defaults__ = (0, [], 0)
 
+
+# coalesce() and the read_run() of Posting and MappedPosting are the same in HW2, HW3 and HW4
+COALESCE_GAP = 64 * 1024  # postings at most this many bytes apart are read together
+MAX_RUN_BYTES = 4 * 1024 * 1024  # a read of more postings stops at about this size
+MAX_RUN_LISTS = 512  # and at this many postings, half of the usual IOV_MAX of preadv()
+
+
+def coalesce(extents, gap=COALESCE_GAP):
+    '''
+    Group the (term, offset, size) extents of postings into runs of nearby
+    postings, each read with a single read: in offset order, postings
+    starting at most gap bytes after the end of the current run join it
+
+    @param extents: list[(str, int, int)]
+    @return list of runs, lists of extents sorted by offset
+    '''
+    runs = []
+    run, start, end = [], 0, 0
+    for extent in sorted(extents, key=lambda extent: extent[1]):
+        _, offset, size = extent
+        if run and (offset - end > gap or offset + size - start > MAX_RUN_BYTES
+                    or len(run) >= MAX_RUN_LISTS):
+            runs.append(run)
+            run = []
+        if not run:
+            start = end = offset
+        run.append(extent)
+        end = max(end, offset + size)
+    if run:
+        runs.append(run)
+    return runs
+
 ############################################
 ##########     Class: Posting    ###########
 ############################################
@@ -153,6 +189,11 @@ class Posting(object):
         '''
         self.dictionary = dicionary
         self.posting_file = posting_file
+        self.prefetched = dict()  # term -> postings of the current query, see prefetch
+        self.sizes = None  # term -> size of its postings, see get_sizes
+        self.reads = 0  # reads of the postings file
+        # the number of documents of columnar postings (index.py -c), None when pickled
+        self.slots = read_header(posting_file)
 
     def __getitem__(self, term):
         '''
@@ -164,9 +205,146 @@ class Posting(object):
         @param term: int
         @return Term(token_freq, weight)
         '''
+        if term in self.prefetched:
+            return self.prefetched[term]
         if term in self.dictionary:
+            self.reads += 1
             val = self.dictionary[term]  # val: Entry
             self.posting_file.seek(val.offset)
+            if self.slots is not None:
+                return decode(self.posting_file.read(self.get_sizes()[term]))
             return pickle.load(self.posting_file)
         else:
             return Token(0, 0)
+
+    def get_sizes(self):
+        '''
+        Return the size of the postings of every term. The entries only
+        record the offsets, and index.py writes the postings one after
+        another: a postings ends where the next one starts.
+
+        @return dict[str, int]
+        '''
+        if self.sizes is None:
+            # the defaultdict also has empty entries of the query terms not indexed
+            entries = sorted(((val.offset, term) for term, val in self.dictionary.items()
+                              if val.frequency > 0))
+            ends = [offset for offset, _ in entries[1:]]
+            ends.append(os.fstat(self.posting_file.fileno()).st_size)
+            self.sizes = {term: end - offset for (offset, term), end in zip(entries, ends)}
+        return self.sizes
+
+    def read_run(self, run):
+        '''
+        Return the bytes of each extent of a run, read at once
+
+        @param run: list[(str, int, int)], extents sorted by offset
+        @return list[bytes]
+        '''
+        self.reads += 1
+        start = run[0][1]
+        if hasattr(os, "preadv"):
+            # scatter the run into a buffer per postings, and per gap between them
+            buffers, bufs, cursor = [], [], start
+            for _, offset, size in run:
+                if offset > cursor:
+                    buffers.append(bytearray(offset - cursor))
+                buf = bytearray(size)
+                buffers.append(buf)
+                bufs.append(buf)
+                cursor = offset + size
+            os.preadv(self.posting_file.fileno(), buffers, start)
+            return bufs
+        end = max(offset + size for _, offset, size in run)
+        self.posting_file.seek(start)
+        buf = memoryview(self.posting_file.read(end - start))
+        return [buf[offset - start:offset - start + size] for _, offset, size in run]
+
+    def fetch_many(self, terms):
+        '''
+        Yield (term, postings) for each of the terms, reading the postings
+        with a few large reads of nearby byte ranges (see coalesce) in the
+        order of the postings file, and unpickling them in the same pass
+
+        @param terms: iterable of str
+        '''
+        sizes = self.get_sizes()
+        extents = []
+        for term in set(terms):
+            if term in sizes:
+                extents.append((term, self.dictionary[term].offset, sizes[term]))
+            else:
+                yield term, Token(0)
+        for run in coalesce(extents):
+            for (term, _, _), buf in zip(run, self.read_run(run)):
+                yield term, self.load(buf)
+
+    def load(self, buf):
+        '''
+        Return the postings of a term from their bytes: a pickled dict, or
+        the Columns of columnar postings
+
+        @param buf: bytes
+        '''
+        if self.slots is not None:
+            return decode(buf)
+        return pickle.loads(buf)
+
+    def prefetch(self, terms):
+        '''
+        Load the postings of the terms of a query up front, replacing
+        those of the previous query
+
+        @param terms: iterable of str
+        '''
+        self.prefetched = dict()  # release the previous working set first
+        self.prefetched = dict(self.fetch_many(terms))
+
+
+class MappedPosting(Posting):
+    ''' 
+    A Posting that maps the whole postings file into memory once, 
+    and unpickles every postings from the mapping, so that no 
+    seek() / read() is done when querying.
+
+    As the entries do not record the size of the postings, the 
+    unpickling starts at the offset and stops by itself at the end
+    of the pickled dict.
+    '''
+
+    def __init__(self, dicionary, posting_file):
+        '''
+        @param dictionary: DefaultDict[str, Entry]
+        @param posting_file: txt file
+        '''
+        Posting.__init__(self, dicionary, posting_file)
+        self.buffer = memoryview(
+            mmap.mmap(posting_file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def __getitem__(self, term):
+        '''
+        Return the associated Token to a key, or an empty Token if the
+        token is not in the dictionary
+
+        @param term: int
+        @return Term(token_freq, weight)
+        '''
+        if term in self.prefetched:
+            return self.prefetched[term]
+        if term in self.dictionary:
+            val = self.dictionary[term]  # val: Entry
+            if self.slots is not None:
+                return decode(self.buffer[val.offset:val.offset + self.get_sizes()[term]])
+            return pickle.loads(self.buffer[val.offset:])
+        else:
+            return Token(0, 0)
+
+    def read_run(self, run):
+        '''
+        Return zero-copy views of the extents of a run: the mapping
+        needs no reads
+
+        @param run: list[(str, int, int)], extents sorted by offset
+        @return list[memoryview]
+        '''
+        return [self.buffer[offset:offset + size] for _, offset, size in run]
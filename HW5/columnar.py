@@ -0,0 +1,77 @@
+'''
+Columnar postings, written by index.py -c instead of the pickled dicts of
+doc ID -> Token: the postings of a term are parallel arrays of doc IDs
+(int32) and weights (float32), and the encoded positions. This is the
+write side of the columnar.py of HW3 and HW4, whose search.py read these
+files with NumPy and score them vectorised.
+
+The postings file is laid out as
+    MAGIC | int64 number of score slots (the largest doc ID + 1)
+    for every term, on a multiple of 4 bytes:
+        int32 number of documents n | int32 doc IDs[n] (sorted) | float32 weights[n]
+        [| int32 size of the lengths | lengths[n] | positions]
+        | padding to 4 bytes
+so that the arrays are aligned.
+
+With the positions (index.py -x), the positions of the term in a document
+are delta + variable-byte encoded (the gaps between them, 7 bits a byte,
+the last byte of a number with its high bit set, as vb_encode() of HW2),
+and lengths are the variable-byte sizes of those of each document.
+'''
+import struct
+
+try:
+    import numpy as np
+except ImportError:  # only the columnar postings need NumPy
+    np = None
+
+MAGIC = b"COLUMNAR"
+HEADER = struct.Struct("<q")  # after MAGIC: the number of score slots
+COUNT = struct.Struct("<i")  # the number of documents of a term
+DOC_ID, WEIGHT = "<i4", "<f4"
+
+
+def require_numpy():
+    if np is None:
+        raise ImportError("the columnar postings of index.py -c need NumPy")
+
+
+def write_header(postings_file, slots):
+    ''' write the header of a columnar postings file, at its start '''
+    postings_file.write(MAGIC + HEADER.pack(slots))
+
+
+def vb_encode(numbers):
+    ''' Return the variable-byte encoding of a list of numbers >= 0 '''
+    data = bytearray()
+    for number in numbers:
+        encoded = bytearray([number & 0x7f | 0x80])  # the last byte has the high bit set
+        number >>= 7
+        while number:
+            encoded.insert(0, number & 0x7f)
+            number >>= 7
+        data += encoded
+    return data
+
+
+def encode_positions(positions):
+    ''' Return the delta + variable-byte encoding of a sorted list of positions '''
+    return vb_encode([position - last for position, last in zip(positions, [0] + positions)])
+
+
+def encode(postings, positional=False):
+    '''
+    Return the bytes of the columns of the postings of a term
+
+    @param postings - doc ID -> Token (with pos if positional), in doc ID order: dict
+    '''
+    require_numpy()
+    doc_ids = np.fromiter(postings.keys(), dtype=DOC_ID, count=len(postings))
+    weights = np.fromiter((token.weight for token in postings.values()),
+                          dtype=WEIGHT, count=len(postings))
+    data = COUNT.pack(len(postings)) + doc_ids.tobytes() + weights.tobytes()
+    if positional:
+        blocks = [encode_positions(token.pos) for token in postings.values()]
+        lengths = vb_encode([len(block) for block in blocks])
+        data += COUNT.pack(len(lengths)) + lengths + b"".join(blocks)
+    return data + b"\0" * (-len(data) % 4)
@@ -3,13 +3,14 @@ import getopt
 import math
 import sys
 from collections import defaultdict
+from multiprocessing import Pool
 
 import nltk
-from nltk.corpus import PlaintextCorpusReader, stopwords
-from nltk.stem import PorterStemmer
-from nltk.stem.wordnet import WordNetLemmatizer
+from nltk.corpus import PlaintextCorpusReader
 from nltk.tokenize import RegexpTokenizer, sent_tokenize, word_tokenize
 
+import columnar
+from normalizer import get_normalizer, load_tables, save_tables, stats
 from utils import Entry, Token, PhrasalToken, normalize, get_tf, preprocess
 from uk2us import uk2us
 
@@ -19,6 +20,10 @@ except ImportError:
     import pickle
 
 phrasal_query = True  # operate phrase query
+workers = 1  # processes analysing the articles
+columnar_postings = False  # write the postings as arrays of doc IDs, weights and encoded positions (columnar.py)
+corpus = None  # corpus reader of the process (set by open_corpus)
+table_file = None  # file of the normalization tables, read before and written after the build
 
 def tokenize(paragraph):
     '''
@@ -47,25 +52,14 @@ def stemming(words, stopword=False, lemma=False):
     @param words: a list of strings
     @return stemmed_tokens: a list of strings
     '''
-    ps = PorterStemmer()
-    stemmed_tokens = list()  # multiple term entries in a single document are merged
+    # memoised, shared by the whole process; as before, the stop words
+    # are removed unless stopword is True
+    normalize_word = get_normalizer(not stopword, lemma)
+    stemmed_tokens = list()
     for w in words:
-
-        if stopword:
-            stop_words = set()
-        else:  # stopword removal
-            stop_words = set(stopwords.words("english"))
-
-        if w not in stop_words:
-            # stemming
-            if lemma:
-                # lemmatization
-                lem = WordNetLemmatizer()
-                token = ps.stem(lem.lemmatize(w, "v"))
-            else:
-                token = ps.stem(w)
+        token = normalize_word(w)
+        if token is not None:  # not a stop word
             stemmed_tokens.append(token)
-
     return stemmed_tokens
 
 def convert2int(s):
@@ -80,6 +74,71 @@ def splitContent(text):
     content = preprocess(split[2], removedigit=True, removepunc=True)
     return title, anchor_text, content
 
+def open_corpus(in_dir, phrasal):
+    ''' open the corpus in this process, also run by every worker process '''
+    global corpus, phrasal_query
+    corpus = PlaintextCorpusReader(in_dir, '.*\.txt')
+    phrasal_query = phrasal
+
+
+def analyse(fn_str):
+    '''
+    Analyse a crawled article: title, anchor text, tokenization, stemming
+    and weighted token frequency.
+
+    @param fn_str: the file name of the article
+    @return (doc ID, title, anchor text, list of (token, Token or PhrasalToken))
+    '''
+    content_raw = corpus.raw(fn_str)  # read file content
+    title, anchor_text, content = splitContent(content_raw)
+    words = tokenize(uk2us(content))  # tokenization: content -> words
+    tokens = stemming(words, stopword=False)  # stemming
+    
+    fn = convert2int(fn_str)
+
+    if phrasal_query:
+        token_len = defaultdict(list)
+    else:
+        token_len = defaultdict(int)
+    # count the apeearing times of the token in the file
+    term_pos = 0
+    for token in tokens:
+        if phrasal_query:
+            if token in token_len.keys():
+                token_len[token][0] += 1
+                token_len[token][1].append(term_pos)
+            else:
+                token_len[token] = [1, [term_pos]]
+        else:
+            token_len[token] += 1
+
+        term_pos += 1
+
+
+    ''' 
+    Generate weighted token frequency.
+    
+    Generate the list of token, (frequency, weighted_token_frequency)
+    '''
+    items = list()
+    if phrasal_query:
+
+        weighted_tokenfreq = normalize(
+            [get_tf(y[0]) for (x, y) in token_len.items()])
+
+        for ((token, freq), w_tf) in zip(token_len.items(), weighted_tokenfreq):
+            items.append((token, PhrasalToken(freq[0], freq[1], w_tf)))
+    else:
+
+        weighted_tokenfreq = normalize(
+            [get_tf(y) for (x, y) in token_len.items()])
+
+        for ((token, freq), w_tf) in zip(token_len.items(), weighted_tokenfreq):
+            items.append((token, Token(freq, w_tf)))
+
+    return fn, title, anchor_text, items
+
+
 def build_index(in_dir, out_dict, out_postings):
     """
     build index from documents stored in the input directory,
@@ -88,64 +147,30 @@ def build_index(in_dir, out_dict, out_postings):
     print('indexing...')
 
     ''' Create a sorted list of the files inside the directory '''
-    corpus = PlaintextCorpusReader(in_dir, '.*\.txt')
+    open_corpus(in_dir, phrasal_query)
     file_id_strs = corpus.fileids()
     # file_ids = sorted(convert2int(file_id_strs))
 
     ''' Load corpus and generate the postings dictionary '''
     postings = defaultdict(dict)
-    tokens = list()
     docsInfo = defaultdict(dict)
-    for fn_str in file_id_strs:
-        content_raw = corpus.raw(fn_str)  # read file content
-        title, anchor_text, content = splitContent(content_raw)
-        words = tokenize(uk2us(content))  # tokenization: content -> words
-        tokens = stemming(words, stopword=False)  # stemming
-        
-        fn = convert2int(fn_str)
+    if workers > 1:
+        # analyse the articles in a pool, getting them back in file order
+        pool = Pool(workers, initializer=open_corpus, initargs=(in_dir, phrasal_query))
+        documents = pool.imap(analyse, file_id_strs,
+                              chunksize=max(1, len(file_id_strs) // (workers * 16)))
+    else:
+        documents = map(analyse, file_id_strs)
+    for fn_str, (fn, title, anchor_text, items) in zip(file_id_strs, documents):
         docsInfo[fn] = [title, anchor_text]
-        
-        print("processing: "+fn_str)
-
-        if phrasal_query:
-            token_len = defaultdict(list)
-        else:
-            token_len = defaultdict(int)
-        # count the apeearing times of the token in the file
-        term_pos = 0
-        for token in tokens:
-            if phrasal_query:
-                if token in token_len.keys():
-                    token_len[token][0] += 1
-                    token_len[token][1].append(term_pos)
-                else:
-                    token_len[token] = [1, [term_pos]]
-            else:
-                token_len[token] += 1
-
-            term_pos += 1
-
-
-        ''' 
-        Generate weighted token frequency.
-        
-        Generate dictionary of key -> token, value -> a dict with k,v 
-        as file_name, (frequency, weighted_token_frequency)
-        '''
-        if phrasal_query:
 
-            weighted_tokenfreq = normalize(
-                [get_tf(y[0]) for (x, y) in token_len.items()])
-
-            for ((token, freq), w_tf) in zip(token_len.items(), weighted_tokenfreq):
-                postings[token][fn] = PhrasalToken(freq[0], freq[1], w_tf)
-        else:
-
-            weighted_tokenfreq = normalize(
-                [get_tf(y) for (x, y) in token_len.items()])
+        print("processing: "+fn_str)
 
-            for ((token, freq), w_tf) in zip(token_len.items(), weighted_tokenfreq):
-                postings[token][fn] = Token(freq, w_tf)
+        for token, value in items:
+            postings[token][fn] = value
+    if workers > 1:
+        pool.close()
+        pool.join()
 
     ''' 
     Output dictionary and postings files 
@@ -158,6 +183,9 @@ def build_index(in_dir, out_dict, out_postings):
     # write postings file
     dictionary = defaultdict(Entry)
     with open(out_postings, mode="wb") as postings_file:
+        if columnar_postings:
+            # the header, then the postings of every term in doc ID order
+            columnar.write_header(postings_file, max(docsInfo) + 1 if docsInfo else 0)
         for key, value in postings.items():
             '''
             len(value) := the document frequency of the token
@@ -167,7 +195,11 @@ def build_index(in_dir, out_dict, out_postings):
                     this token
             '''
             offset = postings_file.tell()
-            size = postings_file.write(pickle.dumps(value))
+            if columnar_postings:
+                # the articles are read in file name order: 1, 10, 100, 2, ...
+                size = postings_file.write(columnar.encode(dict(sorted(value.items())), phrasal_query))
+            else:
+                size = postings_file.write(pickle.dumps(value))
             dictionary[key] = Entry(len(value), offset, size)
     print("postings done.")
 
@@ -192,36 +224,54 @@ def usage():
     
     # python3 index.py -i ~/cs_articles -d dictionary.txt -p postings.txt
     print("usage: " +
-          sys.argv[0] + " -i directory-of-documents -d dictionary-file -p postings-file")
+          sys.argv[0] + " -i directory-of-documents -d dictionary-file -p postings-file [-c] [--workers N] [-t table-file]")
     print("tips:\n"
           "  -i  directory of the reuters training data\n"
           "  -d  dictionary file path\n"
           "  -p  postings file path\n"
-          "  -x  enable phrasal query\n")
-
-
-input_directory = output_file_dictionary = output_file_postings = None
-
-try:
-    opts, args = getopt.getopt(sys.argv[1:], 'i:d:p:x')
-except getopt.GetoptError:
-    usage()
-    sys.exit(2)
-
-for o, a in opts:
-    if o == '-i':  # input directory
-        input_directory = a
-    elif o == '-d':  # dictionary file
-        output_file_dictionary = a
-    elif o == '-p':  # postings file
-        output_file_postings = a
-    elif o == '-x':  # operate phrase query
-        phrasal_query = True
-    else:
-        assert False, "unhandled option"
-
-if input_directory == None or output_file_postings == None or output_file_dictionary == None:
-    usage()
-    sys.exit(2)
-
-build_index(input_directory, output_file_dictionary, output_file_postings)
+          "  -x  enable phrasal query\n"
+          "  -c  write columnar postings (arrays of doc IDs and weights, encoded positions, needs NumPy)\n"
+          "  --workers  analyse the articles in N processes\n"
+          "  -t  start from the normalization table of table-file, and save it there\n")
+
+
+# worker processes import this module: only run the command line in the main process
+if __name__ == "__main__":
+
+    input_directory = output_file_dictionary = output_file_postings = None
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'i:d:p:xct:', ['workers='])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-i':  # input directory
+            input_directory = a
+        elif o == '-d':  # dictionary file
+            output_file_dictionary = a
+        elif o == '-p':  # postings file
+            output_file_postings = a
+        elif o == '-x':  # operate phrase query
+            phrasal_query = True
+        elif o == '-c':  # columnar postings
+            columnar_postings = True
+        elif o == '--workers':  # document analysis processes
+            workers = int(a)
+        elif o == '-t':  # normalization table file
+            table_file = a
+        else:
+            assert False, "unhandled option"
+
+    if input_directory == None or output_file_postings == None or output_file_dictionary == None:
+        usage()
+        sys.exit(2)
+
+    if table_file:
+        load_tables(table_file)
+    build_index(input_directory, output_file_dictionary, output_file_postings)
+    if table_file:
+        save_tables(table_file)
+    for line in stats():
+        print(line)
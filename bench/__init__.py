@@ -0,0 +1,13 @@
+'''
+Benchmark suite of the search engines of HW2 - HW5 on synthetic data, so
+that indexing and query performance can be measured without the Reuters or
+Intelllex collections:
+    corpus.py   := Zipf-distributed synthetic corpora, in the format of
+                   every indexer
+    workload.py := Boolean, free-text and phrasal query workloads
+    runner.py   := runs index.py and search.py of the engines, reports
+                   docs/sec, index size and query latency percentiles
+    probe.py    := times the queries one by one inside a search.py
+
+    $ python3 -m bench -e HW2,HW3 -n 2000 -q 200 -o report.json
+'''
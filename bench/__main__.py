@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+import getopt
+import json
+import sys
+
+from .corpus import SyntheticCorpus
+from .runner import CONFIGS, Benchmark
+
+
+def usage():
+    # $ python3 -m bench -e HW2,HW3 -n 2000 -q 200 -o report.json
+    print("usage: python3 -m bench [-e engines] [-n docs] [-l words-per-doc] [-v vocabulary-size] "
+          "[-z zipf-exponent] [-q queries] [-s seed] [-w work-directory] [-o report-file]")
+    print("tips:\n"
+          "  -e  comma-separated engines among HW2, HW3, HW4, HW5 (all by default)\n"
+          "  -n  documents of the corpus, 1000 by default\n"
+          "  -l  mean words of a document, 150 by default\n"
+          "  -v  words of the vocabulary, 20000 by default\n"
+          "  -z  exponent s of the Zipf distribution of the words (1 / rank^s), 1.1 by default\n"
+          "  -q  queries of every workload, 100 by default\n"
+          "  -s  seed of the corpus and workloads\n"
+          "  -w  directory of the corpus, workloads and indexes, bench-data by default\n"
+          "  -o  write the JSON report to report-file, else print it\n")
+
+
+engines = sorted(set(config[1] for config in CONFIGS))
+num_docs, doc_length, vocabulary_size, zipf = 1000, 150, 20000, 1.1
+num_queries, seed = 100, 42
+work_dir, report_file = "bench-data", None
+
+try:
+    opts, args = getopt.getopt(sys.argv[1:], 'e:n:l:v:z:q:s:w:o:h')
+except getopt.GetoptError:
+    usage()
+    sys.exit(2)
+
+for o, a in opts:
+    if o == '-e':
+        engines = a.split(",")
+    elif o == '-n':
+        num_docs = int(a)
+    elif o == '-l':
+        doc_length = int(a)
+    elif o == '-v':
+        vocabulary_size = int(a)
+    elif o == '-z':
+        zipf = float(a)
+    elif o == '-q':
+        num_queries = int(a)
+    elif o == '-s':
+        seed = int(a)
+    elif o == '-w':
+        work_dir = a
+    elif o == '-o':
+        report_file = a
+    elif o == '-h':
+        usage()
+        sys.exit(0)
+    else:
+        assert False, "unhandled option"
+
+corpus = SyntheticCorpus(num_docs, doc_length, vocabulary_size, zipf, seed)
+report = Benchmark(corpus, num_queries, work_dir, seed).run(engines)
+if report_file:
+    with open(report_file, mode="w") as out:
+        json.dump(report, out, indent=2)
+else:
+    print(json.dumps(report, indent=2))
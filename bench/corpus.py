@@ -0,0 +1,124 @@
+'''
+Zipf-distributed synthetic corpora, in the formats read by the indexers:
+    write_directory() := a directory of documents named by doc ID (HW2, HW3)
+    write_articles()  := a directory of crawled articles 00001.txt ..., with
+                         their title and anchor text (HW5)
+    write_csv()       := a CSV file of legal cases (HW4)
+
+The vocabulary is made of pronounceable synthetic words, and the word of
+rank r is drawn with a probability proportional to 1 / r^s (Zipf's law, s
+is about 1 for English). Every document is drawn from its own seeded random
+generator: a document can be drawn again alone (workload.py takes its
+phrases from them), and the same parameters always give the same corpus.
+'''
+import csv
+import os
+import random
+from itertools import accumulate
+
+CONSONANTS = "bcdfghklmnprstvz"
+VOWELS = "aeiou"
+RESERVED = {"and", "or", "not", "true", "false", "none"}  # operators and constants of the query parsers
+SENTENCE_WORDS = 12  # words of a sentence
+SENTENCES_PER_PARAGRAPH = 5
+COURTS = ["SG Court of Appeal", "SG High Court", "SG District Court",
+          "UK House of Lords", "HK High Court", "NSW Supreme Court"]
+
+
+def make_vocabulary(size, rng):
+    ''' Return size distinct words of 1 to 4 syllables, shorter words first '''
+    words = []
+    seen = set(RESERVED)
+    syllables = 1
+    attempts = 0
+    while len(words) < size:
+        word = "".join(rng.choice(CONSONANTS) + rng.choice(VOWELS) for _ in range(syllables))
+        if rng.random() < 0.3:
+            word += rng.choice(CONSONANTS)
+        attempts += 1
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+            attempts = 0
+        elif attempts > 50:  # the words of this length are running out
+            syllables += 1
+            attempts = 0
+    return words
+
+
+class SyntheticCorpus(object):
+    '''
+    a corpus of num_docs documents (doc IDs 1 to num_docs) of about
+    doc_length words, drawn from a vocabulary of vocabulary_size words
+    '''
+
+    def __init__(self, num_docs=1000, doc_length=150, vocabulary_size=20000, zipf=1.1, seed=42):
+        self.num_docs = num_docs
+        self.doc_length = doc_length
+        self.zipf = zipf
+        self.seed = seed
+        self.vocabulary = make_vocabulary(vocabulary_size, random.Random(seed))
+        # the frequent words are the short ones, as in natural languages
+        self.cum_weights = list(accumulate(1.0 / rank ** zipf
+                                           for rank in range(1, vocabulary_size + 1)))
+
+    def words(self, k, rng):
+        ''' Return k words drawn from the Zipf distribution '''
+        return rng.choices(self.vocabulary, cum_weights=self.cum_weights, k=k)
+
+    def document(self, doc_id):
+        ''' Return the words of a document, the same on every call '''
+        rng = random.Random(self.seed * 1000003 + doc_id)
+        length = rng.randint(self.doc_length // 2, self.doc_length * 3 // 2)
+        return self.words(length, rng)
+
+    def sentences(self, doc_id):
+        ''' Return the sentences of a document, as lists of words '''
+        words = self.document(doc_id)
+        return [words[i:i + SENTENCE_WORDS] for i in range(0, len(words), SENTENCE_WORDS)]
+
+    def text(self, doc_id):
+        ''' Return the text of a document: sentences and paragraphs '''
+        sentences = [" ".join(sentence).capitalize() + "." for sentence in self.sentences(doc_id)]
+        return "\n\n".join(" ".join(sentences[i:i + SENTENCES_PER_PARAGRAPH])
+                           for i in range(0, len(sentences), SENTENCES_PER_PARAGRAPH))
+
+    def doc_ids(self):
+        return range(1, self.num_docs + 1)
+
+    def stats(self):
+        ''' Return the parameters of the corpus, and its number of words '''
+        return {"docs": self.num_docs, "words_per_doc": self.doc_length,
+                "vocabulary": len(self.vocabulary), "zipf": self.zipf, "seed": self.seed,
+                "words": sum(len(self.document(doc_id)) for doc_id in self.doc_ids())}
+
+
+def write_directory(corpus, out_dir):
+    ''' write the documents to out_dir, one file named by doc ID each (HW2, HW3) '''
+    os.makedirs(out_dir, exist_ok=True)
+    for doc_id in corpus.doc_ids():
+        with open(os.path.join(out_dir, str(doc_id)), mode="w", encoding="utf8") as out:
+            out.write(corpus.text(doc_id))
+
+
+def write_articles(corpus, out_dir):
+    ''' write the documents to out_dir as crawled articles 00001.txt ... (HW5) '''
+    os.makedirs(out_dir, exist_ok=True)
+    for doc_id in corpus.doc_ids():
+        words = corpus.document(doc_id)
+        with open(os.path.join(out_dir, "%05d.txt" % doc_id), mode="w", encoding="utf8") as out:
+            out.write("$T: %s\n\n$AT: %s\n\n%s" % (" ".join(words[:5]).title(),
+                                                   " ".join(words[5:8]), corpus.text(doc_id)))
+
+
+def write_csv(corpus, path):
+    ''' write the documents as the rows of a CSV file of legal cases (HW4) '''
+    rng = random.Random(corpus.seed)
+    with open(path, mode="w", encoding="utf8", newline="") as out:
+        writer = csv.writer(out)
+        writer.writerow(["document_id", "title", "content", "date_posted", "court"])
+        for doc_id in corpus.doc_ids():
+            words = corpus.document(doc_id)
+            date = "%d-%02d-%02d 00:00:00" % (rng.randint(1990, 2019), rng.randint(1, 12), rng.randint(1, 28))
+            writer.writerow([doc_id, " ".join(words[:5]).title(), corpus.text(doc_id),
+                             date, rng.choice(COURTS)])
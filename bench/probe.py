@@ -0,0 +1,67 @@
+'''
+Time the queries of a workload one by one inside the search.py of an
+engine, without its startup (loading the dictionary and postings).
+
+Run by runner.py in the directory of the engine, with the same options as
+its search.py:
+    $ python3 probe.py HW2 dictionary-file postings-file queries-file latency-file
+    $ python3 probe.py HW3 dictionary-file postings-file queries-file latency-file [-x]
+and writes the latency of every query in seconds to latency-file, as a JSON
+list. HW4 answers one query a run of search.py: runner.py times the runs.
+'''
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.getcwd())  # the modules of the engine
+
+
+def probe_boolean(dict_file, postings_file, queries):
+    ''' HW2: time every result line of search_queries(), from the query it pulls '''
+    import search
+    latencies = []
+    started = [0.0]
+
+    def timed(queries):
+        for query in queries:
+            started[0] = time.perf_counter()
+            yield query
+
+    with open(dict_file, mode="rb") as dictionary_file,\
+            open(postings_file, mode="rb") as posting_file:
+        for _ in search.search_queries(timed(queries), dictionary_file, posting_file):
+            latencies.append(time.perf_counter() - started[0])
+    return latencies
+
+
+def probe_vsm(dict_file, postings_file, queries, phrasal=False):
+    ''' HW3: time find_10_most_relevant() on every query '''
+    import search
+    search.phrasal_query = phrasal
+    latencies = []
+    with open(dict_file, mode="rb") as dictionary_file,\
+            open(postings_file, mode="rb") as posting_file:
+        num_of_doc = search.pickle.load(dictionary_file)
+        dictionary = search.load_dictionary(dictionary_file, search.Entry, search.Entry)
+        postings = search.Posting(dictionary, posting_file)
+        for query in queries:
+            start = time.perf_counter()
+            search.find_10_most_relevant(query, dictionary, postings, num_of_doc)
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+PROBES = {"HW2": probe_boolean, "HW3": probe_vsm}
+
+
+if __name__ == "__main__":
+    engine, dict_file, postings_file, queries_file, latency_file = sys.argv[1:6]
+    with open(queries_file, encoding="utf8") as q_in:
+        queries = list(q_in)
+    if engine == "HW3" and "-x" in sys.argv[6:]:
+        latencies = probe_vsm(dict_file, postings_file, queries, phrasal=True)
+    else:
+        latencies = PROBES[engine](dict_file, postings_file, queries)
+    with open(latency_file, mode="w") as out:
+        json.dump(latencies, out)
@@ -0,0 +1,144 @@
+'''
+Run the indexers and searches of the engines on a synthetic corpus, and
+report their performance as a dict (JSON):
+    index     := seconds, docs/sec, bytes of the dictionary and postings files
+    workloads := for each query workload: the seconds of a run of search.py
+                 on all the queries (startup included), queries/sec, and
+                 the latency of a query in ms (p50, p95, p99, mean, max),
+                 timed one by one inside search.py by probe.py
+
+HW4 answers one query a run of search.py, so its latencies are those of
+whole runs, on the first MAX_RUNS queries. HW5 has no search.py: only its
+index is measured. An engine whose run fails is reported with its error.
+'''
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+
+from .corpus import write_articles, write_csv, write_directory
+from .workload import WORKLOADS, write_queries, write_query_files
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROBE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "probe.py")
+MAX_RUNS = 20  # queries of HW4, a run of search.py each
+
+# name, directory of the engine, corpus format, index.py options, search.py options, workloads
+CONFIGS = [
+    ("HW2", "HW2", "directory", [], [], ["boolean"]),
+    ("HW3", "HW3", "directory", [], [], ["free_text"]),
+    ("HW3 -x", "HW3", "directory", ["-x"], ["-x"], ["phrasal"]),
+    ("HW3 -c", "HW3", "directory", ["-c"], [], ["free_text"]),
+    ("HW4", "HW4", "csv", [], [], ["legal"]),
+    ("HW5", "HW5", "articles", [], [], []),
+]
+WRITERS = {"directory": write_directory, "articles": write_articles, "csv": write_csv}
+
+
+def percentile(values, p):
+    ''' Return the p-th percentile of a list of numbers, by nearest rank '''
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1))]
+
+
+def latency_stats(latencies):
+    ''' Return the percentiles of latencies in seconds, in ms '''
+    if not latencies:
+        return {}
+    stats = {"p%d" % p: percentile(latencies, p) * 1000 for p in (50, 95, 99)}
+    stats["mean"] = sum(latencies) / len(latencies) * 1000
+    stats["max"] = max(latencies) * 1000
+    return {key: round(value, 3) for key, value in stats.items()}
+
+
+def run(engine_dir, script, options):
+    ''' run a script of an engine in its directory, Return the seconds it took '''
+    start = time.perf_counter()
+    subprocess.run([sys.executable, script] + options, cwd=engine_dir, check=True,
+                   stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+class Benchmark(object):
+    ''' a corpus, its query workloads and the index and search runs on them, under work_dir '''
+
+    def __init__(self, corpus, num_queries, work_dir, seed=0):
+        self.corpus = corpus
+        self.num_queries = num_queries
+        self.work_dir = os.path.abspath(work_dir)
+        self.seed = seed
+        self.corpora = dict()  # format -> path
+        self.workloads = dict()  # name -> path
+
+    def path(self, *names):
+        return os.path.join(self.work_dir, *names)
+
+    def corpus_path(self, corpus_format):
+        ''' Return the path of the corpus in a format, written on first use '''
+        if corpus_format not in self.corpora:
+            path = self.path("corpus.csv" if corpus_format == "csv" else "corpus-" + corpus_format)
+            WRITERS[corpus_format](self.corpus, path)
+            self.corpora[corpus_format] = path
+        return self.corpora[corpus_format]
+
+    def workload_path(self, name):
+        ''' Return the path of a query workload, written on first use '''
+        if name not in self.workloads:
+            path = self.path("queries-%s.txt" % name)
+            write_queries(WORKLOADS[name](self.corpus, self.num_queries, self.seed), path)
+            self.workloads[name] = path
+        return self.workloads[name]
+
+    def run_config(self, config):
+        ''' index the corpus with an engine and run its workloads, Return the report of the engine '''
+        name, engine, corpus_format, index_options, search_options, workloads = config
+        engine_dir = os.path.join(ROOT, engine)
+        slug = name.replace(" ", "").replace("-", "_")
+        dict_file, postings_file = self.path(slug + ".dict"), self.path(slug + ".postings")
+
+        seconds = run(engine_dir, "index.py", ["-i", self.corpus_path(corpus_format),
+                                               "-d", dict_file, "-p", postings_file] + index_options)
+        dict_bytes, postings_bytes = os.path.getsize(dict_file), os.path.getsize(postings_file)
+        report = {"index": {"seconds": round(seconds, 3),
+                            "docs_per_sec": round(self.corpus.num_docs / seconds, 1),
+                            "dictionary_bytes": dict_bytes, "postings_bytes": postings_bytes,
+                            "index_bytes": dict_bytes + postings_bytes},
+                  "workloads": dict()}
+
+        for workload in workloads:
+            queries_file = self.workload_path(workload)
+            results_file = self.path("%s-%s.out" % (slug, workload))
+            options = ["-d", dict_file, "-p", postings_file, "-o", results_file] + search_options
+            if engine == "HW4":
+                with open(queries_file, encoding="utf8") as q_in:
+                    queries = [line.rstrip("\n") for line in q_in][:MAX_RUNS]
+                paths = write_query_files(queries, self.path("%s-%s" % (slug, workload)))
+                latencies = [run(engine_dir, "search.py", ["-q", path] + options) for path in paths]
+                seconds = sum(latencies)
+            else:
+                seconds = run(engine_dir, "search.py", ["-q", queries_file] + options)
+                latency_file = self.path("%s-%s.latency.json" % (slug, workload))
+                run(engine_dir, PROBE, [engine, dict_file, postings_file, queries_file,
+                                        latency_file] + search_options)
+                with open(latency_file) as latency_in:
+                    latencies = json.load(latency_in)
+            report["workloads"][workload] = {
+                "queries": len(latencies), "seconds": round(seconds, 3),
+                "queries_per_sec": round(len(latencies) / seconds, 1),
+                "latency_ms": latency_stats(latencies)}
+        return report
+
+    def run(self, engines):
+        ''' Return the report of the engines (names of CONFIGS, e.g. "HW3" also runs "HW3 -x") '''
+        os.makedirs(self.work_dir, exist_ok=True)
+        report = {"corpus": self.corpus.stats(), "queries": self.num_queries, "engines": dict()}
+        for config in CONFIGS:
+            if config[1] in engines:
+                print("benchmarking %s..." % config[0], file=sys.stderr)
+                try:
+                    report["engines"][config[0]] = self.run_config(config)
+                except subprocess.CalledProcessError as error:  # e.g. missing NLTK data
+                    report["engines"][config[0]] = {"error": str(error)}
+        return report
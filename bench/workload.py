@@ -0,0 +1,102 @@
+'''
+Query workloads over a SyntheticCorpus, as lists of query lines:
+    boolean_queries()   := HW2 Boolean queries of 2 to 4 terms, with AND,
+                           OR, NOT and parentheses
+    free_text_queries() := 2 to 6 words (HW3, HW4)
+    phrasal_queries()   := 2 or 3 consecutive words of a sentence of a
+                           document, so that every phrase occurs (HW3 -x)
+    legal_queries()     := HW4 queries: free text, a "quoted phrase", or
+                           phrases and words joined by AND
+
+The query terms are drawn from the Zipf distribution of the corpus, like
+the words of the documents.
+'''
+import os
+import random
+
+OPERATORS = ["AND", "OR"]
+
+
+def boolean_expression(corpus, rng, terms):
+    ''' Return a random Boolean expression of the given number of terms '''
+    if terms == 1:
+        word = corpus.words(1, rng)[0]
+        return "NOT " + word if rng.random() < 0.2 else word
+    left = rng.randint(1, terms - 1)
+    expression = "%s %s %s" % (boolean_expression(corpus, rng, left), rng.choice(OPERATORS),
+                               boolean_expression(corpus, rng, terms - left))
+    if rng.random() < 0.1:
+        return "NOT (%s)" % expression
+    return "(%s)" % expression
+
+
+def boolean_queries(corpus, count, seed=0):
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        expression = boolean_expression(corpus, rng, rng.randint(2, 4))
+        if expression.startswith("(") and expression.endswith(")"):
+            expression = expression[1:-1]
+        queries.append(expression)
+    return queries
+
+
+def free_text_queries(corpus, count, seed=0):
+    rng = random.Random(seed)
+    return [" ".join(corpus.words(rng.randint(2, 6), rng)) for _ in range(count)]
+
+
+def phrase(corpus, rng):
+    ''' Return 2 or 3 consecutive words of a sentence of a random document '''
+    sentences = corpus.sentences(rng.randint(1, corpus.num_docs))
+    sentence = rng.choice([s for s in sentences if len(s) >= 3])
+    length = rng.randint(2, 3)
+    start = rng.randint(0, len(sentence) - length)
+    return " ".join(sentence[start:start + length])
+
+
+def phrasal_queries(corpus, count, seed=0):
+    rng = random.Random(seed)
+    return [phrase(corpus, rng) for _ in range(count)]
+
+
+def legal_queries(corpus, count, seed=0):
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.4:
+            queries.append(" ".join(corpus.words(rng.randint(2, 6), rng)))
+        elif kind < 0.7:
+            queries.append('"%s"' % phrase(corpus, rng))
+        else:
+            parts = ['"%s"' % phrase(corpus, rng), corpus.words(1, rng)[0]]
+            rng.shuffle(parts)
+            queries.append(" AND ".join(parts))
+    return queries
+
+
+WORKLOADS = {
+    "boolean": boolean_queries,
+    "free_text": free_text_queries,
+    "phrasal": phrasal_queries,
+    "legal": legal_queries,
+}
+
+
+def write_queries(queries, path):
+    ''' write a workload to a file, one query a line '''
+    with open(path, mode="w", encoding="utf8") as out:
+        for query in queries:
+            print(query, file=out)
+
+
+def write_query_files(queries, out_dir):
+    ''' write every query of a workload to its own file q1.txt, ... (HW4), Return their paths '''
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for i, query in enumerate(queries, 1):
+        path = os.path.join(out_dir, "q%d.txt" % i)
+        write_queries([query], path)
+        paths.append(path)
+    return paths